@@ -47,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'weather_search.timing.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,6 +76,25 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'meteo.wsgi.application'
 
+ASGI_APPLICATION = 'meteo.asgi.application'
+
+# Асинхронные версии search_city и autocomplete_city_geo (для запуска под ASGI-сервером)
+ASYNC_VIEWS = config('ASYNC_VIEWS', default=False, cast=bool)
+
+# Потоковая отдача страницы поиска: шапка, форма и история уходят до геокодирования и запроса прогноза
+SEARCH_STREAMING = config('SEARCH_STREAMING', default=False, cast=bool)
+
+# Упреждающая загрузка прогноза для первых TOP_N подсказок автодополнения и подсвеченного варианта,
+# не больше CONCURRENCY фоновых запросов к Open-Meteo одновременно
+FORECAST_PREFETCH = {
+    'ENABLED': config('FORECAST_PREFETCH', default=False, cast=bool),
+    'TOP_N': config('FORECAST_PREFETCH_TOP_N', default=2, cast=int),
+    'CONCURRENCY': config('FORECAST_PREFETCH_CONCURRENCY', default=2, cast=int),
+}
+
+# Сколько первых дней почасового прогноза выводится сразу, остальные подгружаются фрагментами (0 - все сразу)
+FORECAST_INLINE_DAYS = config('FORECAST_INLINE_DAYS', default=2, cast=int)
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -90,6 +110,43 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Для нескольких воркеров кэш прогнозов стоит вынести в общий backend (redis, memcached),
+# переопределив FORECAST_CACHE_BACKEND и FORECAST_CACHE_LOCATION
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'forecast': {
+        'BACKEND': config('FORECAST_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('FORECAST_CACHE_LOCATION', default='forecast'),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('FORECAST_CACHE_MAX_ENTRIES', default=1000, cast=int),
+        },
+    },
+    'sessions': {
+        'BACKEND': config('SESSION_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('SESSION_CACHE_LOCATION', default='sessions'),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('SESSION_CACHE_MAX_ENTRIES', default=10000, cast=int),
+        },
+    },
+}
+
+
+# Sessions
+# https://docs.djangoproject.com/en/5.2/topics/http/sessions/
+# История поиска неавторизованных пользователей хранится в сессии. По умолчанию сессии в БД;
+# без записи в БД на каждый поиск: SESSION_ENGINE=django.contrib.sessions.backends.cache (кэш 'sessions',
+# для нескольких воркеров - общий backend) или django.contrib.sessions.backends.signed_cookies (история в cookie).
+# Истекшие сессии в БД удаляются командой purge_sessions
+
+SESSION_ENGINE = config('SESSION_ENGINE', default='django.contrib.sessions.backends.db')
+SESSION_CACHE_ALIAS = 'sessions'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -130,3 +187,145 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Geocoding cache
+# Результаты геокодирования хранятся в памяти процесса, промахи ("Город не найден") - меньшее время
+
+GEOCODING_CACHE = {
+    'MAX_SIZE': config('GEOCODING_CACHE_MAX_SIZE', default=2048, cast=int),
+    'TTL': config('GEOCODING_CACHE_TTL', default=60 * 60 * 24, cast=int),
+    'NEGATIVE_TTL': config('GEOCODING_CACHE_NEGATIVE_TTL', default=60 * 10, cast=int),
+    # Сколько устаревшая запись еще может использоваться, если геосервис недоступен
+    'STALE_TTL': config('GEOCODING_CACHE_STALE_TTL', default=60 * 60 * 24 * 7, cast=int),
+}
+
+
+# Локальный справочник городов (GeoNames) для автодополнения, загружается командой load_gazetteer.
+# Если в справочнике ничего не найдено, запрос уходит в Open-Meteo Geocoding API
+
+GAZETTEER = {
+    'ENABLED': config('GAZETTEER_ENABLED', default=True, cast=bool),
+}
+
+
+# Forecast cache
+# Прогнозы Open-Meteo обновляются раз в час, записи живут до ближайшего обновления
+
+FORECAST_CACHE = {
+    'ALIAS': 'forecast',
+    # Кол-во знаков после запятой при округлении координат (0.01° ~ 1 км, мельче сетки моделей)
+    'GRID_PRECISION': config('FORECAST_CACHE_GRID_PRECISION', default=2, cast=int),
+    'REFRESH_PERIOD': config('FORECAST_CACHE_REFRESH_PERIOD', default=60 * 60, cast=int),
+    # Задержка публикации нового прогноза относительно начала часа
+    'REFRESH_DELAY': config('FORECAST_CACHE_REFRESH_DELAY', default=60 * 5, cast=int),
+    # Устаревший прогноз хранится еще STALE_TTL секунд и показывается (с пометкой), пока Open-Meteo недоступен
+    # или отвечает дольше LATENCY_BUDGET секунд; обновление при этом продолжается в фоне
+    'STALE_TTL': config('FORECAST_CACHE_STALE_TTL', default=60 * 60 * 6, cast=int),
+    'LATENCY_BUDGET': config('FORECAST_CACHE_LATENCY_BUDGET', default=1.5, cast=float),
+    'REFRESH_WORKERS': config('FORECAST_CACHE_REFRESH_WORKERS', default=4, cast=int),
+    # Ошибка запроса прогноза без устаревшей копии запоминается на ERROR_TTL секунд
+    'ERROR_TTL': config('FORECAST_CACHE_ERROR_TTL', default=15, cast=int),
+    # Максимум точек в одном запросе прогноза для нескольких городов (ограничение длины URL)
+    'MAX_BATCH': config('FORECAST_CACHE_MAX_BATCH', default=50, cast=int),
+}
+
+
+# Forecast prewarm
+# Прогрев кэша прогнозов для популярных городов (manage.py prewarm_forecasts). Процесс прогрева должен использовать
+# тот же кэш, что и веб-воркеры, т.е. общий бэкенд FORECAST_CACHE_BACKEND (например, Redis или файловый кэш)
+
+PREWARM = {
+    'TOP_N': config('PREWARM_TOP_N', default=50, cast=int),
+    'WINDOW_DAYS': config('PREWARM_WINDOW_DAYS', default=7, cast=int),
+    # Сколько самых частых значений forecast_days прогревать для каждого города
+    'DAYS_PER_CITY': config('PREWARM_DAYS_PER_CITY', default=2, cast=int),
+    # Одновременных запросов к Open-Meteo и запросов в секунду
+    'CONCURRENCY': config('PREWARM_CONCURRENCY', default=2, cast=int),
+    'RATE': config('PREWARM_RATE', default=2.0, cast=float),
+    'BATCH_SIZE': config('PREWARM_BATCH_SIZE', default=20, cast=int),
+    'MAX_INTERVAL': config('PREWARM_MAX_INTERVAL', default=300, cast=float),
+}
+
+
+# Upstream HTTP clients
+# Общий пул соединений к Open-Meteo, адреса и таймауты (connect, read) в секундах для каждого endpoint.
+# Адреса можно направить на локальную заглушку Open-Meteo (manage.py openmeteo_stub) для нагрузочных тестов
+
+OPEN_METEO_GEOCODING_URL = config('OPEN_METEO_GEOCODING_URL', default='https://geocoding-api.open-meteo.com/v1/search')
+OPEN_METEO_FORECAST_URL = config('OPEN_METEO_FORECAST_URL', default='https://api.open-meteo.com/v1/forecast')
+
+UPSTREAM_HTTP = {
+    'URLS': {
+        'geocoding': OPEN_METEO_GEOCODING_URL,
+        'autocomplete': OPEN_METEO_GEOCODING_URL,
+        'forecast': OPEN_METEO_FORECAST_URL,
+    },
+    'POOL_CONNECTIONS': config('UPSTREAM_POOL_CONNECTIONS', default=10, cast=int),
+    'POOL_MAXSIZE': config('UPSTREAM_POOL_MAXSIZE', default=20, cast=int),
+    'RETRIES': config('UPSTREAM_RETRIES', default=2, cast=int),
+    'BACKOFF_FACTOR': config('UPSTREAM_BACKOFF_FACTOR', default=0.2, cast=float),
+    'BACKOFF_JITTER': config('UPSTREAM_BACKOFF_JITTER', default=0.3, cast=float),
+    'TIMEOUTS': {
+        'geocoding': (3.05, 5),
+        'autocomplete': (3.05, 3),
+        'forecast': (3.05, 10),
+    },
+    # После FAILURE_THRESHOLD ошибок подряд запросы к сервису не выполняются RECOVERY_TIMEOUT секунд
+    'CIRCUIT_BREAKER': {
+        'FAILURE_THRESHOLD': config('UPSTREAM_FAILURE_THRESHOLD', default=5, cast=int),
+        'RECOVERY_TIMEOUT': config('UPSTREAM_RECOVERY_TIMEOUT', default=30, cast=float),
+    },
+}
+
+
+# Search history write-behind
+# Записи истории поиска копятся в памяти и сохраняются пачками (bulk_create) в фоновом потоке
+
+HISTORY_WRITE_BEHIND = {
+    'ENABLED': config('HISTORY_WRITE_BEHIND', default=True, cast=bool),
+    'BATCH_SIZE': config('HISTORY_WRITE_BEHIND_BATCH_SIZE', default=100, cast=int),
+    'FLUSH_INTERVAL': config('HISTORY_WRITE_BEHIND_FLUSH_INTERVAL', default=2.0, cast=float),
+    'MAX_PENDING': config('HISTORY_WRITE_BEHIND_MAX_PENDING', default=10000, cast=int),
+}
+
+
+# Поиски неавторизованных пользователей старше DAYS дней сворачиваются в счетчики по дням и удаляются
+# (manage.py rollup_history, например раз в сутки по cron), записи удаляются пачками по BATCH_SIZE
+
+HISTORY_RETENTION = {
+    'DAYS': config('HISTORY_RETENTION_DAYS', default=30, cast=int),
+    'BATCH_SIZE': config('HISTORY_RETENTION_BATCH_SIZE', default=1000, cast=int),
+}
+
+
+# "Сейчас ищут" (/api/trending/): поиски за WINDOW секунд по интервалам BUCKET секунд,
+# в каждом интервале не больше CAPACITY городов. Счетчики хранятся в памяти процесса
+
+TRENDING = {
+    'WINDOW': config('TRENDING_WINDOW', default=60 * 60, cast=int),
+    'BUCKET': config('TRENDING_BUCKET', default=60 * 5, cast=int),
+    'CAPACITY': config('TRENDING_CAPACITY', default=100, cast=int),
+}
+
+
+# Замер времени этапов запроса: заголовок Server-Timing и гистограммы на /metrics/ (формат Prometheus).
+# Гистограммы хранятся в памяти процесса, каждый воркер отдает свои.
+# /metrics/ доступен только staff-пользователям и по заголовку "Authorization: Bearer <METRICS_TOKEN>"
+
+REQUEST_TIMING = {
+    'ENABLED': config('REQUEST_TIMING_ENABLED', default=True, cast=bool),
+    'METRICS_TOKEN': config('METRICS_TOKEN', default=''),
+    'VIEWS': (
+        'weather_search:search',
+        'weather_search:forecast_day',
+        'weather_search:compare',
+        'search_field_autocomplete:autocomplete_city',
+        'weather_api:total_search',
+        'weather_api:forecast',
+        'weather_api:forecast_compare',
+        'weather_api:trending',
+    ),
+    'DURATION_BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'QUERY_BUCKETS': (0, 1, 2, 5, 10, 20, 50),
+}
@@ -16,6 +16,7 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from weather_search.timing import metrics
 
 
 urlpatterns = [
@@ -24,4 +25,5 @@ urlpatterns = [
     path('user/', include('user_auth.urls')),
     path('api/', include('weather_api.urls')),
     path('autocomplete/', include('search_field_autocomplete.urls')),
+    path('metrics/', metrics, name='metrics'),
 ]
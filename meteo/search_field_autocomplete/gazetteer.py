@@ -0,0 +1,163 @@
+import heapq
+import threading
+from bisect import bisect_left
+
+from .models import GazetteerCity
+from .utils import is_cyrillic
+
+
+# Для коротких префиксов лучшие города считаются заранее, остальные - просмотром диапазона ключей
+PRECOMPUTED_PREFIX_LENGTH = 3
+MAX_LIMIT = 10
+
+
+def normalize_name(name):
+    return ' '.join(name.replace('ё', 'е').replace('Ё', 'Е').split()).casefold()
+
+
+class GazetteerIndex:
+    """
+    Префиксный индекс городов в памяти.
+
+    keys - отсортированный список (нормализованное название, номер города) по всем названиям
+    (основное, ASCII, кириллическое и альтернативные), поиск префикса - бинарный поиск по нему.
+    Результаты упорядочены по населению, как у Open-Meteo Geocoding API.
+    Для запросов на кириллице название, страна и регион - русские (как с language=ru у Geocoding API).
+    """
+
+    def __init__(self, cities):
+        self.cities = cities
+        self.keys = []
+        self.top_by_prefix = {}
+
+        for idx, city in enumerate(cities):
+            for name in city['names']:
+                self.keys.append((name, idx))
+        self.keys.sort()
+
+        candidates = {}
+        for name, idx in self.keys:
+            for length in range(1, min(len(name), PRECOMPUTED_PREFIX_LENGTH) + 1):
+                candidates.setdefault(name[:length], set()).add(idx)
+
+        for prefix, ids in candidates.items():
+            self.top_by_prefix[prefix] = heapq.nlargest(MAX_LIMIT, ids, key=self._population)
+
+    def _population(self, idx):
+        return self.cities[idx]['population']
+
+    def search(self, query, limit=5):
+        prefix = normalize_name(query)
+        if not prefix:
+            return []
+
+        if len(prefix) <= PRECOMPUTED_PREFIX_LENGTH:
+            ids = self.top_by_prefix.get(prefix, [])[:limit]
+        else:
+            ids = set()
+            position = bisect_left(self.keys, (prefix, -1))
+            while position < len(self.keys) and self.keys[position][0].startswith(prefix):
+                ids.add(self.keys[position][1])
+                position += 1
+            ids = heapq.nlargest(limit, ids, key=self._population)
+
+        if is_cyrillic(query):
+            return [self._as_result_ru(self.cities[idx], prefix) for idx in ids]
+        return [self._as_result(self.cities[idx]) for idx in ids]
+
+    @staticmethod
+    def _as_result(city):
+        """Город в формате ответа Open-Meteo Geocoding API"""
+
+        return {
+            'id': city['id'],
+            'name': city['name'],
+            'latitude': city['latitude'],
+            'longitude': city['longitude'],
+            'country_code': city['country_code'],
+            'country': city['country'],
+            'admin1': city['admin1'],
+            'population': city['population'],
+            'timezone': city['timezone'],
+        }
+
+    @classmethod
+    def _as_result_ru(cls, city, prefix):
+        """
+        Город для запроса на кириллице.
+
+        Без русского названия из alternateNamesV2 берется кириллическое альтернативное название,
+        совпавшее с запросом (а не первое кириллическое: среди них есть украинские, болгарские и т.п.).
+        """
+        name = city['name_ru'] or next(
+            (original for normalized, original in city['cyrillic_names'] if normalized.startswith(prefix)),
+            city['name'],
+        )
+        return {
+            **cls._as_result(city),
+            'name': name,
+            'country': city['country_ru'] or city['country'],
+            'admin1': city['admin1_ru'] or city['admin1'],
+        }
+
+    def __len__(self):
+        return len(self.cities)
+
+    @classmethod
+    def from_db(cls):
+        cities = []
+        rows = GazetteerCity.objects.values_list(
+            'geoname_id', 'name', 'ascii_name', 'name_ru', 'alternate_names', 'latitude', 'longitude',
+            'country_code', 'country', 'admin1', 'country_ru', 'admin1_ru', 'population', 'timezone',
+        )
+        for (geoname_id, name, ascii_name, name_ru, alternate_names, latitude, longitude,
+             country_code, country, admin1, country_ru, admin1_ru, population, timezone) in rows.iterator(chunk_size=5000):
+            alternate_names = alternate_names.split(',')
+            names = {name, ascii_name, name_ru, *alternate_names}
+            cities.append({
+                'id': geoname_id,
+                'name': name,
+                'name_ru': name_ru,
+                'names': {normalize_name(n) for n in names if n.strip()},
+                # Нужны только для выбора названия, если русского нет
+                'cyrillic_names': () if name_ru else tuple(
+                    (normalize_name(n), n) for n in alternate_names if is_cyrillic(n)
+                ),
+                'latitude': latitude,
+                'longitude': longitude,
+                'country_code': country_code,
+                'country': country,
+                'admin1': admin1,
+                'country_ru': country_ru,
+                'admin1_ru': admin1_ru,
+                'population': population,
+                'timezone': timezone,
+            })
+        return cls(cities)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_gazetteer_index():
+    """Индекс строится из БД при первом обращении и живет до перезапуска процесса (или reset_gazetteer_index)"""
+
+    global _index
+
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = GazetteerIndex.from_db()
+    return _index
+
+
+def reset_gazetteer_index():
+    global _index
+
+    with _index_lock:
+        _index = None
+
+
+def search_gazetteer(query, limit=5):
+    return get_gazetteer_index().search(query, limit=limit)
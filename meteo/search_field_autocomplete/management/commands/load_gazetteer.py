@@ -0,0 +1,140 @@
+import csv
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from search_field_autocomplete.gazetteer import reset_gazetteer_index
+from search_field_autocomplete.models import GazetteerCity
+
+
+# Колонки выгрузки GeoNames (cities500.txt, cities15000.txt и т.п.)
+GEONAME_ID, NAME, ASCII_NAME, ALTERNATE_NAMES, LATITUDE, LONGITUDE = 0, 1, 2, 3, 4, 5
+COUNTRY_CODE, ADMIN1_CODE, POPULATION, TIMEZONE = 8, 10, 14, 17
+
+# Колонки alternateNamesV2.txt: geonameid, язык, название и признаки названия
+ALT_GEONAME_ID, ALT_LANGUAGE, ALT_NAME, ALT_PREFERRED, ALT_SHORT, ALT_COLLOQUIAL, ALT_HISTORIC = 1, 2, 3, 4, 5, 6, 7
+
+# geonameid страны в countryInfo.txt и региона в admin1CodesASCII.txt
+COUNTRY_GEONAME_ID, ADMIN1_GEONAME_ID = 16, 3
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает справочник городов GeoNames для автодополнения. '
+        'Таблица справочника заменяется целиком.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('cities', help='Файл городов GeoNames, например cities15000.txt')
+        parser.add_argument('--countries', help='countryInfo.txt - названия стран')
+        parser.add_argument('--admin1', help='admin1CodesASCII.txt - названия регионов')
+        parser.add_argument(
+            '--alternate-names',
+            help='alternateNamesV2.txt (или alternatenames/<страна>.txt) - русские названия городов, стран и регионов',
+        )
+        parser.add_argument('--min-population', type=int, default=0, help='Пропускать города с меньшим населением')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Размер пачки при записи в БД')
+
+    def handle(self, *args, **options):
+        countries = self._read_names(options['countries'], key_column=0, name_column=4, id_column=COUNTRY_GEONAME_ID)
+        admin1 = self._read_names(options['admin1'], key_column=0, name_column=1, id_column=ADMIN1_GEONAME_ID)
+        names_ru = self._read_localized_names(options['alternate_names'], language='ru')
+        min_population = options['min_population']
+
+        if not options['alternate_names']:
+            self.stderr.write(self.style.WARNING(
+                'Без --alternate-names у городов нет русских названий: для запросов на кириллице '
+                'название берется из альтернативных, а страна и регион - на английском'
+            ))
+
+        try:
+            with open(options['cities'], encoding='utf-8', newline='') as f:
+                cities = [
+                    city for city in (self._parse_row(row, countries, admin1, names_ru) for row in self._rows(f))
+                    if city.population >= min_population
+                ]
+        except OSError as e:
+            raise CommandError(f'Не удалось прочитать файл городов: {e}')
+
+        with transaction.atomic():
+            GazetteerCity.objects.all().delete()
+            GazetteerCity.objects.bulk_create(cities, batch_size=options['batch_size'])
+
+        reset_gazetteer_index()
+
+        self.stdout.write(self.style.SUCCESS(f'Справочник загружен: {len(cities)} городов'))
+
+    @staticmethod
+    def _rows(f):
+        csv.field_size_limit(sys.maxsize)
+        for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+            if row and not row[0].startswith('#'):
+                yield row
+
+    def _read_names(self, path, key_column, name_column, id_column):
+        """{код: (название, geonameid)}, geonameid нужен для русского названия из alternateNamesV2"""
+
+        if not path:
+            return {}
+
+        try:
+            with open(path, encoding='utf-8', newline='') as f:
+                return {
+                    row[key_column]: (row[name_column], row[id_column] if len(row) > id_column else '')
+                    for row in self._rows(f)
+                }
+        except OSError as e:
+            raise CommandError(f'Не удалось прочитать файл {path}: {e}')
+
+    def _read_localized_names(self, path, language):
+        """
+        {geonameid: название на языке language} из alternateNamesV2.txt.
+
+        Предпочтительное название (isPreferredName) важнее остальных, затем полное важнее краткого.
+        Разговорные и исторические названия пропускаются.
+        """
+        if not path:
+            return {}
+
+        names = {}
+        try:
+            with open(path, encoding='utf-8', newline='') as f:
+                for row in self._rows(f):
+                    if len(row) <= ALT_HISTORIC or row[ALT_LANGUAGE] != language:
+                        continue
+                    if row[ALT_COLLOQUIAL] == '1' or row[ALT_HISTORIC] == '1':
+                        continue
+
+                    rank = (row[ALT_PREFERRED] == '1', row[ALT_SHORT] != '1')
+                    current = names.get(row[ALT_GEONAME_ID])
+                    if current is None or rank > current[0]:
+                        names[row[ALT_GEONAME_ID]] = (rank, row[ALT_NAME])
+        except OSError as e:
+            raise CommandError(f'Не удалось прочитать файл {path}: {e}')
+
+        return {geoname_id: name for geoname_id, (_, name) in names.items()}
+
+    @staticmethod
+    def _parse_row(row, countries, admin1, names_ru):
+        alternate_names = [name for name in row[ALTERNATE_NAMES].split(',') if name]
+        country_code = row[COUNTRY_CODE]
+        country, country_id = countries.get(country_code, ('', ''))
+        admin1_name, admin1_id = admin1.get(f'{country_code}.{row[ADMIN1_CODE]}', ('', ''))
+
+        return GazetteerCity(
+            geoname_id=int(row[GEONAME_ID]),
+            name=row[NAME],
+            ascii_name=row[ASCII_NAME],
+            name_ru=names_ru.get(row[GEONAME_ID], ''),
+            alternate_names=','.join(alternate_names),
+            latitude=float(row[LATITUDE]),
+            longitude=float(row[LONGITUDE]),
+            country_code=country_code,
+            country=country,
+            admin1=admin1_name,
+            country_ru=names_ru.get(country_id, ''),
+            admin1_ru=names_ru.get(admin1_id, ''),
+            population=int(row[POPULATION] or 0),
+            timezone=row[TIMEZONE],
+        )
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GazetteerCity',
+            fields=[
+                ('geoname_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=200)),
+                ('ascii_name', models.CharField(max_length=200)),
+                ('name_ru', models.CharField(blank=True, max_length=200)),
+                ('alternate_names', models.TextField(blank=True)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('country_code', models.CharField(max_length=10)),
+                ('country', models.CharField(blank=True, max_length=100)),
+                ('admin1', models.CharField(blank=True, max_length=100)),
+                ('population', models.BigIntegerField(default=0)),
+                ('timezone', models.CharField(blank=True, max_length=64)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search_field_autocomplete', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gazetteercity',
+            name='admin1_ru',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='gazetteercity',
+            name='country_ru',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
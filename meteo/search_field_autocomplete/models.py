@@ -1,3 +1,23 @@
 from django.db import models
 
-# Create your models here.
+
+class GazetteerCity(models.Model):
+    """Город из локального справочника (выгрузка GeoNames), используется автодополнением"""
+
+    geoname_id = models.IntegerField(primary_key=True)
+    name = models.CharField(max_length=200)
+    ascii_name = models.CharField(max_length=200)
+    # Русское название (alternateNamesV2 GeoNames, isolanguage='ru'), пустое, если оно не загружено
+    name_ru = models.CharField(max_length=200, blank=True)
+    # Альтернативные названия на латинице и кириллице через запятую
+    alternate_names = models.TextField(blank=True)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    country_code = models.CharField(max_length=10)
+    country = models.CharField(max_length=100, blank=True)
+    admin1 = models.CharField(max_length=100, blank=True)
+    # Названия страны и региона на русском (для запросов на кириллице, как language=ru у Geocoding API)
+    country_ru = models.CharField(max_length=100, blank=True)
+    admin1_ru = models.CharField(max_length=100, blank=True)
+    population = models.BigIntegerField(default=0)
+    timezone = models.CharField(max_length=64, blank=True)
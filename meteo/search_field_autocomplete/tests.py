@@ -1,3 +1,323 @@
-from django.test import TestCase
+import os
+from io import StringIO
+import tempfile
+import time
 
-# Create your tests here.
+import niquests
+from django.core import signing
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from unittest.mock import patch, MagicMock
+from weather_search.prefetch import PREFETCH_TOKEN_MAX_AGE
+from weather_search.upstream import breaker_for, reset_breakers
+from .gazetteer import GazetteerIndex, reset_gazetteer_index, normalize_name
+from .models import GazetteerCity
+from .views import afetch_autocomplete
+
+
+CITIES = [
+    GazetteerCity(geoname_id=524901, name='Moscow', ascii_name='Moscow', name_ru='Москва',
+                  alternate_names='Moskva,Москва', latitude=55.75, longitude=37.62, country_code='RU',
+                  country='Russia', admin1='Moscow', country_ru='Россия', admin1_ru='Москва',
+                  population=10381222, timezone='Europe/Moscow'),
+    GazetteerCity(geoname_id=4400, name='Mosul', ascii_name='Mosul', name_ru='Мосул',
+                  alternate_names='Мосул', latitude=36.34, longitude=43.13, country_code='IQ',
+                  country='Iraq', admin1='Nineveh', population=1739800, timezone='Asia/Baghdad'),
+    GazetteerCity(geoname_id=5601538, name='Moscow', ascii_name='Moscow', name_ru='',
+                  alternate_names='', latitude=46.73, longitude=-117.0, country_code='US',
+                  country='United States', admin1='Idaho', population=25435, timezone='America/Los_Angeles'),
+    GazetteerCity(geoname_id=468902, name='Yoshkar-Ola', ascii_name='Yoshkar-Ola', name_ru='Йошкар-Ола',
+                  alternate_names='Йошкар-Ола,Йошкар Ола', latitude=56.63, longitude=47.89, country_code='RU',
+                  country='Russia', admin1='Mari El', population=248688, timezone='Europe/Moscow'),
+    GazetteerCity(geoname_id=472757, name='Orel', ascii_name='Orel', name_ru='Орёл',
+                  alternate_names='Oryol,Орёл', latitude=52.97, longitude=36.06, country_code='RU',
+                  country='Russia', admin1='Oryol', population=317854, timezone='Europe/Moscow'),
+    GazetteerCity(geoname_id=703448, name='Kyiv', ascii_name='Kyiv', name_ru='',
+                  alternate_names='Kiev,Київ,Киев', latitude=50.45, longitude=30.52, country_code='UA',
+                  country='Ukraine', admin1='Kyiv City', population=2797553, timezone='Europe/Kyiv'),
+]
+
+
+class GazetteerIndexTest(TestCase):
+    def setUp(self):
+        GazetteerCity.objects.bulk_create(CITIES)
+        self.index = GazetteerIndex.from_db()
+
+    def test_normalize_name(self):
+        self.assertEqual(normalize_name('  Орёл  Город '), 'орел город')
+        self.assertEqual(normalize_name('MOSCOW'), 'moscow')
+
+    def test_prefix_results_ordered_by_population(self):
+        names = [(city['name'], city['country_code']) for city in self.index.search('mos')]
+
+        self.assertEqual(names, [('Moscow', 'RU'), ('Mosul', 'IQ'), ('Moscow', 'US')])
+
+    def test_long_prefix_uses_key_range(self):
+        results = self.index.search('Mosc')
+
+        self.assertEqual([city['id'] for city in results], [524901, 5601538])
+
+    def test_cyrillic_query_returns_russian_names(self):
+        results = self.index.search('мос')
+
+        self.assertEqual([city['name'] for city in results], ['Москва', 'Мосул'])
+
+    def test_cyrillic_query_returns_russian_country_and_region(self):
+        city = self.index.search('Моск')[0]
+
+        self.assertEqual((city['name'], city['country'], city['admin1']), ('Москва', 'Россия', 'Москва'))
+        self.assertEqual(self.index.search('Moscow')[0]['country'], 'Russia')
+
+    def test_without_russian_name_uses_alternate_matching_query(self):
+        self.assertEqual(self.index.search('Кие')[0]['name'], 'Киев')
+        self.assertEqual(self.index.search('Киї')[0]['name'], 'Київ')
+        # Русских названий страны и региона нет - как в справочнике
+        self.assertEqual(self.index.search('Кие')[0]['country'], 'Ukraine')
+
+    def test_yo_and_whitespace_are_normalized(self):
+        self.assertEqual(self.index.search('Орел')[0]['name'], 'Орёл')
+        self.assertEqual(self.index.search('йошкар  ола')[0]['id'], 468902)
+
+    def test_limit(self):
+        self.assertEqual(len(self.index.search('m', limit=2)), 2)
+        self.assertEqual(len(self.index.search('mosc', limit=1)), 1)
+
+    def test_result_has_geocoding_api_shape(self):
+        city = self.index.search('Moscow')[0]
+
+        self.assertEqual(city, {
+            'id': 524901, 'name': 'Moscow', 'latitude': 55.75, 'longitude': 37.62, 'country_code': 'RU',
+            'country': 'Russia', 'admin1': 'Moscow', 'population': 10381222, 'timezone': 'Europe/Moscow',
+        })
+
+    def test_no_match(self):
+        self.assertEqual(self.index.search('zzz'), [])
+        self.assertEqual(self.index.search('   '), [])
+
+
+class AutocompleteViewTest(TestCase):
+    def setUp(self):
+        reset_gazetteer_index()
+        self.addCleanup(reset_gazetteer_index)
+        GazetteerCity.objects.bulk_create(CITIES)
+
+    @patch('weather_search.upstream.niquests.Session.get')
+    def test_answer_from_gazetteer(self, mock_get):
+        response = self.client.get(reverse('search_field_autocomplete:autocomplete_city'), {'q': 'Моск'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['name'], 'Москва')
+        mock_get.assert_not_called()
+
+    @patch('weather_search.upstream.niquests.Session.get')
+    def test_fallback_to_geocoding_api(self, mock_get):
+        mock_response = MagicMock()
+        mock_response.json.return_value = {'results': [{'name': 'Tver', 'population': 1}, {'name': 'Tvaran', 'population': 5}]}
+        mock_get.return_value = mock_response
+
+        response = self.client.get(reverse('search_field_autocomplete:autocomplete_city'), {'q': 'Tv'})
+
+        self.assertEqual([city['name'] for city in response.json()], ['Tvaran', 'Tver'])
+        mock_get.assert_called_once()
+
+    @override_settings(GAZETTEER={'ENABLED': False})
+    @patch('weather_search.upstream.niquests.Session.get')
+    def test_gazetteer_disabled(self, mock_get):
+        mock_response = MagicMock()
+        mock_response.json.return_value = {'results': []}
+        mock_get.return_value = mock_response
+
+        self.client.get(reverse('search_field_autocomplete:autocomplete_city'), {'q': 'Моск'})
+
+        mock_get.assert_called_once()
+
+
+@override_settings(GAZETTEER={'ENABLED': False})
+class AutocompleteUpstreamFailureTest(TestCase):
+    def setUp(self):
+        reset_breakers()
+        self.addCleanup(reset_breakers)
+
+    def _open(self, service):
+        breaker = breaker_for(service)
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+
+    @patch('weather_search.upstream.niquests.Session.get')
+    def test_upstream_error_returns_empty_list(self, mock_get):
+        mock_get.return_value.raise_for_status.side_effect = niquests.HTTPError('503 Service Unavailable')
+
+        response = self.client.get(reverse('search_field_autocomplete:autocomplete_city'), {'q': 'Tv'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+        self.assertIsInstance(breaker_for('autocomplete').last_error, niquests.HTTPError)
+
+    @patch('weather_search.upstream.niquests.Session.get', side_effect=niquests.ConnectionError('down'))
+    def test_connection_error_returns_empty_list(self, mock_get):
+        response = self.client.get(reverse('search_field_autocomplete:autocomplete_city'), {'q': 'Tv'})
+
+        self.assertEqual(response.json(), [])
+
+    @patch('weather_search.upstream.niquests.Session.get')
+    def test_open_circuit_skips_upstream(self, mock_get):
+        for service in ('autocomplete', 'geocoding'):
+            with self.subTest(service=service):
+                reset_breakers()
+                self._open(service)
+
+                response = self.client.get(reverse('search_field_autocomplete:autocomplete_city'), {'q': 'Tv'})
+
+                self.assertEqual(response.json(), [])
+                mock_get.assert_not_called()
+
+    @patch('weather_search.upstream.niquests.AsyncSession.get')
+    async def test_async_open_circuit_and_upstream_error(self, mock_get):
+        mock_get.return_value = MagicMock()
+        mock_get.return_value.raise_for_status.side_effect = niquests.HTTPError('503 Service Unavailable')
+
+        self.assertEqual(await afetch_autocomplete('Tv'), [])
+        mock_get.assert_awaited_once()
+
+        self._open('autocomplete')
+        self.assertEqual(await afetch_autocomplete('Tv'), [])
+        mock_get.assert_awaited_once()
+
+
+class LoadGazetteerCommandTest(TestCase):
+    def _write(self, content):
+        fd, path = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_load(self):
+        GazetteerCity.objects.create(geoname_id=1, name='Old', ascii_name='Old', latitude=0, longitude=0,
+                                     country_code='XX')
+        cities = self._write(
+            '524901\tMoscow\tMoscow\tMoskva,Москва,Moscou\t55.75222\t37.61556\tP\tPPLC\tRU\t\t48\t\t\t\t'
+            '10381222\t\t144\tEurope/Moscow\t2022-12-10\n'
+            '5601538\tMoscow\tMoscow\t\t46.73239\t-117.00017\tP\tPPLA2\tUS\t\tID\t057\t\t\t'
+            '25435\t786\t779\tAmerica/Los_Angeles\t2011-05-14\n'
+        )
+        countries = self._write('# ISO\tISO3\tISO-Numeric\tfips\tCountry\n'
+                                'RU\tRUS\t643\tRS\tRussia' + '\t' * 12 + '2017370\n'
+                                'US\tUSA\t840\tUS\tUnited States' + '\t' * 12 + '6252001\n')
+        admin1 = self._write('RU.48\tMoscow\tMoscow\t524894\nUS.ID\tIdaho\tIdaho\t5596512\n')
+        alternate_names = self._write(
+            '1\t524901\tuk\tМосква\t\t\t\t\t\t\n'
+            '2\t524901\tru\tМск\t\t1\t\t\t\t\n'
+            '3\t524901\tru\tМосква\t1\t\t\t\t\t\n'
+            '4\t2017370\tru\tРоссийская Федерация\t\t\t\t\t\t\n'
+            '5\t2017370\tru\tРоссия\t1\t\t\t\t\t\n'
+            '6\t524894\tru\tМосква\t\t\t\t\t\t\n'
+            '7\t5601538\tru\tМосков\t\t\t\t1\t\t\n'
+        )
+
+        call_command('load_gazetteer', cities, countries=countries, admin1=admin1, alternate_names=alternate_names,
+                     min_population=1000, stdout=StringIO())
+
+        self.assertEqual(GazetteerCity.objects.count(), 2)
+        moscow = GazetteerCity.objects.get(geoname_id=524901)
+        self.assertEqual(moscow.name_ru, 'Москва')
+        self.assertEqual(moscow.country, 'Russia')
+        self.assertEqual(moscow.admin1, 'Moscow')
+        self.assertEqual((moscow.country_ru, moscow.admin1_ru), ('Россия', 'Москва'))
+        self.assertEqual(moscow.population, 10381222)
+        self.assertEqual(moscow.timezone, 'Europe/Moscow')
+        idaho_moscow = GazetteerCity.objects.get(geoname_id=5601538)
+        self.assertEqual(idaho_moscow.admin1, 'Idaho')
+        # Историческое название пропускается
+        self.assertEqual(idaho_moscow.name_ru, '')
+
+    def test_load_without_alternate_names(self):
+        cities = self._write(
+            '703448\tKyiv\tKyiv\tKiev,Київ,Киев\t50.45466\t30.5238\tP\tPPLC\tUA\t\t12\t\t\t\t'
+            '2797553\t\t187\tEurope/Kyiv\t2024-01-01\n'
+        )
+        stderr = StringIO()
+
+        call_command('load_gazetteer', cities, stdout=StringIO(), stderr=stderr)
+
+        # Русское название не угадывается по первому кириллическому (здесь оно украинское)
+        self.assertEqual(GazetteerCity.objects.get(geoname_id=703448).name_ru, '')
+        self.assertIn('--alternate-names', stderr.getvalue())
+
+    def test_min_population(self):
+        cities = self._write(
+            '5601538\tMoscow\tMoscow\t\t46.73239\t-117.00017\tP\tPPLA2\tUS\t\tID\t057\t\t\t'
+            '25435\t786\t779\tAmerica/Los_Angeles\t2011-05-14\n'
+        )
+
+        call_command('load_gazetteer', cities, min_population=100000, stdout=StringIO(), stderr=StringIO())
+
+        self.assertFalse(GazetteerCity.objects.exists())
+
+
+class PrefetchSignalTest(TestCase):
+    def setUp(self):
+        reset_gazetteer_index()
+        self.addCleanup(reset_gazetteer_index)
+        GazetteerCity.objects.bulk_create(CITIES)
+
+    @patch('search_field_autocomplete.views.prefetch_forecasts')
+    def test_autocomplete_results_are_prefetched(self, mock_prefetch):
+        response = self.client.get(reverse('search_field_autocomplete:autocomplete_city'), {'q': 'mos', 'forecast_days': '5'})
+
+        mock_prefetch.assert_called_once_with(response.json(), '5')
+
+    @override_settings(FORECAST_PREFETCH={'ENABLED': True, 'TOP_N': 2, 'CONCURRENCY': 2})
+    @patch('search_field_autocomplete.views.prefetch_forecasts')
+    def test_highlighted_candidate(self, mock_prefetch):
+        candidates = self.client.get(reverse('search_field_autocomplete:autocomplete_city'), {'q': 'mos'}).json()
+        mock_prefetch.reset_mock()
+
+        response = self.client.post(reverse('search_field_autocomplete:prefetch_forecast'), {
+            'prefetch_token': candidates[0]['prefetch_token'], 'forecast_days': 2,
+        })
+
+        self.assertEqual(response.status_code, 204)
+        mock_prefetch.assert_called_once_with([{'latitude': 55.75, 'longitude': 37.62}], '2')
+
+    @patch('search_field_autocomplete.views.prefetch_forecasts')
+    def test_highlighted_candidate_requires_served_token(self, mock_prefetch):
+        url = reverse('search_field_autocomplete:prefetch_forecast')
+        forged = signing.TimestampSigner(salt='other').sign('55.75,37.62')
+        for params in ({}, {'latitude': 55.75, 'longitude': 37.62}, {'prefetch_token': '55.75,37.62'},
+                       {'prefetch_token': forged}):
+            with self.subTest(params=params):
+                response = self.client.post(url, params)
+                self.assertEqual(response.status_code, 400)
+
+        mock_prefetch.assert_not_called()
+
+    @override_settings(FORECAST_PREFETCH={'ENABLED': True, 'TOP_N': 2, 'CONCURRENCY': 2})
+    @patch('search_field_autocomplete.views.prefetch_forecasts')
+    def test_highlighted_candidate_token_expires(self, mock_prefetch):
+        candidates = self.client.get(reverse('search_field_autocomplete:autocomplete_city'), {'q': 'mos'}).json()
+        mock_prefetch.reset_mock()
+
+        with patch('django.core.signing.time.time', return_value=time.time() + PREFETCH_TOKEN_MAX_AGE + 1):
+            response = self.client.post(reverse('search_field_autocomplete:prefetch_forecast'), {
+                'prefetch_token': candidates[0]['prefetch_token'],
+            })
+
+        self.assertEqual(response.status_code, 400)
+        mock_prefetch.assert_not_called()
+
+    @patch('search_field_autocomplete.views.prefetch_forecasts')
+    def test_highlighted_candidate_is_post_with_csrf(self, mock_prefetch):
+        url = reverse('search_field_autocomplete:prefetch_forecast')
+
+        self.assertEqual(self.client.get(url, {'latitude': 55.75, 'longitude': 37.62}).status_code, 405)
+        self.assertEqual(Client(enforce_csrf_checks=True).post(url, {'prefetch_token': ''}).status_code, 403)
+        mock_prefetch.assert_not_called()
+
+    def test_tokens_only_with_prefetch_enabled(self):
+        url = reverse('search_field_autocomplete:autocomplete_city')
+
+        self.assertNotIn('prefetch_token', self.client.get(url, {'q': 'mos'}).json()[0])
+        with override_settings(FORECAST_PREFETCH={'ENABLED': True, 'TOP_N': 0, 'CONCURRENCY': 2}):
+            self.assertIn('prefetch_token', self.client.get(url, {'q': 'mos'}).json()[0])
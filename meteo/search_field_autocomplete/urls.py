@@ -1,10 +1,12 @@
+from django.conf import settings
 from django.urls import path
-from .views import autocomplete_city_geo
+from .views import autocomplete_city_geo, autocomplete_city_geo_async, prefetch_forecast
 
 
 app_name = 'search_field_autocomplete'
 
 
 urlpatterns = [
-    path('search-field/', autocomplete_city_geo, name='autocomplete_city'),
+    path('search-field/', autocomplete_city_geo_async if settings.ASYNC_VIEWS else autocomplete_city_geo, name='autocomplete_city'),
+    path('prefetch/', prefetch_forecast, name='prefetch_forecast'),
 ]
\ No newline at end of file
@@ -1,9 +1,23 @@
-import requests
-from django.http import JsonResponse
-from django.views.decorators.http import require_GET
+import logging
+
+import niquests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest
+from django.views.decorators.http import require_GET, require_POST
+from weather_search.prefetch import prefetch_forecasts, sign_candidates, read_prefetch_token
+from weather_search.timing import phase
+from weather_search.circuit import CircuitOpenError
+from weather_search.upstream import upstream_get, async_upstream_get, breaker_for
+from .gazetteer import search_gazetteer
 from .utils import is_cyrillic
 
 
+AUTOCOMPLETE_COUNT = 5
+
+logger = logging.getLogger(__name__)
+
+
 @require_GET
 def autocomplete_city_geo(request):
     """
@@ -12,25 +26,123 @@ def autocomplete_city_geo(request):
 
     Возвращает отсортированный по населению список найденных городов.
     Если запрос на кириллице, то использует русский язык результатов.
+    Сначала город ищется в локальном справочнике, Geocoding API - только если там ничего нет.
+    Если геосервис недоступен (ошибка или разомкнутый предохранитель), возвращает пустой список.
+    С FORECAST_PREFETCH прогноз для первых городов списка (на forecast_days дней) загружается в фоне,
+    а у каждого города есть prefetch_token для сигнала prefetch_forecast.
     """
     query = request.GET.get('q', '')
     if not query:
         return JsonResponse([], safe=False)
 
-    url = "https://geocoding-api.open-meteo.com/v1/search"
+    data = None
+    if settings.GAZETTEER['ENABLED']:
+        with phase('gazetteer'):
+            data = search_gazetteer(query, limit=AUTOCOMPLETE_COUNT)
+
+    if not data:
+        with phase('geocoding'):
+            data = fetch_autocomplete(query)
+
+    prefetch_forecasts(data, request.GET.get('forecast_days'))
+    return JsonResponse(sign_candidates(data), safe=False)
+
+
+@require_GET
+async def autocomplete_city_geo_async(request):
+    """Асинхронная версия autocomplete_city_geo для запуска под ASGI"""
+
+    query = request.GET.get('q', '')
+    if not query:
+        return JsonResponse([], safe=False)
+
+    data = None
+    if settings.GAZETTEER['ENABLED']:
+        # Первое обращение строит индекс из БД
+        with phase('gazetteer'):
+            data = await sync_to_async(search_gazetteer)(query, limit=AUTOCOMPLETE_COUNT)
+
+    if not data:
+        with phase('geocoding'):
+            data = await afetch_autocomplete(query)
+
+    # Только ставит запросы в очередь фоновых потоков, event loop не блокируется
+    prefetch_forecasts(data, request.GET.get('forecast_days'))
+    return JsonResponse(sign_candidates(data), safe=False)
+
+
+@require_POST
+def prefetch_forecast(request):
+    """
+    Сигнал клиента о подсвеченной подсказке автодополнения (POST с CSRF-токеном: prefetch_token, forecast_days):
+    прогноз для нее загружается в фоне. Координаты берутся только из prefetch_token, выданного
+    autocomplete_city_geo, - произвольные координаты клиента к запросам в Open-Meteo не приводят.
+    Ответ сразу, без тела (204).
+    """
+    location = read_prefetch_token(request.POST.get('prefetch_token'))
+    if location is None:
+        return HttpResponseBadRequest('Некорректная подсказка')
+
+    latitude, longitude = location
+    prefetch_forecasts([{'latitude': latitude, 'longitude': longitude}], request.POST.get('forecast_days'))
+    return HttpResponse(status=204)
+
+
+def fetch_autocomplete(query):
+    """Города из Geocoding API по префиксу query через предохранитель 'autocomplete', при ошибке - []"""
+
+    if breaker_for('geocoding').is_open():
+        return []
+
+    try:
+        response = breaker_for('autocomplete').call(_autocomplete_get, autocomplete_params(query))
+        return sort_by_population(response.json().get('results', []))
+    except CircuitOpenError:
+        return []
+    except (niquests.RequestException, ValueError) as e:
+        logger.info('Автодополнение для %r не удалось: %s', query, e)
+        return []
+
+
+async def afetch_autocomplete(query):
+    """Асинхронная версия fetch_autocomplete"""
+
+    if breaker_for('geocoding').is_open():
+        return []
+
+    try:
+        response = await breaker_for('autocomplete').acall(_async_autocomplete_get, autocomplete_params(query))
+        return sort_by_population(response.json().get('results', []))
+    except CircuitOpenError:
+        return []
+    except (niquests.RequestException, ValueError) as e:
+        logger.info('Автодополнение для %r не удалось: %s', query, e)
+        return []
+
+
+def _autocomplete_get(params):
+    response = upstream_get('autocomplete', params=params)
+    response.raise_for_status()
+    return response
+
+
+async def _async_autocomplete_get(params):
+    response = await async_upstream_get('autocomplete', params=params)
+    response.raise_for_status()
+    return response
+
 
+def autocomplete_params(query):
     params = {
         "name": query,
-        "count": 5,
+        "count": AUTOCOMPLETE_COUNT,
     }
 
     if is_cyrillic(query):
         params['language'] = 'ru'
 
-    response = requests.get(url, params=params, timeout=5)
+    return params
 
-    data = response.json()
-    data_results = data.get('results', [])
 
-    data = sorted(data_results, key=lambda x: x.get('population', 0), reverse=True)
-    return JsonResponse(data, safe=False)
\ No newline at end of file
+def sort_by_population(results):
+    return sorted(results, key=lambda x: x.get('population', 0), reverse=True)
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import HistoryModel
+from .models import HistoryModel, CityDailySearchCount
 
 
 admin.site.register(HistoryModel)
+admin.site.register(CityDailySearchCount)
@@ -0,0 +1,190 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import HistoryModel
+from .rollup import increment_city_search_counts
+from .upsert import upsert_user_history
+
+
+logger = logging.getLogger(__name__)
+
+# Строковые поля HistoryModel без null: отсутствующее значение (например, admin1 в ответе геосервиса) - пустая строка
+TEXT_FIELDS = ('city', 'country', 'country_code', 'admin', 'timezone')
+
+
+def normalize_city_values(city_values_dict):
+    """Данные города для записи в HistoryModel: None в строковых полях заменяется пустой строкой"""
+
+    return {
+        field: '' if value is None and field in TEXT_FIELDS else value
+        for field, value in city_values_dict.items()
+    }
+
+
+class HistoryWriter:
+    """
+    Буфер записей истории поиска (write-behind).
+
+    Записи копятся в памяти и сохраняются в БД в фоновом потоке (bulk_create, для пользователей - upsert):
+    когда набирается batch_size записей или проходит flush_interval секунд.
+    При завершении процесса оставшиеся записи сохраняются (atexit).
+    Если пачка не сохраняется целиком, записи сохраняются по одной: теряются только ошибочные.
+
+    timestamp записи выставляется при сохранении (auto_now_add), т.е. с задержкой не больше flush_interval.
+    """
+
+    def __init__(self, batch_size=100, flush_interval=2.0, max_pending=10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._pending = []
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def add(self, user_id, city_values_dict):
+        """Ставит запись в очередь, не обращаясь к БД (безопасно вызывать из async-кода)"""
+
+        with self._condition:
+            # БД не успевает за потоком записей - отбрасываем самые старые, чтобы не копить память
+            if len(self._pending) >= self.max_pending:
+                del self._pending[0]
+                logger.warning('Буфер истории поиска переполнен, запись отброшена')
+
+            self._pending.append((user_id, normalize_city_values(city_values_dict)))
+
+            if self._thread is None and not self._closed:
+                self._start()
+
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify()
+
+    def flush(self):
+        """Сохраняет все накопленные записи, возвращает их количество"""
+
+        with self._flush_lock:
+            with self._condition:
+                records, self._pending = self._pending, []
+
+            if not records:
+                return 0
+
+            try:
+                self._save(records)
+            except Exception:
+                logger.warning('Не удалось сохранить пачку из %s записей истории поиска, сохраняем по одной',
+                               len(records), exc_info=True)
+                return self._save_one_by_one(records)
+
+            return len(records)
+
+    def close(self):
+        """Останавливает фоновый поток и сохраняет оставшиеся записи"""
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+            self._thread = None
+
+        self.flush()
+
+    def pending(self):
+        with self._condition:
+            return len(self._pending)
+
+    def _save(self, records):
+        with transaction.atomic():
+            anonymous, by_user = self._group(records)
+            HistoryModel.objects.bulk_create(anonymous)
+            for (user_id, _), (city_values_dict, hits) in by_user.items():
+                upsert_user_history(user_id, city_values_dict, hits=hits)
+            increment_city_search_counts([city_values_dict['city'] for _, city_values_dict in records])
+
+    def _save_one_by_one(self, records):
+        saved = 0
+        for record in records:
+            try:
+                self._save([record])
+            except Exception:
+                logger.exception('Не удалось сохранить запись истории поиска: %r', record[1])
+            else:
+                saved += 1
+        return saved
+
+    @staticmethod
+    def _group(records):
+        """
+        Разделяет записи на объекты HistoryModel без user и поиски пользователей,
+        сгруппированные по записи истории: {(user_id, lookup): (последние данные города, кол-во поисков)}
+        """
+        anonymous = []
+        by_user = {}
+
+        for user_id, city_values_dict in records:
+            if user_id is None:
+                anonymous.append(HistoryModel(user=None, **city_values_dict))
+                continue
+
+            lookup, _ = HistoryModel.split_location(city_values_dict)
+            key = (user_id, tuple(sorted(lookup.items())))
+            _, hits = by_user.get(key, (None, 0))
+            by_user[key] = (city_values_dict, hits + 1)
+
+        return anonymous, by_user
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        deadline = time.monotonic() + self.flush_interval
+
+        while True:
+            with self._condition:
+                while not self._closed and len(self._pending) < self.batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._condition.wait(timeout)
+
+                closed = self._closed
+
+            if closed:
+                return
+
+            self.flush()
+            close_old_connections()
+            deadline = time.monotonic() + self.flush_interval
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_history_writer():
+    """Буфер истории, общий для процесса"""
+
+    global _writer
+
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                conf = settings.HISTORY_WRITE_BEHIND
+                _writer = HistoryWriter(
+                    batch_size=conf['BATCH_SIZE'],
+                    flush_interval=conf['FLUSH_INTERVAL'],
+                    max_pending=conf['MAX_PENDING'],
+                )
+                atexit.register(_writer.close)
+
+    return _writer
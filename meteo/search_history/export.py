@@ -0,0 +1,60 @@
+# Выгрузка истории поиска (CSV или JSON Lines) без загрузки всей таблицы в память:
+# записи читаются курсором пачками (.iterator()), строки выгрузки отдаются генератором.
+import csv
+import json
+
+from .models import HistoryModel
+
+
+EXPORT_FIELDS = (
+    'id', 'user_id', 'city', 'country', 'country_code', 'admin', 'forecast_days',
+    'latitude', 'longitude', 'timezone', 'timestamp', 'last_searched', 'hit_count',
+)
+
+CHUNK_SIZE = 2000
+
+
+def history_for_export(since=None, until=None):
+    """Записи истории за период [since, until] (даты, включительно)"""
+
+    history = HistoryModel.objects.all()
+    if since:
+        history = history.filter(timestamp__date__gte=since)
+    if until:
+        history = history.filter(timestamp__date__lte=until)
+    return history
+
+
+class _Echo:
+    """Файл для csv.writer, который возвращает записанную строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+def export_csv(queryset):
+    writer = csv.writer(_Echo())
+
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in _rows(queryset):
+        yield writer.writerow([_format(value) for value in row])
+
+
+def export_jsonl(queryset):
+    for row in _rows(queryset):
+        yield json.dumps(dict(zip(EXPORT_FIELDS, map(_format, row))), ensure_ascii=False) + '\n'
+
+
+# Формат: (генератор строк, Content-Type, расширение файла)
+EXPORT_FORMATS = {
+    'csv': (export_csv, 'text/csv; charset=utf-8', 'csv'),
+    'jsonl': (export_jsonl, 'application/x-ndjson; charset=utf-8', 'jsonl'),
+}
+
+
+def _rows(queryset):
+    return queryset.order_by('pk').values_list(*EXPORT_FIELDS).iterator(chunk_size=CHUNK_SIZE)
+
+
+def _format(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
@@ -0,0 +1,79 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from search_history.models import HistoryModel, CityDailySearchCount
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счетчики поисков городов по дням (CityDailySearchCount) по истории поиска. '
+        'Пересчитываются только дни, за которые в истории есть записи. '
+        'Повторные поиски пользователя (hit_count) относятся ко дню первого поиска города. '
+        'Дни старше --retention-days могли быть свернуты rollup_history (поиски без user удалены), '
+        'их счетчики только дополняются до пересчитанных, но не уменьшаются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Размер пачки при записи счетчиков')
+        parser.add_argument('--retention-days', type=int, default=None,
+                            help='С каким --days запускается rollup_history (по умолчанию HISTORY_RETENTION["DAYS"])')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        retention_days = options['retention_days']
+        if retention_days is None:
+            retention_days = settings.HISTORY_RETENTION['DAYS']
+        # Более ранние дни rollup_history мог уже свернуть: записей истории за них меньше, чем поисков
+        first_complete_day = timezone.localdate() - timedelta(days=retention_days)
+
+        stats = (
+            HistoryModel.objects
+            .annotate(day=TruncDate('timestamp'))
+            .values('city', 'day')
+            .annotate(count=Sum('hit_count'))
+            .order_by()
+        )
+
+        counters = [CityDailySearchCount(city=row['city'], day=row['day'], count=row['count']) for row in stats.iterator()]
+        rebuilt = [counter for counter in counters if counter.day >= first_complete_day]
+        merged = [counter for counter in counters if counter.day < first_complete_day]
+        days = {counter.day for counter in counters}
+
+        with transaction.atomic():
+            CityDailySearchCount.objects.filter(day__in={counter.day for counter in rebuilt}).delete()
+            CityDailySearchCount.objects.bulk_create(rebuilt, batch_size=batch_size)
+            self._merge(merged, batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Счетчики пересчитаны: {len(counters)} записей за {len(days)} дн.'
+        ))
+
+    @staticmethod
+    def _merge(counters, batch_size):
+        """Счетчики свернутых дней: недостающие создаются, меньшие пересчитанных - увеличиваются"""
+
+        if not counters:
+            return
+
+        existing = {
+            (counter.city, counter.day): counter
+            for counter in CityDailySearchCount.objects.filter(day__in={counter.day for counter in counters})
+        }
+
+        created, updated = [], []
+        for counter in counters:
+            current = existing.get((counter.city, counter.day))
+            if current is None:
+                created.append(counter)
+            elif current.count < counter.count:
+                current.count = counter.count
+                updated.append(current)
+
+        CityDailySearchCount.objects.bulk_create(created, batch_size=batch_size)
+        CityDailySearchCount.objects.bulk_update(updated, ['count'], batch_size=batch_size)
@@ -0,0 +1,108 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from search_field_autocomplete.gazetteer import normalize_name, search_gazetteer, MAX_LIMIT
+from search_history.models import HistoryModel
+from weather_search.utils import geo_coding_request, GeoApiException
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет координаты и часовой пояс у записей истории поиска, сохраненных без них. '
+        'Каждый город определяется один раз (по справочнику GeoNames, затем у геосервиса), '
+        'записи обновляются пачками.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Кол-во городов, обновляемых в одной транзакции')
+        parser.add_argument('--offline', action='store_true',
+                            help='Только справочник GeoNames, без запросов к геосервису')
+        parser.add_argument('--delay', type=float, default=0.0,
+                            help='Пауза между запросами к геосервису в секундах')
+
+    def handle(self, *args, **options):
+        self.offline = options['offline']
+        self.delay = options['delay']
+        batch_size = options['batch_size']
+
+        locations = (
+            HistoryModel.objects
+            .filter(latitude__isnull=True)
+            .values_list('city', 'country_code', 'admin')
+            .distinct()
+            .order_by()
+        )
+
+        updated_rows = resolved = unresolved = 0
+        batch = []
+
+        for city, country_code, admin in locations.iterator():
+            geo_data = self._resolve(city, country_code, admin)
+            if geo_data is None:
+                unresolved += 1
+                continue
+
+            resolved += 1
+            batch.append(((city, country_code, admin), geo_data))
+            if len(batch) >= batch_size:
+                updated_rows += self._save(batch)
+                batch = []
+
+        updated_rows += self._save(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Координаты заполнены: {updated_rows} записей, {resolved} городов, не найдено {unresolved}'
+        ))
+
+    @staticmethod
+    def _save(batch):
+        updated = 0
+
+        with transaction.atomic():
+            for (city, country_code, admin), geo_data in batch:
+                updated += HistoryModel.objects.filter(
+                    latitude__isnull=True, city=city, country_code=country_code, admin=admin,
+                ).update(
+                    latitude=geo_data['latitude'],
+                    longitude=geo_data['longitude'],
+                    timezone=geo_data.get('timezone') or '',
+                )
+
+        return updated
+
+    def _resolve(self, city, country_code, admin):
+        geo_data = self._resolve_in_gazetteer(city, country_code, admin)
+        if geo_data is not None or self.offline:
+            return geo_data
+
+        try:
+            geo_data = geo_coding_request(city=city, country_code=country_code or None, admin=admin or None)
+        except GeoApiException as e:
+            self.stderr.write(f'{city} ({country_code}, {admin}): {e}')
+            return None
+        finally:
+            if self.delay:
+                time.sleep(self.delay)
+
+        return geo_data
+
+    @staticmethod
+    def _resolve_in_gazetteer(city, country_code, admin):
+        if not settings.GAZETTEER['ENABLED']:
+            return None
+
+        name = normalize_name(city)
+        for result in search_gazetteer(city, limit=MAX_LIMIT):
+            if normalize_name(result['name']) != name:
+                continue
+            if country_code and result['country_code'] != country_code:
+                continue
+            if admin and result['admin1'] != admin:
+                continue
+            return result
+
+        return None
@@ -0,0 +1,26 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from search_history.export import EXPORT_FORMATS, history_for_export
+
+
+class Command(BaseCommand):
+    help = 'Выгружает историю поиска в CSV или JSON Lines, читая записи пачками (размер выгрузки не ограничен памятью)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', help='Файл выгрузки (по умолчанию stdout)')
+        parser.add_argument('--since', type=date.fromisoformat, help='С даты (ГГГГ-ММ-ДД, включительно)')
+        parser.add_argument('--until', type=date.fromisoformat, help='По дату (ГГГГ-ММ-ДД, включительно)')
+
+    def handle(self, *args, **options):
+        export, _, _ = EXPORT_FORMATS[options['format']]
+        history = history_for_export(options['since'], options['until'])
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(export(history))
+        else:
+            for line in export(history):
+                self.stdout.write(line, ending='')
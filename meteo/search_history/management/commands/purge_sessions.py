@@ -0,0 +1,46 @@
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет истекшие сессии из БД пачками по первичному ключу, чтобы не блокировать таблицу '
+        'одним большим DELETE. Сессии в кэше и cookie истекают сами.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Кол-во сессий, удаляемых одним запросом')
+        parser.add_argument('--delay', type=float, default=0.0,
+                            help='Пауза между пачками в секундах')
+
+    def handle(self, *args, **options):
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        if not hasattr(store, 'get_model_class'):
+            self.stdout.write(f'{settings.SESSION_ENGINE}: сессии не хранятся в БД, удалять нечего')
+            return
+
+        deleted = purge_expired_sessions(store.get_model_class(), options['batch_size'], options['delay'])
+
+        self.stdout.write(self.style.SUCCESS(f'Удалено истекших сессий: {deleted}'))
+
+
+def purge_expired_sessions(model, batch_size, delay=0.0):
+    """Удаляет сессии с expire_date в прошлом (индекс по expire_date), возвращает их кол-во"""
+
+    now = timezone.now()
+    expired = model.objects.filter(expire_date__lt=now).order_by().values_list('pk', flat=True)
+
+    deleted = 0
+    while True:
+        keys = list(expired[:batch_size])
+        if not keys:
+            return deleted
+
+        deleted += model.objects.filter(pk__in=keys).delete()[0]
+        if delay:
+            time.sleep(delay)
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from search_history.retention import roll_up_history
+
+
+class Command(BaseCommand):
+    help = (
+        'Сворачивает поиски неавторизованных пользователей старше --days дней в счетчики поисков по дням '
+        '(CityDailySearchCount) и удаляет их пачками. История авторизованных пользователей не удаляется.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Сколько дней хранить записи (по умолчанию HISTORY_RETENTION["DAYS"])')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Кол-во записей, удаляемых одной транзакцией')
+        parser.add_argument('--delay', type=float, default=0.0,
+                            help='Пауза между пачками в секундах (чтобы не мешать записи новых поисков)')
+
+    def handle(self, *args, **options):
+        conf = settings.HISTORY_RETENTION
+        days = options['days'] if options['days'] is not None else conf['DAYS']
+        batch_size = options['batch_size'] or conf['BATCH_SIZE']
+
+        def on_day(day, deleted):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{day}: {deleted}')
+
+        deleted = roll_up_history(days, batch_size=batch_size, delay=options['delay'], on_day=on_day)
+
+        self.stdout.write(self.style.SUCCESS(f'Свернуто и удалено записей истории: {deleted}'))
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search_history', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CityDailySearchCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city', models.CharField(max_length=100)),
+                ('day', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day', 'city'], name='search_hist_day_7d6ffd_idx')],
+                'constraints': [models.UniqueConstraint(fields=('city', 'day'), name='unique_city_day_search_count')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def copy_timestamp(apps, schema_editor):
+    HistoryModel = apps.get_model('search_history', 'HistoryModel')
+    HistoryModel.objects.update(last_searched=models.F('timestamp'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search_history', '0003_history_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historymodel',
+            name='last_searched',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='historymodel',
+            name='hit_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(copy_timestamp, migrations.RunPython.noop),
+    ]
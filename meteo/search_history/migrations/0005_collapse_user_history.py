@@ -0,0 +1,47 @@
+from django.db import migrations, models
+
+
+LOOKUP_FIELDS = ('user', 'city', 'country', 'country_code', 'admin', 'forecast_days')
+
+
+def collapse_duplicates(apps, schema_editor):
+    """
+    Повторяющиеся записи истории пользователя сливаются в одну (самую раннюю):
+    hit_count - сумма, last_searched - последний поиск, координаты - последние известные.
+    """
+    HistoryModel = apps.get_model('search_history', 'HistoryModel')
+
+    duplicates = (
+        HistoryModel.objects
+        .filter(user__isnull=False)
+        .values(*LOOKUP_FIELDS)
+        .annotate(rows=models.Count('id'))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+
+    for lookup in duplicates.iterator():
+        lookup.pop('rows')
+        rows = list(HistoryModel.objects.filter(**lookup).order_by('timestamp', 'id'))
+        kept, extra = rows[0], rows[1:]
+
+        kept.hit_count = sum(row.hit_count for row in rows)
+        kept.last_searched = max(row.last_searched for row in rows)
+        located = [row for row in rows if row.latitude is not None]
+        if located:
+            kept.latitude, kept.longitude = located[-1].latitude, located[-1].longitude
+            kept.timezone = located[-1].timezone or kept.timezone
+        kept.save(update_fields=['hit_count', 'last_searched', 'latitude', 'longitude', 'timezone'])
+
+        HistoryModel.objects.filter(pk__in=[row.pk for row in extra]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search_history', '0004_history_hit_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(collapse_duplicates, migrations.RunPython.noop),
+    ]
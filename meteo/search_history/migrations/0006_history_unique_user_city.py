@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search_history', '0005_collapse_user_history'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='historymodel',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('user__isnull', False)),
+                fields=('user', 'city', 'country', 'country_code', 'admin', 'forecast_days'),
+                name='unique_user_history_city',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='historymodel',
+            index=models.Index(fields=['user', '-last_searched'], name='history_user_last_searched'),
+        ),
+    ]
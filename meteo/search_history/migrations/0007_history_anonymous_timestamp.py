@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search_history', '0006_history_unique_user_city'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='historymodel',
+            index=models.Index(condition=models.Q(('user__isnull', True)), fields=['timestamp'], name='history_anonymous_timestamp'),
+        ),
+    ]
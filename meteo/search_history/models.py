@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.utils import timezone as django_timezone
 
 
 User = get_user_model()
@@ -12,5 +13,56 @@ class HistoryModel(models.Model):
     country_code = models.CharField(max_length=10)
     admin = models.CharField(max_length=100)
     forecast_days = models.IntegerField()
+    # Координаты и часовой пояс найденного города: повторный поиск из истории идет без геокодирования
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
+    timezone = models.CharField(max_length=64, blank=True, default='')
     timestamp = models.DateTimeField(auto_now_add=True)
+    # У пользователя одна запись на город: время последнего поиска и кол-во поисков
+    last_searched = models.DateTimeField(default=django_timezone.now)
+    hit_count = models.PositiveIntegerField(default=1)
 
+    # Поля, определяющие запись истории пользователя
+    LOOKUP_FIELDS = ('city', 'country', 'country_code', 'admin', 'forecast_days')
+    # Поля, не участвующие в поиске записи истории (одинаковый город мог быть найден с немного разными координатами)
+    LOCATION_FIELDS = ('latitude', 'longitude', 'timezone')
+
+    class Meta:
+        constraints = [
+            # Записи без user (поиски неавторизованных пользователей) не уникальны
+            models.UniqueConstraint(
+                fields=['user', 'city', 'country', 'country_code', 'admin', 'forecast_days'],
+                condition=models.Q(user__isnull=False),
+                name='unique_user_history_city',
+            ),
+        ]
+        indexes = [
+            # Последние города пользователя (история на странице поиска)
+            models.Index(fields=['user', '-last_searched'], name='history_user_last_searched'),
+            # Старые поиски неавторизованных пользователей (сворачивание истории, retention.py)
+            models.Index(fields=['timestamp'], condition=models.Q(user__isnull=True), name='history_anonymous_timestamp'),
+        ]
+
+    @classmethod
+    def split_location(cls, city_values_dict):
+        """Разделяет данные города на поля для поиска записи и координаты: (lookup, location)"""
+
+        lookup = {k: v for k, v in city_values_dict.items() if k not in cls.LOCATION_FIELDS}
+        location = {k: v for k, v in city_values_dict.items() if k in cls.LOCATION_FIELDS and v is not None}
+        return lookup, location
+
+
+class CityDailySearchCount(models.Model):
+    """Кол-во поисков города за день, обновляется при каждой записи истории"""
+
+    city = models.CharField(max_length=100)
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['city', 'day'], name='unique_city_day_search_count'),
+        ]
+        indexes = [
+            models.Index(fields=['day', 'city']),
+        ]
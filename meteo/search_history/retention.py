@@ -0,0 +1,73 @@
+# Хранение истории поиска: поиски неавторизованных пользователей (записи без user) нужны только для статистики,
+# поэтому через RETENTION_DAYS дней они сворачиваются в счетчики по дням (CityDailySearchCount) и удаляются.
+# Записи истории пользователей (по одной на город) не удаляются.
+import time
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from .models import HistoryModel
+from .rollup import merge_city_search_counts
+
+
+def expired_history(days):
+    """Записи без user, сделанные раньше начала дня days дней назад"""
+
+    cutoff = _day_start(timezone.localdate() - timedelta(days=days))
+    return HistoryModel.objects.filter(user__isnull=True, timestamp__lt=cutoff)
+
+
+def roll_up_history(days, batch_size=1000, delay=0.0, on_day=None):
+    """
+    Сворачивает и удаляет записи expired_history(days) по одному дню, начиная с самого старого:
+    счетчики дня дополняются (merge_city_search_counts), затем записи удаляются пачками по batch_size,
+    каждая пачка - отдельной короткой транзакцией. Прерванный проход можно просто запустить снова.
+    Возвращает кол-во удаленных записей.
+    """
+    expired = expired_history(days)
+    oldest = expired.aggregate(oldest=Min('timestamp'))['oldest']
+    if oldest is None:
+        return 0
+
+    day = timezone.localtime(oldest).date()
+    last_day = timezone.localdate() - timedelta(days=days + 1)
+
+    deleted = 0
+    while day <= last_day:
+        rows = expired.filter(timestamp__gte=_day_start(day), timestamp__lt=_day_start(day + timedelta(days=1)))
+        counts = dict(rows.values_list('city').annotate(count=Count('id')).order_by())
+
+        if counts:
+            with transaction.atomic():
+                merge_city_search_counts(counts, day)
+            day_deleted = delete_in_batches(rows, batch_size, delay)
+            deleted += day_deleted
+
+            if on_day is not None:
+                on_day(day, day_deleted)
+
+        day += timedelta(days=1)
+
+    return deleted
+
+
+def delete_in_batches(queryset, batch_size, delay=0.0):
+    """Удаляет записи queryset по первичному ключу пачками, не держа блокировку на все удаление"""
+
+    keys = queryset.order_by('pk').values_list('pk', flat=True)
+
+    deleted = 0
+    while True:
+        batch = list(keys[:batch_size])
+        if not batch:
+            return deleted
+
+        deleted += HistoryModel.objects.filter(pk__in=batch).delete()[0]
+        if delay:
+            time.sleep(delay)
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()))
@@ -0,0 +1,74 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import CityDailySearchCount
+
+
+def increment_city_search_counts(cities, day=None):
+    """
+    Увеличивает счетчики поисков городов за день.
+    cities - список названий городов (по одному на каждый поиск).
+    """
+    if day is None:
+        day = timezone.localdate()
+
+    for city, count in Counter(cities).items():
+        updated = (
+            CityDailySearchCount.objects
+            .filter(city=city, day=day)
+            .update(count=F('count') + count)
+        )
+        if updated:
+            continue
+
+        try:
+            with transaction.atomic():
+                CityDailySearchCount.objects.create(city=city, day=day, count=count)
+        except IntegrityError:
+            # Строку успел создать параллельный запрос
+            CityDailySearchCount.objects.filter(city=city, day=day).update(count=F('count') + count)
+
+
+def merge_city_search_counts(counts, day):
+    """
+    Дополняет счетчики поисков за день до counts ({город: кол-во}), если в них меньше.
+    Повторный вызов с теми же counts ничего не меняет (записи истории уже учтенные при поиске не удваиваются).
+    """
+    for city, count in counts.items():
+        updated = (
+            CityDailySearchCount.objects
+            .filter(city=city, day=day)
+            .update(count=Greatest(F('count'), count))
+        )
+        if updated:
+            continue
+
+        try:
+            with transaction.atomic():
+                CityDailySearchCount.objects.create(city=city, day=day, count=count)
+        except IntegrityError:
+            CityDailySearchCount.objects.filter(city=city, day=day).update(count=Greatest(F('count'), count))
+
+
+def top_searched_cities(window_days=None):
+    """
+    Города по убыванию кол-ва поисков: queryset из {'city', 'count'}.
+    window_days - учитывать только последние window_days дней (включая сегодня).
+    """
+    stats = CityDailySearchCount.objects.all()
+
+    if window_days:
+        since = timezone.localdate() - timedelta(days=window_days - 1)
+        stats = stats.filter(day__gte=since)
+
+    return (
+        stats
+        .values('city')
+        .annotate(count=Sum('count'))
+        .order_by('-count', 'city')
+    )
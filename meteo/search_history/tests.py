@@ -1,3 +1,382 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from io import StringIO
+from unittest.mock import patch
+from .buffer import HistoryWriter
+from .models import HistoryModel, CityDailySearchCount
+from .trending import SpaceSaving, TrendingCities, trending_cities
+from .upsert import upsert_user_history
+from .utils import record_city_search
+from weather_search.utils import CityHistoryContextService
 
-# Create your tests here.
+
+User = get_user_model()
+
+CITY = {'city': 'Москва', 'country': 'Россия', 'country_code': 'RU', 'admin': 'Москва', 'forecast_days': 3}
+
+
+class HistoryWriterTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.writer = HistoryWriter(batch_size=1000, flush_interval=3600)
+
+    def tearDown(self):
+        self.writer.close()
+
+    def test_records_are_buffered_until_flush(self):
+        self.writer.add(None, CITY)
+        self.writer.add(None, CITY)
+
+        self.assertEqual(HistoryModel.objects.count(), 0)
+        self.assertEqual(self.writer.pending(), 2)
+
+        self.assertEqual(self.writer.flush(), 2)
+        self.assertEqual(HistoryModel.objects.filter(user=None).count(), 2)
+        self.assertEqual(self.writer.pending(), 0)
+        self.assertEqual(CityDailySearchCount.objects.get(city='Москва').count, 2)
+
+    def test_repeated_user_search_updates_history(self):
+        HistoryModel.objects.create(user=self.user, **CITY)
+
+        self.writer.add(self.user.pk, CITY)
+        self.writer.add(self.user.pk, {**CITY, 'city': 'Тула'})
+        self.writer.add(self.user.pk, {**CITY, 'city': 'Тула', 'latitude': 54.2, 'longitude': 37.6})
+        self.writer.flush()
+
+        self.assertEqual(HistoryModel.objects.filter(user=self.user).count(), 2)
+        self.assertFalse(HistoryModel.objects.filter(user=None).exists())
+        self.assertEqual(HistoryModel.objects.get(user=self.user, city='Москва').hit_count, 2)
+        tula = HistoryModel.objects.get(user=self.user, city='Тула')
+        self.assertEqual((tula.hit_count, tula.latitude), (2, 54.2))
+        self.assertEqual(CityDailySearchCount.objects.get(city='Тула').count, 2)
+
+    def test_missing_admin_is_saved_as_empty_string(self):
+        self.writer.add(self.user.pk, {**CITY, 'admin': None})
+        self.writer.add(None, {**CITY, 'admin': None})
+
+        self.assertEqual(self.writer.flush(), 2)
+        self.assertEqual(HistoryModel.objects.filter(admin='').count(), 2)
+
+    def test_bad_record_does_not_drop_batch(self):
+        self.writer.add(None, CITY)
+        self.writer.add(self.user.pk, {**CITY, 'forecast_days': None})
+        self.writer.add(self.user.pk, {**CITY, 'city': 'Тула'})
+
+        with self.assertLogs('search_history.buffer', 'WARNING'):
+            self.assertEqual(self.writer.flush(), 2)
+
+        self.assertEqual(HistoryModel.objects.filter(user=None).count(), 1)
+        self.assertEqual(list(HistoryModel.objects.filter(user=self.user).values_list('city', flat=True)), ['Тула'])
+        self.assertEqual(sum(CityDailySearchCount.objects.values_list('count', flat=True)), 2)
+
+    def test_close_drains_pending_records(self):
+        self.writer.add(None, CITY)
+        self.writer.close()
+
+        self.assertEqual(HistoryModel.objects.count(), 1)
+
+    def test_pending_records_are_bounded(self):
+        writer = HistoryWriter(batch_size=1000, flush_interval=3600, max_pending=3)
+        for _ in range(5):
+            writer.add(None, CITY)
+
+        self.assertEqual(writer.pending(), 3)
+        writer.close()
+
+
+@override_settings(HISTORY_WRITE_BEHIND={'ENABLED': False})
+class RecordCitySearchTest(TestCase):
+    def test_direct_write_for_user(self):
+        user = User.objects.create_user(username='user', password='password')
+
+        record_city_search(user, CITY)
+        record_city_search(user, CITY)
+
+        history = HistoryModel.objects.get(user=user)
+        self.assertEqual(history.hit_count, 2)
+        self.assertGreater(history.last_searched, history.timestamp)
+        self.assertFalse(HistoryModel.objects.filter(user=None).exists())
+        self.assertEqual(CityDailySearchCount.objects.get(city='Москва', day=timezone.localdate()).count, 2)
+
+    def test_repeated_search_moves_city_to_top_of_history(self):
+        user = User.objects.create_user(username='user', password='password')
+
+        for city in ['Москва', 'Тула', 'Москва']:
+            record_city_search(user, {**CITY, 'city': city})
+
+        history = CityHistoryContextService.get_city_history(user, session={})
+        self.assertEqual([item['city'] for item in history], ['Москва', 'Тула'])
+
+    def test_direct_write_for_anonymous_user(self):
+        record_city_search(AnonymousUser(), CITY)
+        record_city_search(AnonymousUser(), CITY)
+
+        self.assertEqual(HistoryModel.objects.filter(user=None).count(), 2)
+
+    def test_direct_write_with_missing_admin(self):
+        user = User.objects.create_user(username='user', password='password')
+
+        record_city_search(AnonymousUser(), {**CITY, 'admin': None})
+        record_city_search(user, {**CITY, 'admin': None})
+        record_city_search(user, {**CITY, 'admin': None})
+
+        history = HistoryModel.objects.get(user=user)
+        self.assertEqual((history.admin, history.hit_count), ('', 2))
+        self.assertEqual(HistoryModel.objects.get(user=None).admin, '')
+
+    def test_write_behind_with_missing_admin_matches_direct_write(self):
+        user = User.objects.create_user(username='user', password='password')
+        writer = HistoryWriter(batch_size=100, flush_interval=3600)
+        self.addCleanup(writer.close)
+
+        record_city_search(user, {**CITY, 'admin': None})
+        with override_settings(HISTORY_WRITE_BEHIND={'ENABLED': True}), \
+                patch('search_history.utils.get_history_writer', return_value=writer):
+            record_city_search(AnonymousUser(), {**CITY, 'admin': None})
+            record_city_search(user, {**CITY, 'admin': None})
+        writer.flush()
+
+        self.assertEqual(HistoryModel.objects.get(user=None).admin, '')
+        # Обе записи пользователя попали в одну строку истории: ключ уникальности одинаковый
+        self.assertEqual(HistoryModel.objects.get(user=user).hit_count, 2)
+
+    def test_user_history_is_matched_without_coordinates(self):
+        user = User.objects.create_user(username='user', password='password')
+        HistoryModel.objects.create(user=user, **CITY)
+
+        record_city_search(user, {**CITY, 'latitude': 55.75, 'longitude': 37.62, 'timezone': 'Europe/Moscow'})
+        record_city_search(user, CITY)
+
+        history = HistoryModel.objects.get(user=user)
+        self.assertEqual((history.hit_count, history.latitude, history.timezone), (3, 55.75, 'Europe/Moscow'))
+
+    def test_fallback_without_on_conflict(self):
+        user = User.objects.create_user(username='user', password='password')
+
+        with patch.object(connection.features, 'supports_update_conflicts_with_target', False):
+            upsert_user_history(user.pk, CITY)
+            upsert_user_history(user.pk, {**CITY, 'latitude': 55.75, 'longitude': 37.62}, hits=2)
+
+        history = HistoryModel.objects.get(user=user)
+        self.assertEqual((history.hit_count, history.latitude), (3, 55.75))
+
+
+class BackfillCitySearchCountsTest(TestCase):
+    def test_counts_are_rebuilt_from_history(self):
+        HistoryModel.objects.bulk_create([HistoryModel(**CITY) for _ in range(3)])
+        old = HistoryModel.objects.create(**{**CITY, 'city': 'Тула'})
+        HistoryModel.objects.filter(pk=old.pk).update(timestamp=timezone.now() - timedelta(days=2))
+        CityDailySearchCount.objects.create(city='Москва', day=timezone.localdate(), count=100)
+
+        call_command('backfill_city_search_counts', stdout=StringIO())
+
+        self.assertEqual(CityDailySearchCount.objects.get(city='Москва').count, 3)
+        self.assertEqual(
+            CityDailySearchCount.objects.get(city='Тула').day,
+            timezone.localdate() - timedelta(days=2),
+        )
+
+
+@override_settings(GAZETTEER={'ENABLED': False})
+class BackfillHistoryLocationsTest(TestCase):
+    @patch('search_history.management.commands.backfill_history_locations.geo_coding_request')
+    def test_each_city_is_geocoded_once(self, mock_geo_coding_request):
+        mock_geo_coding_request.return_value = {'latitude': 55.75, 'longitude': 37.62, 'timezone': 'Europe/Moscow'}
+        HistoryModel.objects.bulk_create([HistoryModel(**CITY) for _ in range(3)])
+        located = HistoryModel.objects.create(**CITY, latitude=1.0, longitude=2.0, timezone='UTC')
+
+        call_command('backfill_history_locations', '--batch-size', '1', stdout=StringIO())
+
+        mock_geo_coding_request.assert_called_once_with(city='Москва', country_code='RU', admin='Москва')
+        self.assertEqual(HistoryModel.objects.filter(latitude=55.75, timezone='Europe/Moscow').count(), 3)
+        located.refresh_from_db()
+        self.assertEqual(located.latitude, 1.0)
+
+    @patch('search_history.management.commands.backfill_history_locations.geo_coding_request')
+    def test_offline_mode_skips_geocoder(self, mock_geo_coding_request):
+        HistoryModel.objects.create(**CITY)
+
+        call_command('backfill_history_locations', '--offline', stdout=StringIO())
+
+        mock_geo_coding_request.assert_not_called()
+        self.assertTrue(HistoryModel.objects.filter(latitude__isnull=True).exists())
+
+
+class PurgeSessionsTest(TestCase):
+    def test_only_expired_sessions_are_deleted(self):
+        now = timezone.now()
+        Session.objects.bulk_create(
+            [Session(session_key=f'expired{i}', session_data='', expire_date=now - timedelta(days=1)) for i in range(5)]
+            + [Session(session_key='active', session_data='', expire_date=now + timedelta(days=1))]
+        )
+
+        out = StringIO()
+        call_command('purge_sessions', '--batch-size', '2', stdout=out)
+
+        self.assertIn('5', out.getvalue())
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['active'])
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache')
+    def test_cache_sessions_are_not_touched(self):
+        Session.objects.create(session_key='expired', session_data='', expire_date=timezone.now() - timedelta(days=1))
+
+        call_command('purge_sessions', stdout=StringIO())
+
+        self.assertTrue(Session.objects.exists())
+
+
+class CollapseUserHistoryMigrationTest(TransactionTestCase):
+    before = [('search_history', '0004_history_hit_count')]
+    after = [('search_history', '0006_history_unique_user_city')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicates_are_collapsed(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        OldHistoryModel = apps.get_model('search_history', 'HistoryModel')
+        user = apps.get_model('auth', 'User').objects.create(username='user')
+
+        first = OldHistoryModel.objects.create(user=user, **CITY)
+        OldHistoryModel.objects.create(user=user, **CITY, latitude=55.75, longitude=37.62, timezone='Europe/Moscow')
+        OldHistoryModel.objects.create(user=user, **{**CITY, 'city': 'Тула'})
+        OldHistoryModel.objects.bulk_create([OldHistoryModel(user=None, **CITY) for _ in range(2)])
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.after)
+
+        self.assertEqual(HistoryModel.objects.filter(user_id=user.pk).count(), 2)
+        moscow = HistoryModel.objects.get(user_id=user.pk, city='Москва')
+        self.assertEqual((moscow.pk, moscow.hit_count, moscow.timezone), (first.pk, 2, 'Europe/Moscow'))
+        self.assertEqual(HistoryModel.objects.filter(user=None).count(), 2)
+
+
+class RollupHistoryTest(TestCase):
+    def _create(self, days_ago, count, user=None, city='Москва'):
+        rows = HistoryModel.objects.bulk_create([HistoryModel(user=user, **{**CITY, 'city': city}) for _ in range(count)])
+        HistoryModel.objects.filter(pk__in=[row.pk for row in rows]).update(
+            timestamp=timezone.now() - timedelta(days=days_ago)
+        )
+
+    def test_old_anonymous_rows_are_rolled_up(self):
+        user = User.objects.create_user(username='user', password='password')
+        self._create(40, 3)
+        self._create(40, 1, city='Тула')
+        self._create(45, 2)
+        self._create(40, 1, user=user)
+        self._create(1, 2)
+        # Поиски, уже учтенные счетчиком при записи, не удваиваются
+        day = timezone.localdate() - timedelta(days=45)
+        CityDailySearchCount.objects.create(city='Москва', day=day, count=5)
+
+        call_command('rollup_history', '--days', '30', '--batch-size', '2', stdout=StringIO())
+
+        self.assertEqual(HistoryModel.objects.filter(user=None).count(), 2)
+        self.assertTrue(HistoryModel.objects.filter(user=user).exists())
+        counts = dict(CityDailySearchCount.objects.filter(city='Москва').values_list('day', 'count'))
+        self.assertEqual(counts[day], 5)
+        self.assertEqual(counts[timezone.localdate() - timedelta(days=40)], 3)
+        self.assertEqual(CityDailySearchCount.objects.get(city='Тула').count, 1)
+
+    def test_backfill_after_rollup_keeps_rolled_up_counts(self):
+        user = User.objects.create_user(username='user', password='password')
+        self._create(40, 3)
+        self._create(40, 1, user=user)
+        self._create(41, 1, user=user, city='Тула')
+        day = timezone.localdate() - timedelta(days=40)
+        CityDailySearchCount.objects.create(city='Москва', day=day, count=4)
+
+        call_command('rollup_history', '--days', '30', stdout=StringIO())
+        call_command('backfill_city_search_counts', '--retention-days', '30', stdout=StringIO())
+
+        # Остались только поиски пользователя (1), счетчик свернутого дня не уменьшается
+        self.assertEqual(CityDailySearchCount.objects.get(city='Москва', day=day).count, 4)
+        self.assertEqual(CityDailySearchCount.objects.get(city='Тула').count, 1)
+
+    def test_nothing_to_roll_up(self):
+        self._create(1, 2)
+
+        out = StringIO()
+        call_command('rollup_history', stdout=out)
+
+        self.assertIn(': 0', out.getvalue())
+        self.assertEqual(HistoryModel.objects.count(), 2)
+
+
+class ExportHistoryTest(TestCase):
+    def test_export_to_file(self):
+        HistoryModel.objects.bulk_create([HistoryModel(**CITY) for _ in range(5)])
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'history.jsonl')
+            with patch('search_history.export.CHUNK_SIZE', 2):
+                call_command('export_history', '--format', 'jsonl', '--output', path)
+
+            with open(path, encoding='utf-8') as output:
+                rows = [json.loads(line) for line in output]
+
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['city'], 'Москва')
+
+    def test_export_to_stdout(self):
+        HistoryModel.objects.create(**CITY)
+
+        out = StringIO()
+        call_command('export_history', stdout=out)
+
+        self.assertEqual(out.getvalue().splitlines()[0].split(',')[:3], ['id', 'user_id', 'city'])
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+
+class TrendingCitiesTest(TestCase):
+    def test_space_saving_keeps_heavy_hitters(self):
+        sketch = SpaceSaving(capacity=5)
+        for i in range(10):
+            sketch.add('Москва')
+            if i < 8:
+                sketch.add('Тула')
+            sketch.add(f'Город {i}')
+
+        self.assertEqual(len(sketch.counts), 5)
+        (first, first_count), (second, second_count) = sketch.top(2)
+        self.assertEqual((first, second), ('Москва', 'Тула'))
+        # Счетчик завышен не больше, чем на error
+        self.assertEqual(second_count - sketch.errors.get('Тула', 0), 8)
+
+    def test_old_buckets_expire(self):
+        trending = TrendingCities(window=3600, bucket=300, capacity=10)
+        now = 1_000_000 * 300
+
+        trending.add('Омск', now=now - 3600)
+        for _ in range(2):
+            trending.add('Москва', now=now - 600)
+        trending.add('Тула', now=now)
+
+        self.assertEqual(trending.top(now=now), [{'city': 'Москва', 'count': 2}, {'city': 'Тула', 'count': 1}])
+        self.assertEqual(trending.top(now=now + 3300), [{'city': 'Тула', 'count': 1}])
+        self.assertEqual(len(trending._buckets), 1)
+
+    @override_settings(HISTORY_WRITE_BEHIND={'ENABLED': False})
+    def test_searches_are_counted(self):
+        trending_cities().clear()
+
+        record_city_search(AnonymousUser(), CITY)
+        record_city_search(AnonymousUser(), {**CITY, 'city': 'Тула'})
+        record_city_search(AnonymousUser(), CITY)
+
+        self.assertEqual(trending_cities().top(1), [{'city': 'Москва', 'count': 2}])
@@ -0,0 +1,117 @@
+# "Сейчас ищут": самые популярные города за последний час без запросов к БД.
+# Поиски считаются в памяти процесса по интервалам (bucket) фиксированной длины, в каждом интервале -
+# не больше capacity городов (алгоритм Space-Saving), поэтому память и время ответа не зависят от кол-ва поисков.
+# Счетчики у каждого воркера свои.
+import threading
+import time
+
+from django.conf import settings
+
+
+class SpaceSaving:
+    """
+    Приближенный top-K (Space-Saving): хранится не больше capacity счетчиков.
+    Новый элемент при заполненной таблице занимает место элемента с минимальным счетчиком
+    и получает его счетчик + 1, так что счетчик может быть завышен не больше, чем на error.
+    """
+
+    __slots__ = ('capacity', 'counts', 'errors')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+
+    def add(self, item, count=1):
+        if item in self.counts:
+            self.counts[item] += count
+            return
+
+        error = 0
+        if len(self.counts) >= self.capacity:
+            evicted = min(self.counts, key=self.counts.__getitem__)
+            error = self.counts.pop(evicted)
+            self.errors.pop(evicted, None)
+
+        self.counts[item] = error + count
+        if error:
+            self.errors[item] = error
+
+    def top(self, limit=None):
+        """[(элемент, счетчик), ...] по убыванию счетчика"""
+
+        items = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+        return items[:limit] if limit else items
+
+
+class TrendingCities:
+    """
+    Популярные города за последние window секунд: window / bucket интервалов,
+    в каждом свой SpaceSaving на capacity городов. Устаревшие интервалы отбрасываются при обращении.
+    """
+
+    def __init__(self, window=3600, bucket=300, capacity=100):
+        self.window = window
+        self.bucket = bucket
+        self.capacity = capacity
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        conf = settings.TRENDING
+        return cls(window=conf['WINDOW'], bucket=conf['BUCKET'], capacity=conf['CAPACITY'])
+
+    def add(self, city, now=None):
+        index = self._index(now)
+
+        with self._lock:
+            sketch = self._buckets.get(index)
+            if sketch is None:
+                self._expire(index)
+                sketch = self._buckets[index] = SpaceSaving(self.capacity)
+            sketch.add(city)
+
+    def top(self, limit=10, now=None):
+        """[{'city', 'count'}, ...] за последние window секунд, по убыванию кол-ва поисков"""
+
+        index = self._index(now)
+
+        with self._lock:
+            self._expire(index)
+            totals = SpaceSaving(self.capacity * len(self._buckets) or 1)
+            for sketch in self._buckets.values():
+                for city, count in sketch.counts.items():
+                    totals.add(city, count)
+
+        return [{'city': city, 'count': count} for city, count in totals.top(limit)]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def _index(self, now):
+        return int((time.time() if now is None else now) // self.bucket)
+
+    def _expire(self, index):
+        oldest = index - self.window // self.bucket + 1
+        for stale in [i for i in self._buckets if i < oldest]:
+            del self._buckets[stale]
+
+
+_trending = None
+_trending_lock = threading.Lock()
+
+
+def trending_cities():
+    """Счетчики популярных городов, общие для процесса"""
+
+    global _trending
+
+    if _trending is None:
+        with _trending_lock:
+            if _trending is None:
+                _trending = TrendingCities.from_settings()
+
+    return _trending
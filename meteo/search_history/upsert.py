@@ -0,0 +1,74 @@
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import HistoryModel
+
+
+def upsert_user_history(user_id, city_values_dict, hits=1, searched_at=None):
+    """
+    Записывает поиск города пользователем: новая запись истории или hit_count + hits
+    и новое last_searched у существующей (одним INSERT ... ON CONFLICT, где БД его поддерживает).
+    Координаты существующей записи обновляются, если они известны.
+    """
+    searched_at = searched_at or timezone.now()
+    lookup, location = HistoryModel.split_location(city_values_dict)
+
+    if connection.features.supports_update_conflicts_with_target:
+        _upsert(user_id, lookup, location, hits, searched_at)
+    else:
+        _update_or_create(user_id, lookup, location, hits, searched_at)
+
+
+def _upsert(user_id, lookup, location, hits, searched_at):
+    qn = connection.ops.quote_name
+    table = qn(HistoryModel._meta.db_table)
+
+    def column(name):
+        return qn(HistoryModel._meta.get_field(name).column)
+
+    adapt = connection.ops.adapt_datetimefield_value
+    values = {
+        'user': user_id,
+        **{field: lookup[field] for field in HistoryModel.LOOKUP_FIELDS},
+        'latitude': location.get('latitude'),
+        'longitude': location.get('longitude'),
+        'timezone': location.get('timezone') or '',
+        'timestamp': adapt(searched_at),
+        'last_searched': adapt(searched_at),
+        'hit_count': hits,
+    }
+
+    conflict = ', '.join(column(field) for field in ('user', *HistoryModel.LOOKUP_FIELDS))
+    sql = (
+        f'INSERT INTO {table} ({", ".join(column(field) for field in values)}) '
+        f'VALUES ({", ".join(["%s"] * len(values))}) '
+        # Условие частичного уникального индекса unique_user_history_city
+        f'ON CONFLICT ({conflict}) WHERE {column("user")} IS NOT NULL DO UPDATE SET '
+        f'{column("hit_count")} = {table}.{column("hit_count")} + excluded.{column("hit_count")}, '
+        f'{column("last_searched")} = excluded.{column("last_searched")}, '
+        f'{column("latitude")} = COALESCE(excluded.{column("latitude")}, {table}.{column("latitude")}), '
+        f'{column("longitude")} = COALESCE(excluded.{column("longitude")}, {table}.{column("longitude")}), '
+        f'{column("timezone")} = COALESCE(NULLIF(excluded.{column("timezone")}, \'\'), {table}.{column("timezone")})'
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, list(values.values()))
+
+
+def _update_or_create(user_id, lookup, location, hits, searched_at):
+    """Для БД без ON CONFLICT: обновление, а если записи нет - создание (как increment_city_search_counts)"""
+
+    rows = HistoryModel.objects.filter(user_id=user_id, **lookup)
+    changes = {'hit_count': F('hit_count') + hits, 'last_searched': searched_at, **location}
+    if rows.update(**changes):
+        return
+
+    try:
+        with transaction.atomic():
+            HistoryModel.objects.create(
+                user_id=user_id, **lookup, **location, hit_count=hits, last_searched=searched_at,
+            )
+    except IntegrityError:
+        # Запись успел создать параллельный запрос
+        rows.update(**changes)
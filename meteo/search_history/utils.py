@@ -1,8 +1,54 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from .buffer import get_history_writer, normalize_city_values
 from .models import HistoryModel
+from .rollup import increment_city_search_counts
+from .trending import trending_cities
+from .upsert import upsert_user_history
 
 
 def add_history_city_to_user(user, city_values_dict):
-    """Добавляет новый объект HistoryModel с указанным user в БД"""
+    """Добавляет город в историю user или увеличивает hit_count уже сохраненного"""
+
+    upsert_user_history(user.pk, city_values_dict)
+
+
+def record_city_search(user, city_values_dict):
+    """
+    Сохраняет поиск города в историю БД.
+
+    Для авторизованного пользователя у города одна запись истории (last_searched, hit_count),
+    поиск неавторизованного пользователя сохраняется отдельной записью без user.
+    Вместе с записью увеличивается счетчик поисков города (CityDailySearchCount), по нему считается total-city-searched/.
+    Если включен HISTORY_WRITE_BEHIND, запись только ставится в очередь буфера.
+    Поиск также учитывается в trending_cities ("сейчас ищут").
+    """
+    user_id = user.pk if user.is_authenticated else None
+    city_values_dict = normalize_city_values(city_values_dict)
+    trending_cities().add(city_values_dict['city'])
+
+    if settings.HISTORY_WRITE_BEHIND['ENABLED']:
+        get_history_writer().add(user_id, city_values_dict)
+        return
+
+    with transaction.atomic():
+        if user_id is None:
+            HistoryModel.objects.create(user=None, **city_values_dict)
+        else:
+            add_history_city_to_user(user, city_values_dict)
+
+        increment_city_search_counts([city_values_dict['city']])
+
+
+async def arecord_city_search(user, city_values_dict):
+    """Асинхронная версия record_city_search"""
+
+    if settings.HISTORY_WRITE_BEHIND['ENABLED']:
+        user_id = user.pk if user.is_authenticated else None
+        trending_cities().add(city_values_dict['city'])
+        get_history_writer().add(user_id, city_values_dict)
+        return
 
-    obj, created = HistoryModel.objects.get_or_create(user=user, **city_values_dict)
-    return created
+    await sync_to_async(record_city_search)(user, city_values_dict)
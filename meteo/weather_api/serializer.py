@@ -1,6 +1,94 @@
 from rest_framework import serializers
+from search_history.export import EXPORT_FORMATS
 
 
 class CityStatSerializer(serializers.Serializer):
     city = serializers.CharField()
-    count = serializers.IntegerField()
\ No newline at end of file
+    count = serializers.IntegerField()
+
+
+class CityStatQuerySerializer(serializers.Serializer):
+    """Параметры запроса total-city-searched/"""
+
+    WINDOW_DAYS = {
+        'day': 1,
+        'week': 7,
+        'month': 30,
+    }
+
+    window = serializers.ChoiceField(choices=list(WINDOW_DAYS), required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, required=False)
+    offset = serializers.IntegerField(min_value=0, default=0)
+
+
+class TrendingQuerySerializer(serializers.Serializer):
+    """Параметры запроса trending/"""
+
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+
+class ForecastCompareQuerySerializer(serializers.Serializer):
+    """
+    Параметры запроса forecast/compare/.
+
+    locations - координаты через ";" ("55.75,37.62;59.94,30.31"), без них берутся последние города из истории поиска
+    """
+
+    MAX_LOCATIONS = 10
+
+    locations = serializers.CharField(required=False)
+    forecast_days = serializers.IntegerField(min_value=1, max_value=16, default=3)
+
+    def validate_locations(self, value):
+        locations = []
+        for item in value.split(';'):
+            try:
+                lat, lon = (float(part) for part in item.split(','))
+            except ValueError:
+                raise serializers.ValidationError(f'Некорректные координаты: {item}')
+
+            if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                raise serializers.ValidationError(f'Координаты вне допустимого диапазона: {item}')
+            locations.append({'city': item, 'latitude': lat, 'longitude': lon})
+
+        if len(locations) > self.MAX_LOCATIONS:
+            raise serializers.ValidationError(f'Не больше {self.MAX_LOCATIONS} точек в запросе')
+        return locations
+
+
+class DailySummarySerializer(serializers.Serializer):
+    date = serializers.DateField()
+    temperature_min = serializers.FloatField()
+    temperature_max = serializers.FloatField()
+    rain = serializers.FloatField()
+
+
+class CityForecastSerializer(serializers.Serializer):
+    city = serializers.CharField()
+    country = serializers.CharField(allow_blank=True)
+    country_code = serializers.CharField(allow_blank=True)
+    admin = serializers.CharField(allow_blank=True)
+    latitude = serializers.FloatField(allow_null=True)
+    longitude = serializers.FloatField(allow_null=True)
+    timezone = serializers.CharField(allow_null=True)
+    stale = serializers.BooleanField()
+    fetched_at = serializers.CharField(allow_null=True)
+    current_weather = serializers.DictField(allow_null=True)
+    daily = DailySummarySerializer(many=True)
+    error = serializers.CharField(allow_null=True)
+
+
+class ForecastQuerySerializer(serializers.Serializer):
+    """Параметры запроса forecast/"""
+
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+    forecast_days = serializers.IntegerField(min_value=1, max_value=16, default=3)
+
+
+class HistoryExportQuerySerializer(serializers.Serializer):
+    """Параметры запроса history/export/ (параметр format занят DRF, поэтому output)"""
+
+    output = serializers.ChoiceField(choices=list(EXPORT_FORMATS), default='csv')
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
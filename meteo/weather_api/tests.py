@@ -1,3 +1,218 @@
+import csv
+import io
+import json
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from search_history.models import CityDailySearchCount, HistoryModel
+from search_history.trending import trending_cities
+from weather_search.tests import OpenMeteoStubMixin
+from unittest.mock import patch
+import niquests
+
+
+class TotalCitySearchedViewTest(TestCase):
+    def setUp(self):
+        today = timezone.localdate()
+        CityDailySearchCount.objects.bulk_create([
+            CityDailySearchCount(city='Москва', day=today, count=3),
+            CityDailySearchCount(city='Москва', day=today - timedelta(days=10), count=4),
+            CityDailySearchCount(city='Тула', day=today, count=5),
+            CityDailySearchCount(city='Омск', day=today - timedelta(days=3), count=1),
+        ])
+
+    def test_all_time_counts(self):
+        response = self.client.get(reverse('weather_api:total_search'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [
+            {'city': 'Москва', 'count': 7},
+            {'city': 'Тула', 'count': 5},
+            {'city': 'Омск', 'count': 1},
+        ])
+
+    def test_window(self):
+        response = self.client.get(reverse('weather_api:total_search'), {'window': 'day'})
+        self.assertEqual(response.json(), [{'city': 'Тула', 'count': 5}, {'city': 'Москва', 'count': 3}])
+
+        response = self.client.get(reverse('weather_api:total_search'), {'window': 'week'})
+        self.assertEqual([row['city'] for row in response.json()], ['Тула', 'Москва', 'Омск'])
+
+    def test_limit_and_offset(self):
+        response = self.client.get(reverse('weather_api:total_search'), {'limit': 1, 'offset': 1})
+        self.assertEqual(response.json(), [{'city': 'Тула', 'count': 5}])
+
+    def test_invalid_params(self):
+        for params in ({'window': 'year'}, {'limit': 0}, {'offset': -1}):
+            with self.subTest(params=params):
+                response = self.client.get(reverse('weather_api:total_search'), params)
+                self.assertEqual(response.status_code, 400)
+
+    def test_server_timing(self):
+        response = self.client.get(reverse('weather_api:total_search'))
+
+        self.assertIn('stats;dur=', response['Server-Timing'])
+        self.assertIn('db;desc="1 queries"', response['Server-Timing'])
+
+
+class ForecastCompareViewTest(OpenMeteoStubMixin, TestCase):
+    def test_explicit_locations(self):
+        response = self.client.get(reverse('weather_api:forecast_compare'), {
+            'locations': '55.75,37.62;51.51,-0.13', 'forecast_days': 2,
+        })
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([row['timezone'] for row in data], ['Europe/Moscow', 'Europe/London'])
+        self.assertEqual(len(data[0]['daily']), 2)
+        self.assertEqual(set(data[0]['current_weather']), {'temperature', 'apparent_temperature', 'humidity', 'rain', 'is_day'})
+        self.assertIsNone(data[0]['error'])
+
+    def test_user_history(self):
+        user = get_user_model().objects.create_user(username='user', password='password')
+        HistoryModel.objects.create(
+            user=user, city='Москва', country='Россия', country_code='RU', admin='Москва', forecast_days=1,
+            latitude=55.75222, longitude=37.61556, timezone='Europe/Moscow',
+        )
+        self.client.force_login(user)
+
+        response = self.client.get(reverse('weather_api:forecast_compare'))
+
+        self.assertEqual([row['city'] for row in response.json()], ['Москва'])
+        self.assertEqual(len(response.json()[0]['daily']), 3)
+
+    def test_invalid_params(self):
+        for params in ({'locations': 'abc'}, {'locations': '95,10'}, {'forecast_days': 17},
+                       {'locations': ';'.join(['1,1'] * 11)}):
+            with self.subTest(params=params):
+                response = self.client.get(reverse('weather_api:forecast_compare'), params)
+                self.assertEqual(response.status_code, 400)
+
+
+class ForecastViewTest(OpenMeteoStubMixin, TestCase):
+    PARAMS = {'latitude': 55.75222, 'longitude': 37.61556, 'forecast_days': 2}
+
+    def test_columnar_forecast(self):
+        response = self.client.get(reverse('weather_api:forecast'), self.PARAMS)
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['latitude'], data['longitude']), (55.75, 37.62))
+        self.assertEqual(data['timezone'], 'Europe/Moscow')
+        self.assertFalse(data['stale'])
+        self.assertEqual(
+            set(data['hourly']),
+            {'time', 'temperature', 'apparent_temperature', 'humidity', 'rain', 'is_day', 'wind_speed'},
+        )
+        self.assertTrue(all(len(values) == 48 for values in data['hourly'].values()))
+        self.assertEqual(data['hourly']['time'][1] - data['hourly']['time'][0], data['hourly_interval'])
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+        self.assertIn('max-age=', response['Cache-Control'])
+
+    def test_not_modified_for_same_etag(self):
+        response = self.client.get(reverse('weather_api:forecast'), self.PARAMS)
+
+        response = self.client.get(reverse('weather_api:forecast'), self.PARAMS, HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_not_modified_since(self):
+        response = self.client.get(reverse('weather_api:forecast'), self.PARAMS)
+
+        response = self.client.get(
+            reverse('weather_api:forecast'), self.PARAMS, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_with_forecast(self):
+        first = self.client.get(reverse('weather_api:forecast'), self.PARAMS)['ETag']
+        other = self.client.get(reverse('weather_api:forecast'), {**self.PARAMS, 'forecast_days': 3})
+
+        self.assertNotEqual(other['ETag'], first)
+        response = self.client.get(
+            reverse('weather_api:forecast'), {**self.PARAMS, 'forecast_days': 3}, HTTP_IF_NONE_MATCH=first
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_upstream_error(self):
+        with patch('weather_search.upstream.openmeteo_requests.Client.weather_api', side_effect=niquests.ConnectionError):
+            response = self.client.get(reverse('weather_api:forecast'), self.PARAMS)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('detail', response.json())
+
+    def test_invalid_params(self):
+        for params in ({'latitude': 91, 'longitude': 0}, {'latitude': 'abc', 'longitude': 0}, {'latitude': 10},
+                       {**self.PARAMS, 'forecast_days': 0}):
+            with self.subTest(params=params):
+                response = self.client.get(reverse('weather_api:forecast'), params)
+                self.assertEqual(response.status_code, 400)
+
+
+class HistoryExportViewTest(TestCase):
+    def setUp(self):
+        HistoryModel.objects.bulk_create([
+            HistoryModel(city='Москва', country='Россия', country_code='RU', admin='Москва', forecast_days=1),
+            HistoryModel(city='Тула', country='Россия', country_code='RU', admin='Тульская', forecast_days=2,
+                         latitude=54.19, longitude=37.62, timezone='Europe/Moscow'),
+        ])
+        self.admin = get_user_model().objects.create_user(username='admin', password='password', is_staff=True)
+
+    def test_only_staff(self):
+        self.assertEqual(self.client.get(reverse('weather_api:history_export')).status_code, 403)
+
+        self.client.force_login(get_user_model().objects.create_user(username='user', password='password'))
+        self.assertEqual(self.client.get(reverse('weather_api:history_export')).status_code, 403)
+
+    def test_csv(self):
+        self.client.force_login(self.admin)
+
+        response = self.client.get(reverse('weather_api:history_export'))
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([row['city'] for row in rows], ['Москва', 'Тула'])
+        self.assertEqual((rows[0]['latitude'], rows[1]['timezone']), ('', 'Europe/Moscow'))
+
+    def test_jsonl_for_period(self):
+        self.client.force_login(self.admin)
+        HistoryModel.objects.filter(city='Москва').update(timestamp=timezone.now() - timedelta(days=5))
+
+        response = self.client.get(reverse('weather_api:history_export'), {
+            'output': 'jsonl', 'since': timezone.localdate().isoformat(),
+        })
+
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['city'] for row in rows], ['Тула'])
+        self.assertEqual(rows[0]['latitude'], 54.19)
+
+    def test_invalid_params(self):
+        self.client.force_login(self.admin)
+
+        for params in ({'output': 'xml'}, {'since': '01.01.2025'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(reverse('weather_api:history_export'), params).status_code, 400)
+
+
+class TrendingCitiesViewTest(TestCase):
+    def setUp(self):
+        trending_cities().clear()
+        for city in ['Москва', 'Тула', 'Москва', 'Омск', 'Москва', 'Тула']:
+            trending_cities().add(city)
+
+    def test_top_cities(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('weather_api:trending'), {'limit': 2})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{'city': 'Москва', 'count': 3}, {'city': 'Тула', 'count': 2}])
 
-# Create your tests here.
+    def test_invalid_limit(self):
+        self.assertEqual(self.client.get(reverse('weather_api:trending'), {'limit': 0}).status_code, 400)
@@ -1,4 +1,4 @@
-from .views import TotalCitySearchedView
+from .views import TotalCitySearchedView, TrendingCitiesView, ForecastCompareView, ForecastView, HistoryExportView
 from django.urls import path
 
 
@@ -7,4 +7,8 @@ app_name = 'weather_api'
 
 urlpatterns = [
     path('total-city-searched/', TotalCitySearchedView.as_view(), name='total_search'),
+    path('trending/', TrendingCitiesView.as_view(), name='trending'),
+    path('forecast/', ForecastView.as_view(), name='forecast'),
+    path('forecast/compare/', ForecastCompareView.as_view(), name='forecast_compare'),
+    path('history/export/', HistoryExportView.as_view(), name='history_export'),
 ]
\ No newline at end of file
@@ -1,18 +1,154 @@
-from django.db.models import Count
-from search_history.models import HistoryModel
+from datetime import datetime, timezone as dt_timezone
+
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser
+from search_history.export import EXPORT_FORMATS, history_for_export
+from search_history.rollup import top_searched_cities
+from search_history.trending import trending_cities
+from weather_search.compare import compare_forecasts
+from weather_search.forecast import (get_forecast, round_to_grid, forecast_cache_ttl, forecast_etag,
+                                     build_current_weather, build_hourly_columns, ForecastApiException)
+from weather_search.timing import phase
+from weather_search.utils import CityHistoryContextService
 from rest_framework.views import APIView
-from .serializer import CityStatSerializer
+from .serializer import (CityStatSerializer, CityStatQuerySerializer, TrendingQuerySerializer,
+                         ForecastCompareQuerySerializer, CityForecastSerializer, ForecastQuerySerializer,
+                         HistoryExportQuerySerializer)
 from rest_framework.response import Response
 
 
 class TotalCitySearchedView(APIView):
+    """
+    Кол-во поисков по городам, по убыванию.
+
+    Данные берутся из счетчиков по дням (CityDailySearchCount), а не из всей истории поиска.
+    Параметры: window=day|week|month - период, limit/offset - top-N и постраничный вывод.
+    """
+
+    def get(self, request, *args, **kwargs):
+        query = CityStatQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        window = params.get('window')
+        stats = top_searched_cities(CityStatQuerySerializer.WINDOW_DAYS[window] if window else None)
+
+        offset = params['offset']
+        limit = params.get('limit')
+        stats = stats[offset:offset + limit] if limit else stats[offset:]
+
+        with phase('stats'):
+            data = CityStatSerializer(stats, many=True).data
+        return Response(data)
+
+
+class TrendingCitiesView(APIView):
+    """
+    Самые популярные города за последний час (TRENDING['WINDOW']), по убыванию кол-ва поисков.
+
+    Считается в памяти процесса (trending_cities) без обращения к БД, limit - кол-во городов.
+    """
+
+    def get(self, request, *args, **kwargs):
+        query = TrendingQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+
+        with phase('stats'):
+            data = CityStatSerializer(trending_cities().top(query.validated_data['limit']), many=True).data
+        return Response(data)
+
+
+class ForecastCompareView(APIView):
+    """
+    Прогноз для нескольких точек одним запросом к Open-Meteo.
+
+    Параметры: locations=lat,lon;lat,lon (без них - последние города из истории поиска пользователя),
+    forecast_days - кол-во дней. Для каждой точки - текущая погода и сводка по дням.
+    """
+
+    def get(self, request, *args, **kwargs):
+        query = ForecastCompareQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        cities = params.get('locations')
+        if cities is None:
+            with phase('history'):
+                cities = CityHistoryContextService.get_city_history(request.user, request.session)
+
+        with phase('forecast'):
+            rows = compare_forecasts(cities, params['forecast_days'])
+
+        return Response(CityForecastSerializer(rows, many=True).data)
+
+
+class ForecastView(APIView):
+    """
+    Прогноз для координат в виде столбцов: ось времени (unix, UTC) и по массиву на каждую почасовую переменную.
+
+    Ответ содержит ETag (отпечаток данных прогноза) и Last-Modified (время получения прогноза от Open-Meteo),
+    на запрос с If-None-Match / If-Modified-Since для неизменившегося прогноза отдается 304 без тела.
+    """
+
+    def get(self, request, *args, **kwargs):
+        query = ForecastQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        try:
+            with phase('forecast'):
+                forecast = get_forecast(params['latitude'], params['longitude'], params['forecast_days'])
+        except ForecastApiException as e:
+            return Response({'detail': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        etag = quote_etag(forecast_etag(forecast))
+        last_modified = int(forecast.fetched_at)
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is None:
+            latitude, longitude = round_to_grid(params['latitude'], params['longitude'])
+            with phase('forecast_build'):
+                data = {
+                    'latitude': latitude,
+                    'longitude': longitude,
+                    'timezone': forecast.timezone,
+                    'forecast_days': params['forecast_days'],
+                    'stale': forecast.stale,
+                    'fetched_at': datetime.fromtimestamp(last_modified, dt_timezone.utc).isoformat(),
+                    'current': build_current_weather(forecast),
+                    'hourly_interval': forecast.hourly_interval,
+                    'hourly': build_hourly_columns(forecast),
+                }
+            response = Response(data)
+        else:
+            response = not_modified
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        # Устаревший прогноз клиент должен перепроверить при следующем запросе
+        patch_cache_control(response, max_age=0 if forecast.stale else forecast_cache_ttl())
+        return response
+
+
+class HistoryExportView(APIView):
+    """
+    Выгрузка истории поиска (только для staff): output=csv|jsonl, since/until - период по дате поиска.
+    Ответ отдается потоком, записи читаются из БД пачками.
+    """
+
+    permission_classes = [IsAdminUser]
+
     def get(self, request, *args, **kwargs):
-        stats = (
-            HistoryModel
-            .objects.values('city')
-            .annotate(count=Count('city'))
-            .order_by('-count')
-        )
-
-        serializer = CityStatSerializer(stats, many=True)
-        return Response(serializer.data)
+        query = HistoryExportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        export, content_type, extension = EXPORT_FORMATS[params['output']]
+        history = history_for_export(params.get('since'), params.get('until'))
+
+        response = StreamingHttpResponse(export(history), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="history.{extension}"'
+        return response
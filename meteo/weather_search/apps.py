@@ -6,3 +6,9 @@ class WeatherSearchConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'weather_search'
 
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .timing import install_query_counter
+
+        # Подсчет SQL-запросов для Server-Timing и /metrics/
+        connection_created.connect(install_query_counter, dispatch_uid='weather_search_query_counter')
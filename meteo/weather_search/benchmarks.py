@@ -0,0 +1,150 @@
+# Микробенчмарки обработки прогноза между ответом Open-Meteo и HTML-страницей:
+# разбор FlatBuffers, текущая погода, почасовая таблица (часовые пояса, группировка по дням) и рендер шаблона.
+# Ответы синтетические (как у заглушки openmeteo_stub), время фиксировано, поэтому замеры повторяемы.
+import json
+import platform
+import statistics
+import timeit
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+import django
+import numpy as np
+from django.contrib.auth.models import AnonymousUser
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
+
+from .forecast import snapshot_from_response, build_current_weather, build_hourly_by_day
+from .openmeteo_stub import forecast_message
+from .weather_variables import FORECAST_CURRENT_PARAMS, FORECAST_HOURLY_PARAMS
+
+
+BASELINE_PATH = Path(__file__).resolve().parent / 'benchmark_baseline.json'
+
+# 2025-01-15 12:00 UTC, Москва
+BENCHMARK_NOW = 1736942400
+BENCHMARK_LOCATION = (55.75, 37.62)
+
+STAGES = ('decode', 'current', 'hourly', 'render', 'total')
+
+
+class ForecastBenchmark:
+    """Подготовленные данные для замера этапов обработки прогноза на forecast_days дней"""
+
+    def __init__(self, forecast_days):
+        self.forecast_days = forecast_days
+        self.payload = forecast_message(
+            *BENCHMARK_LOCATION, FORECAST_CURRENT_PARAMS, FORECAST_HOURLY_PARAMS, forecast_days, now=BENCHMARK_NOW
+        )
+
+        self.snapshot = self.decode()
+        self.tz = ZoneInfo(self.snapshot.timezone)
+        # С местной полуночи, чтобы в таблицу попадали все forecast_days * 24 часов
+        self.now = datetime.fromtimestamp(self.snapshot.hourly_time, dt_timezone.utc)
+
+        self.request = RequestFactory().get('/search/', {'city': 'Москва', 'forecast_days': forecast_days})
+        self.request.user = AnonymousUser()
+        self.context = self.build_context(self.snapshot)
+
+    def decode(self):
+        return snapshot_from_response(WeatherApiResponse.GetRootAs(self.payload, 0))
+
+    def current(self):
+        return build_current_weather(self.snapshot)
+
+    def hourly(self):
+        return build_hourly_by_day(self.snapshot, self.tz, now=self.now)
+
+    def render(self):
+        return render_to_string('weather_search/search.html', self.context, request=self.request)
+
+    def total(self):
+        context = self.build_context(self.decode())
+        return render_to_string('weather_search/search.html', context, request=self.request)
+
+    def build_context(self, snapshot):
+        return {
+            'city_name': 'Москва',
+            'country': 'Россия',
+            'country_code': 'RU',
+            'admin': 'Москва',
+            'latitude': BENCHMARK_LOCATION[0],
+            'longitude': BENCHMARK_LOCATION[1],
+            'forecast_days': self.forecast_days,
+            'current_weather': build_current_weather(snapshot),
+            'hourly_by_day': build_hourly_by_day(snapshot, ZoneInfo(snapshot.timezone), now=self.now),
+        }
+
+    def hourly_rows(self):
+        return sum(len(rows) for rows in self.context['hourly_by_day'].values())
+
+
+def run_benchmarks(days=range(1, 17), stages=STAGES, repeat=5, min_time=0.05):
+    """
+    Замеряет этапы для каждого forecast_days.
+
+    Каждый замер повторяется repeat раз по number вызовов, number подбирается так, чтобы замер шел
+    примерно min_time секунд. Возвращает {stage: {days: {'median': сек, 'min': сек}}} на один вызов.
+    """
+    results = {stage: {} for stage in stages}
+
+    for forecast_days in days:
+        benchmark = ForecastBenchmark(forecast_days)
+
+        for stage in stages:
+            timer = timeit.Timer(getattr(benchmark, stage))
+            single = timer.timeit(number=1)
+            number = max(1, int(min_time / single)) if single else 1
+            timings = [elapsed / number for elapsed in timer.repeat(repeat=repeat, number=number)]
+            results[stage][forecast_days] = {'median': statistics.median(timings), 'min': min(timings)}
+
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'platform': platform.platform(terse=True),
+    }
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    data = {
+        'environment': environment(),
+        'created': datetime.now(dt_timezone.utc).isoformat(timespec='seconds'),
+        'results': {
+            stage: {str(forecast_days): timing for forecast_days, timing in by_days.items()}
+            for stage, by_days in results.items()
+        },
+    }
+    Path(path).write_text(json.dumps(data, indent=2, sort_keys=True) + '\n', encoding='utf-8')
+
+
+def load_baseline(path=BASELINE_PATH):
+    data = json.loads(Path(path).read_text(encoding='utf-8'))
+    data['results'] = {
+        stage: {int(forecast_days): timing for forecast_days, timing in by_days.items()}
+        for stage, by_days in data['results'].items()
+    }
+    return data
+
+
+def compare(results, baseline, threshold=1.25):
+    """
+    Сравнение медиан с baseline: [(stage, days, сейчас, baseline, отношение, регрессия), ...].
+    Регрессия - замедление больше чем в threshold раз.
+    """
+    rows = []
+    for stage, by_days in results.items():
+        for forecast_days, timing in by_days.items():
+            base = baseline.get(stage, {}).get(forecast_days)
+            if base is None:
+                continue
+            ratio = timing['median'] / base['median'] if base['median'] else float('inf')
+            rows.append((stage, forecast_days, timing['median'], base['median'], ratio, ratio > threshold))
+    return rows
@@ -0,0 +1,129 @@
+import threading
+import time
+
+
+class CircuitOpenError(Exception):
+    """Запрос не выполнялся: сервис недавно отвечал ошибками, цепь разомкнута"""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для обращений к внешнему сервису.
+
+    closed - запросы выполняются, ошибки подряд считаются;
+    open - после failure_threshold ошибок подряд запросы сразу завершаются CircuitOpenError;
+    half_open - через recovery_timeout секунд пропускается один пробный запрос:
+    успех замыкает цепь, ошибка снова размыкает её.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and self._recovery_elapsed():
+                return self.HALF_OPEN
+            return self._state
+
+    def is_open(self):
+        """True, если запрос сейчас точно не будет выполнен (без занятия пробного запроса)"""
+
+        with self._lock:
+            if self._state == self.OPEN:
+                return not self._recovery_elapsed()
+            return self._state == self.HALF_OPEN and self._probe_in_flight
+
+    def allow_request(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+
+            if self._state == self.OPEN:
+                if not self._recovery_elapsed():
+                    return False
+                self._state = self.HALF_OPEN
+
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self._failures += 1
+            self.last_error = error
+            self._probe_in_flight = False
+
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def reset(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+            self.last_error = None
+
+    def call(self, func, *args, **kwargs):
+        """Выполняет func через предохранитель, любое исключение func считается ошибкой сервиса"""
+
+        if not self.allow_request():
+            raise CircuitOpenError(self.name)
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        except BaseException:
+            self._release_probe()
+            raise
+
+        self.record_success()
+        return result
+
+    async def acall(self, func, *args, **kwargs):
+        """Асинхронный вариант call для корутинных функций"""
+
+        if not self.allow_request():
+            raise CircuitOpenError(self.name)
+
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        except BaseException:
+            # Отмена запроса не говорит о состоянии сервиса, но пробный запрос нужно освободить
+            self._release_probe()
+            raise
+
+        self.record_success()
+        return result
+
+    def _release_probe(self):
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _recovery_elapsed(self):
+        return time.monotonic() - self._opened_at >= self.recovery_timeout
@@ -0,0 +1,104 @@
+# Сравнение прогноза для нескольких городов ("Мои города"): прогнозы всех городов запрашиваются
+# у Open-Meteo одним запросом (get_forecasts) и используют тот же кэш, что и поиск одного города.
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from .forecast import get_forecasts, aget_forecasts, build_current_weather, build_daily_summary, FORECAST_REQUEST_FAILED
+from .utils import geo_coding_request, async_geo_coding_request, GeoApiException
+
+
+def compare_forecasts(cities, forecast_days):
+    """
+    Прогнозы для городов из истории поиска: [{city, country, ..., current_weather, daily, stale, error}, ...].
+    Города без сохраненных координат (записи до их появления) сначала геокодируются.
+    """
+    cities = [_with_location(city) for city in cities]
+    located = [city for city in cities if city.get('error') is None]
+
+    forecasts = get_forecasts([(city['latitude'], city['longitude']) for city in located], forecast_days)
+    return _build_rows(cities, located, forecasts)
+
+
+async def acompare_forecasts(cities, forecast_days):
+    """Асинхронная версия compare_forecasts"""
+
+    cities = [await _awith_location(city) for city in cities]
+    located = [city for city in cities if city.get('error') is None]
+
+    forecasts = await aget_forecasts([(city['latitude'], city['longitude']) for city in located], forecast_days)
+    return _build_rows(cities, located, forecasts)
+
+
+def _with_location(city):
+    city = dict(city)
+    if city.get('latitude') is not None and city.get('longitude') is not None:
+        return city
+
+    try:
+        geo_data = geo_coding_request(
+            city=city['city'], country_code=city.get('country_code') or None, admin=city.get('admin') or None
+        )
+    except GeoApiException as e:
+        city['error'] = str(e)
+        return city
+
+    return _apply_location(city, geo_data)
+
+
+async def _awith_location(city):
+    city = dict(city)
+    if city.get('latitude') is not None and city.get('longitude') is not None:
+        return city
+
+    try:
+        geo_data = await async_geo_coding_request(
+            city=city['city'], country_code=city.get('country_code') or None, admin=city.get('admin') or None
+        )
+    except GeoApiException as e:
+        city['error'] = str(e)
+        return city
+
+    return _apply_location(city, geo_data)
+
+
+def _apply_location(city, geo_data):
+    city['latitude'] = geo_data.get('latitude')
+    city['longitude'] = geo_data.get('longitude')
+    city['timezone'] = city.get('timezone') or geo_data.get('timezone')
+    return city
+
+
+def _build_rows(cities, located, forecasts):
+    forecast_by_city = {id(city): forecast for city, forecast in zip(located, forecasts)}
+
+    rows = []
+    for city in cities:
+        row = {
+            'city': city['city'],
+            'country': city.get('country') or '',
+            'country_code': city.get('country_code') or '',
+            'admin': city.get('admin') or '',
+            'latitude': city.get('latitude'),
+            'longitude': city.get('longitude'),
+            'timezone': None,
+            'stale': False,
+            'fetched_at': None,
+            'current_weather': None,
+            'daily': [],
+            'error': city.get('error'),
+        }
+
+        forecast = forecast_by_city.get(id(city))
+        if forecast is None:
+            row['error'] = row['error'] or FORECAST_REQUEST_FAILED
+        else:
+            tz = ZoneInfo(forecast.timezone)
+            row['timezone'] = forecast.timezone
+            row['stale'] = forecast.stale
+            row['fetched_at'] = datetime.fromtimestamp(forecast.fetched_at, tz).strftime('%d.%m.%Y %H:%M')
+            row['current_weather'] = build_current_weather(forecast)
+            row['daily'] = build_daily_summary(forecast, tz)
+
+        rows.append(row)
+
+    return rows
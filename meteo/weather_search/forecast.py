@@ -0,0 +1,670 @@
+import asyncio
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+from .weather_variables import (FORECAST_CURRENT_PARAMS, FORECAST_HOURLY_PARAMS,
+                                VARIABLES_CURRENT, VARIABLES_HOURLY)
+from .circuit import CircuitOpenError
+from .upstream import forecast_client, async_forecast_client, timeout_for, upstream_url, breaker_for
+from .singleflight import SingleFlight, AsyncSingleFlight
+from .utils_basic import round_array
+from .forecast_data import Forecast, HourlyTable
+from .timing import phase
+
+
+# Версия формата записи кэша, меняется вместе со структурой записи
+_CACHE_FORMAT = 3
+
+# Короткий отпечаток набора переменных и формата, чтобы их смена не отдавала старые записи
+_VARIABLES_DIGEST = hashlib.md5(
+    (','.join(FORECAST_CURRENT_PARAMS + ['|'] + FORECAST_HOURLY_PARAMS) + f'|v{_CACHE_FORMAT}').encode()
+).hexdigest()[:8]
+
+FORECAST_REQUEST_FAILED = 'Ошибка при запросе прогноза погоды'
+FORECAST_UNAVAILABLE = 'Сервис прогноза погоды временно недоступен, попробуйте позже'
+
+# Объединение одновременных одинаковых запросов к Open-Meteo
+forecast_flight = SingleFlight()
+async_forecast_flight = AsyncSingleFlight()
+
+
+def forecast_cache():
+    return caches[settings.FORECAST_CACHE['ALIAS']]
+
+
+def round_to_grid(lat, lon):
+    """Округляет координаты до точности сетки кэша"""
+
+    precision = settings.FORECAST_CACHE['GRID_PRECISION']
+    return round(float(lat), precision), round(float(lon), precision)
+
+
+def forecast_cache_key(lat, lon, forecast_days):
+    lat, lon = round_to_grid(lat, lon)
+    return f'forecast:{lat}:{lon}:{forecast_days}:{_VARIABLES_DIGEST}'
+
+
+def forecast_cache_ttl(now=None):
+    """
+    Время жизни записи в секундах - до ближайшего обновления прогноза на стороне Open-Meteo
+    (начало часа + REFRESH_DELAY)
+    """
+    if now is None:
+        now = time.time()
+
+    period = settings.FORECAST_CACHE['REFRESH_PERIOD']
+    delay = settings.FORECAST_CACHE['REFRESH_DELAY']
+
+    return int(period - (now - delay) % period) or period
+
+
+def build_forecast_params(lat, lon, forecast_days):
+    return {
+        "latitude": lat,
+        "longitude": lon,
+        "current": FORECAST_CURRENT_PARAMS,
+        "hourly": FORECAST_HOURLY_PARAMS,
+        "timezone": "auto",
+        "forecast_days": forecast_days,
+    }
+
+
+def build_batch_forecast_params(grid_locations, forecast_days):
+    """Параметры одного запроса прогноза для нескольких точек: Open-Meteo принимает координаты через запятую"""
+
+    return build_forecast_params(
+        ','.join(str(lat) for lat, _ in grid_locations),
+        ','.join(str(lon) for _, lon in grid_locations),
+        forecast_days,
+    )
+
+
+def snapshot_from_response(response):
+    """
+    Переводит ответ Open-Meteo (FlatBuffers) в компактный Forecast для хранения в кэше.
+    Почасовые значения хранятся одной матрицей float32, как и в исходном ответе,
+    и извлекаются целиком через ValuesAsNumpy.
+    """
+    tz_raw = response.Timezone()
+    if isinstance(tz_raw, bytes):
+        tz_name = tz_raw.decode('utf-8', errors='replace')
+    else:
+        tz_name = str(tz_raw)
+
+    current = response.Current()
+    hourly = response.Hourly()
+
+    return Forecast(
+        timezone=tz_name,
+        current=(
+            current.Variables(idx).Value()
+            for idx in range(len(FORECAST_CURRENT_PARAMS))
+        ),
+        hourly_time=hourly.Time(),
+        hourly_interval=hourly.Interval(),
+        # np.stack копирует значения и отвязывает их от буфера всего ответа
+        hourly=np.stack([
+            hourly.Variables(idx).ValuesAsNumpy()
+            for idx in range(len(FORECAST_HOURLY_PARAMS))
+        ]),
+    )
+
+
+class ForecastApiException(Exception):
+    pass
+
+
+def get_forecast(lat, lon, forecast_days):
+    """
+    Возвращает прогноз для координат из кэша или запрашивает его у Open-Meteo.
+    Координаты округляются до сетки кэша, чтобы соседние запросы попадали в одну запись.
+
+    Если прогноз в кэше устарел, он обновляется, но ответ ждется не дольше LATENCY_BUDGET секунд:
+    при ошибке, долгом ответе или разомкнутом предохранителе возвращается устаревшая копия
+    с forecast.stale = True, а обновление продолжается в фоне.
+    Без устаревшей копии ошибка Open-Meteo пробрасывается как ForecastApiException.
+    """
+    cache = forecast_cache()
+    cache_key = forecast_cache_key(lat, lon, forecast_days)
+
+    entry = cache.get(cache_key)
+    if entry is not None and _is_fresh(entry):
+        return entry[1]
+
+    if entry is None:
+        return _fetch_or_fail(cache_key, lat, lon, forecast_days)
+
+    stale = entry[1]
+    if breaker_for('forecast').is_open():
+        return mark_stale(stale)
+
+    refresh = forecast_flight.pending(cache_key) or _refresh_executor().submit(
+        forecast_flight.do, cache_key, _fetch_forecast, cache_key, lat, lon, forecast_days
+    )
+    try:
+        return refresh.result(timeout=settings.FORECAST_CACHE['LATENCY_BUDGET'])
+    except (FuturesTimeoutError, ForecastApiException):
+        return mark_stale(stale)
+
+
+def _fetch_or_fail(cache_key, lat, lon, forecast_days):
+    """Запрос прогноза, которого нет в кэше; ошибка запоминается на ERROR_TTL секунд"""
+
+    cache = forecast_cache()
+    error = cache.get(_error_cache_key(cache_key))
+    if error is not None:
+        raise ForecastApiException(error)
+
+    try:
+        # Одновременные одинаковые запросы ждут результат одного обращения к Open-Meteo
+        return forecast_flight.do(cache_key, _fetch_forecast, cache_key, lat, lon, forecast_days)
+    except ForecastApiException as e:
+        cache.set(_error_cache_key(cache_key), str(e), settings.FORECAST_CACHE['ERROR_TTL'])
+        raise
+
+
+def _fetch_forecast(cache_key, lat, lon, forecast_days):
+    grid_lat, grid_lon = round_to_grid(lat, lon)
+
+    try:
+        with phase('forecast_fetch'):
+            responses = breaker_for('forecast').call(
+                forecast_client().weather_api,
+                upstream_url('forecast'),
+                params=build_forecast_params(grid_lat, grid_lon, forecast_days),
+                timeout=timeout_for('forecast'),
+            )
+    except CircuitOpenError as e:
+        raise ForecastApiException(FORECAST_UNAVAILABLE) from e
+    except Exception as e:
+        raise ForecastApiException(FORECAST_REQUEST_FAILED) from e
+
+    with phase('forecast_decode'):
+        snapshot = snapshot_from_response(responses[0])
+
+    _store(cache_key, snapshot)
+    return snapshot
+
+
+async def aget_forecast(lat, lon, forecast_days):
+    """Асинхронная версия get_forecast, запрос к Open-Meteo не блокирует event loop"""
+
+    cache = forecast_cache()
+    cache_key = forecast_cache_key(lat, lon, forecast_days)
+
+    entry = await cache.aget(cache_key)
+    if entry is not None and _is_fresh(entry):
+        return entry[1]
+
+    if entry is None:
+        return await _afetch_or_fail(cache_key, lat, lon, forecast_days)
+
+    stale = entry[1]
+    if breaker_for('forecast').is_open():
+        return mark_stale(stale)
+
+    refresh = _join_sync_fetch(cache_key) or asyncio.ensure_future(
+        async_forecast_flight.do(cache_key, _afetch_forecast, cache_key, lat, lon, forecast_days)
+    )
+    # Результат фонового обновления может так и не понадобиться
+    refresh.add_done_callback(lambda task: task.cancelled() or task.exception())
+    try:
+        return await asyncio.wait_for(asyncio.shield(refresh), settings.FORECAST_CACHE['LATENCY_BUDGET'])
+    except (asyncio.TimeoutError, ForecastApiException):
+        return mark_stale(stale)
+
+
+async def _afetch_or_fail(cache_key, lat, lon, forecast_days):
+    cache = forecast_cache()
+    error = await cache.aget(_error_cache_key(cache_key))
+    if error is not None:
+        raise ForecastApiException(error)
+
+    try:
+        pending = _join_sync_fetch(cache_key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        return await async_forecast_flight.do(cache_key, _afetch_forecast, cache_key, lat, lon, forecast_days)
+    except ForecastApiException as e:
+        await cache.aset(_error_cache_key(cache_key), str(e), settings.FORECAST_CACHE['ERROR_TTL'])
+        raise
+
+
+def _join_sync_fetch(cache_key):
+    """
+    Запрос того же прогноза, уже выполняемый в потоке (упреждающая загрузка, фоновое обновление, прогрев),
+    как asyncio.Future, или None. Его результат ждется вместо второго запроса к Open-Meteo.
+    Ожидать его нужно через asyncio.shield: отмена обертки отменила бы Future SingleFlight, который ждут и другие.
+    """
+    pending = forecast_flight.pending(cache_key)
+    return asyncio.wrap_future(pending) if pending is not None else None
+
+
+async def _afetch_forecast(cache_key, lat, lon, forecast_days):
+    grid_lat, grid_lon = round_to_grid(lat, lon)
+
+    try:
+        with phase('forecast_fetch'):
+            responses = await breaker_for('forecast').acall(
+                async_forecast_client().weather_api,
+                upstream_url('forecast'),
+                params=build_forecast_params(grid_lat, grid_lon, forecast_days),
+                timeout=timeout_for('forecast'),
+            )
+    except CircuitOpenError as e:
+        raise ForecastApiException(FORECAST_UNAVAILABLE) from e
+    except Exception as e:
+        raise ForecastApiException(FORECAST_REQUEST_FAILED) from e
+
+    with phase('forecast_decode'):
+        snapshot = snapshot_from_response(responses[0])
+
+    await _astore(cache_key, snapshot)
+    return snapshot
+
+
+def get_forecasts(locations, forecast_days):
+    """
+    Прогнозы для нескольких координат [(lat, lon), ...] в том же порядке.
+
+    Недостающие и устаревшие записи кэша запрашиваются у Open-Meteo одним запросом (по MAX_BATCH точек),
+    все ответы разбираются в одном проходе и сохраняются в кэш по отдельности, как у get_forecast.
+    Пакет, в котором у всех точек есть устаревшая копия, как и в get_forecast, ждется не дольше LATENCY_BUDGET секунд
+    и дообновляется в фоне. Если Open-Meteo недоступен или не успел ответить, для точки возвращается
+    устаревшая копия (forecast.stale = True) или None.
+    """
+    cache_keys = [forecast_cache_key(lat, lon, forecast_days) for lat, lon in locations]
+    entries = forecast_cache().get_many(cache_keys)
+
+    missing = _missing_locations(locations, cache_keys, entries)
+    fetched = {}
+
+    if missing and not breaker_for('forecast').is_open():
+        deadline = time.monotonic() + settings.FORECAST_CACHE['LATENCY_BUDGET']
+        refreshes = []
+        for chunk, has_stale in _batch_chunks(missing, entries):
+            flight_key = ('batch', *chunk)
+            if has_stale:
+                refreshes.append(forecast_flight.pending(flight_key) or _refresh_executor().submit(
+                    forecast_flight.do, flight_key, _fetch_forecasts, chunk, forecast_days
+                ))
+                continue
+            try:
+                fetched.update(forecast_flight.do(flight_key, _fetch_forecasts, chunk, forecast_days))
+            except ForecastApiException:
+                continue
+
+        for refresh in refreshes:
+            try:
+                fetched.update(refresh.result(timeout=max(deadline - time.monotonic(), 0)))
+            except (FuturesTimeoutError, ForecastApiException):
+                continue
+
+    return [_batch_result(key, entries, fetched) for key in cache_keys]
+
+
+async def aget_forecasts(locations, forecast_days):
+    """Асинхронная версия get_forecasts"""
+
+    cache_keys = [forecast_cache_key(lat, lon, forecast_days) for lat, lon in locations]
+    entries = await forecast_cache().aget_many(cache_keys)
+
+    missing = _missing_locations(locations, cache_keys, entries)
+    fetched = {}
+
+    if missing and not breaker_for('forecast').is_open():
+        deadline = time.monotonic() + settings.FORECAST_CACHE['LATENCY_BUDGET']
+        refreshes = []
+        for chunk, has_stale in _batch_chunks(missing, entries):
+            fetch = async_forecast_flight.do(('batch', *chunk), _afetch_forecasts, chunk, forecast_days)
+            if has_stale:
+                refresh = asyncio.ensure_future(fetch)
+                refresh.add_done_callback(lambda task: task.cancelled() or task.exception())
+                refreshes.append(refresh)
+                continue
+            try:
+                fetched.update(await fetch)
+            except ForecastApiException:
+                continue
+
+        for refresh in refreshes:
+            try:
+                fetched.update(await asyncio.wait_for(asyncio.shield(refresh), max(deadline - time.monotonic(), 0)))
+            except (asyncio.TimeoutError, ForecastApiException):
+                continue
+
+    return [_batch_result(key, entries, fetched) for key in cache_keys]
+
+
+def _missing_locations(locations, cache_keys, entries):
+    """{cache_key: (lat, lon) сетки} для точек без актуальной записи в кэше, без повторов"""
+
+    missing = {}
+    for (lat, lon), cache_key in zip(locations, cache_keys):
+        entry = entries.get(cache_key)
+        if entry is None or not _is_fresh(entry):
+            missing.setdefault(cache_key, round_to_grid(lat, lon))
+    return missing
+
+
+def _batch_chunks(missing, entries):
+    """
+    Пакеты запроса по MAX_BATCH точек: [(chunk, has_stale), ...],
+    has_stale - у всех точек пакета есть устаревшая копия в кэше и ответ можно не ждать
+    """
+    batch_size = settings.FORECAST_CACHE['MAX_BATCH']
+    keys = list(missing)
+    for start in range(0, len(keys), batch_size):
+        chunk = {key: missing[key] for key in keys[start:start + batch_size]}
+        yield chunk, all(entries.get(key) is not None for key in chunk)
+
+
+def _batch_result(cache_key, entries, fetched):
+    if cache_key in fetched:
+        return fetched[cache_key]
+
+    entry = entries.get(cache_key)
+    if entry is None:
+        return None
+    return entry[1] if _is_fresh(entry) else mark_stale(entry[1])
+
+
+def _fetch_forecasts(grid_locations, forecast_days):
+    """Один запрос к Open-Meteo для {cache_key: (lat, lon)}, возвращает {cache_key: snapshot}"""
+
+    try:
+        with phase('forecast_fetch'):
+            responses = breaker_for('forecast').call(
+                forecast_client().weather_api,
+                upstream_url('forecast'),
+                params=build_batch_forecast_params(grid_locations.values(), forecast_days),
+                timeout=timeout_for('forecast'),
+            )
+    except CircuitOpenError as e:
+        raise ForecastApiException(FORECAST_UNAVAILABLE) from e
+    except Exception as e:
+        raise ForecastApiException(FORECAST_REQUEST_FAILED) from e
+
+    snapshots = _decode_batch(grid_locations, responses)
+    forecast_cache().set_many(*_cache_entries(snapshots))
+    return snapshots
+
+
+async def _afetch_forecasts(grid_locations, forecast_days):
+    try:
+        with phase('forecast_fetch'):
+            responses = await breaker_for('forecast').acall(
+                async_forecast_client().weather_api,
+                upstream_url('forecast'),
+                params=build_batch_forecast_params(grid_locations.values(), forecast_days),
+                timeout=timeout_for('forecast'),
+            )
+    except CircuitOpenError as e:
+        raise ForecastApiException(FORECAST_UNAVAILABLE) from e
+    except Exception as e:
+        raise ForecastApiException(FORECAST_REQUEST_FAILED) from e
+
+    snapshots = _decode_batch(grid_locations, responses)
+    await forecast_cache().aset_many(*_cache_entries(snapshots))
+    return snapshots
+
+
+def _decode_batch(grid_locations, responses):
+    """Ответы Open-Meteo идут в порядке координат запроса"""
+
+    if len(responses) != len(grid_locations):
+        raise ForecastApiException(FORECAST_REQUEST_FAILED)
+
+    with phase('forecast_decode'):
+        return {
+            cache_key: snapshot_from_response(response)
+            for cache_key, response in zip(grid_locations, responses)
+        }
+
+
+def _cache_entries(snapshots):
+    """(записи, timeout) для set_many: у всех записей пакета одинаковый срок актуальности"""
+
+    values = {}
+    timeout = None
+    for cache_key, snapshot in snapshots.items():
+        values[cache_key], timeout = _cache_entry(snapshot)
+    return values, timeout
+
+
+def _store(cache_key, snapshot):
+    """
+    Запись хранится как (fresh_until, snapshot) дольше, чем она актуальна (на STALE_TTL),
+    чтобы при недоступности Open-Meteo было что показать
+    """
+    cache = forecast_cache()
+    cache.set(cache_key, *_cache_entry(snapshot))
+    cache.delete(_error_cache_key(cache_key))
+
+
+async def _astore(cache_key, snapshot):
+    cache = forecast_cache()
+    await cache.aset(cache_key, *_cache_entry(snapshot))
+    await cache.adelete(_error_cache_key(cache_key))
+
+
+def _cache_entry(snapshot):
+    """(значение, timeout) записи кэша"""
+
+    now = time.time()
+    ttl = forecast_cache_ttl(now)
+    snapshot.fetched_at = now
+    return (now + ttl, snapshot), ttl + settings.FORECAST_CACHE['STALE_TTL']
+
+
+def _is_fresh(entry):
+    return entry[0] > time.time()
+
+
+def _error_cache_key(cache_key):
+    return f'{cache_key}:error'
+
+
+def mark_stale(snapshot):
+    """Копия прогноза с пометкой, что он устарел (сам объект из кэша не меняется)"""
+
+    return snapshot.replace(stale=True)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _refresh_executor():
+    """Потоки фонового обновления устаревших прогнозов"""
+
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.FORECAST_CACHE['REFRESH_WORKERS'],
+                    thread_name_prefix='forecast-refresh',
+                )
+    return _executor
+
+
+def utc_offsets(timestamps, tz, step):
+    """
+    Смещения от UTC (в секундах) для каждой отметки времени.
+
+    Смещение вычисляется через tz только в опорных точках через каждые step отметок,
+    между опорными точками с разным смещением переход ищется бинарным поиском.
+    """
+    def offset_at(ts):
+        return int(datetime.fromtimestamp(int(ts), tz=tz).utcoffset().total_seconds())
+
+    length = len(timestamps)
+    offsets = np.empty(length, dtype=np.int64)
+    if not length:
+        return offsets
+
+    anchors = list(range(0, length - 1, step)) + [length - 1]
+    anchor_offsets = [offset_at(timestamps[i]) for i in anchors]
+    offsets[-1] = anchor_offsets[-1]
+
+    for (lo, off_lo), (hi, off_hi) in zip(
+            zip(anchors, anchor_offsets), zip(anchors[1:], anchor_offsets[1:])):
+        offsets[lo:hi + 1] = off_lo
+        if off_lo == off_hi:
+            continue
+
+        # переход внутри отрезка: ищем первую отметку с новым смещением
+        left, right = lo, hi
+        while right - left > 1:
+            mid = (left + right) // 2
+            if offset_at(timestamps[mid]) == off_lo:
+                left = mid
+            else:
+                right = mid
+        offsets[right:hi + 1] = off_hi
+
+    return offsets
+
+
+def build_current_weather(forecast):
+    """Текущая погода с применением обработчиков из VARIABLES_CURRENT"""
+
+    current_weather_data = {}
+    for name, (idx, func) in VARIABLES_CURRENT.items():
+        processor = func if func else (lambda x: x)
+        current_weather_data[name] = processor(forecast.current[idx])
+
+    return current_weather_data
+
+
+def build_hourly_by_day(forecast, tz, now=None, first_day=0, max_days=None):
+    """
+    Почасовой прогноз, сгруппированный по локальной дате: HourlyTable {date: [HourRow, ...]},
+    у строки поля VARIABLES_HOURLY и 'time' (str).
+
+    Все вычисления выполняются над массивами целиком: округление значений, ось времени,
+    фильтрация часов до текущего локального часа и разбиение по дням. Значения хранятся столбцами,
+    строки - представления поверх них, создаются при обходе.
+    first_day/max_days - только дни [first_day, first_day + max_days), столбцы остальных дней не строятся.
+    """
+    axis = _hourly_axis(forecast, tz, now)
+    if axis is None:
+        return HourlyTable((), [], [0])
+    first, local_seconds, unique_days, day_bounds = axis
+
+    last_day = len(unique_days) if max_days is None else min(len(unique_days), first_day + max_days)
+    if first_day >= last_day:
+        return HourlyTable((), [], [0])
+    start, end = day_bounds[first_day], day_bounds[last_day]
+
+    local_times = local_seconds[start:end].astype('datetime64[s]')
+    time_labels = np.char.replace(np.datetime_as_string(local_times, unit='m'), 'T', ' ').tolist()
+
+    hourly = forecast.hourly[:, first + start:first + end].astype(np.float64)
+    columns = tuple(
+        (func(hourly[idx]) if func else hourly[idx]).tolist()
+        for idx, func in VARIABLES_HOURLY.values()
+    ) + (time_labels,)
+
+    offsets = [bound - start for bound in day_bounds[first_day:last_day + 1]]
+    return HourlyTable(columns, unique_days[first_day:last_day], offsets)
+
+
+def forecast_local_days(forecast, tz, now=None):
+    """Локальные даты почасового прогноза (начиная с текущего часа), как ключи build_hourly_by_day"""
+
+    axis = _hourly_axis(forecast, tz, now)
+    return [] if axis is None else axis[2]
+
+
+def _hourly_axis(forecast, tz, now):
+    """
+    Ось времени почасового прогноза с текущего локального часа:
+    (индекс первого часа, локальное время в секундах, даты дней, границы дней в оси) или None, если часов нет
+    """
+    interval = forecast.hourly_interval
+    timestamps = forecast.timestamps()
+
+    # Фильтрация таким образом,
+    # чтобы погода показывалась с местного времени города, в который сделали запрос
+    local_now = now.astimezone(tz) if now else datetime.now(tz=tz)
+    rounded_local = local_now.replace(minute=0, second=0, microsecond=0)
+    first = int(np.searchsorted(timestamps, rounded_local.timestamp(), side='left'))
+    timestamps = timestamps[first:]
+    if not len(timestamps):
+        return None
+
+    local_seconds = timestamps + utc_offsets(timestamps, tz, step=max(1, 86400 // interval))
+    days = local_seconds.astype('datetime64[s]').astype('datetime64[D]')
+
+    unique_days, day_starts = np.unique(days, return_index=True)
+    day_bounds = day_starts.tolist() + [len(timestamps)]
+    return first, local_seconds, unique_days.astype(object).tolist(), day_bounds
+
+
+def build_daily_summary(forecast, tz):
+    """
+    Сводка по локальным дням прогноза: [{'date', 'temperature_min', 'temperature_max', 'rain'}, ...].
+    Минимум, максимум и сумма считаются по массивам через np.*.reduceat по границам дней.
+    """
+    hourly = forecast.hourly
+    if not forecast.hours:
+        return []
+
+    interval = forecast.hourly_interval
+    timestamps = forecast.timestamps()
+    local_seconds = timestamps + utc_offsets(timestamps, tz, step=max(1, 86400 // interval))
+    days = local_seconds.astype('datetime64[s]').astype('datetime64[D]')
+
+    unique_days, day_starts = np.unique(days, return_index=True)
+    temperature = hourly[VARIABLES_HOURLY['temperature'][0]].astype(np.float64)
+    rain = hourly[VARIABLES_HOURLY['rain'][0]].astype(np.float64)
+
+    columns = {
+        'temperature_min': np.minimum.reduceat(temperature, day_starts),
+        'temperature_max': np.maximum.reduceat(temperature, day_starts),
+        'rain': np.add.reduceat(rain, day_starts),
+    }
+    columns = {name: round_array(values).tolist() for name, values in columns.items()}
+
+    return [
+        {'date': day, **{name: values[i] for name, values in columns.items()}}
+        for i, day in enumerate(unique_days.astype(object))
+    ]
+
+
+def forecast_etag(forecast):
+    """
+    Отпечаток прогноза для ETag: меняется вместе с данными прогноза, а не со временем запроса к Open-Meteo,
+    поэтому повторно полученный тот же прогноз не сбрасывает кэш клиента
+    """
+    digest = hashlib.md5(_VARIABLES_DIGEST.encode())
+    digest.update(forecast.timezone.encode())
+    digest.update(np.asarray(forecast.current, dtype=np.float64).tobytes())
+    digest.update(np.int64(forecast.hourly_time).tobytes())
+    digest.update(np.int64(forecast.hourly_interval).tobytes())
+    digest.update(np.ascontiguousarray(forecast.hourly).tobytes())
+    return digest.hexdigest()
+
+
+def build_hourly_columns(forecast):
+    """
+    Почасовой прогноз по столбцам: {'time': [unix, ...], name: [значение, ...]} для всех часов прогноза.
+    Значения обрабатываются как и для таблицы (VARIABLES_HOURLY), время - в UTC.
+    """
+    hourly = forecast.hourly
+    columns = {'time': forecast.timestamps().tolist()}
+    for name, (idx, func) in VARIABLES_HOURLY.items():
+        values = hourly[idx].astype(np.float64)
+        columns[name] = (func(values) if func else values).tolist()
+
+    return columns
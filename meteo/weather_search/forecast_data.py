@@ -0,0 +1,137 @@
+# Компактное представление прогноза: вместо словарей на каждый час - столбцы значений
+# и легкие представления строк поверх них, которые создаются только при обходе в шаблоне.
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+from .weather_variables import VARIABLES_HOURLY
+
+
+class Forecast:
+    """
+    Прогноз Open-Meteo для одной точки (в таком виде он и хранится в кэше).
+
+    hourly - матрица float32 (переменная x час) в порядке FORECAST_HOURLY_PARAMS,
+    hourly[idx] - значения одной переменной без копирования.
+    """
+
+    __slots__ = ('timezone', 'current', 'hourly_time', 'hourly_interval', 'hourly', 'fetched_at', 'stale')
+
+    def __init__(self, timezone, current, hourly_time, hourly_interval, hourly, fetched_at=None, stale=False):
+        self.timezone = timezone
+        self.current = tuple(current)
+        self.hourly_time = int(hourly_time)
+        self.hourly_interval = int(hourly_interval)
+        self.hourly = np.asarray(hourly, dtype=np.float32)
+        self.fetched_at = fetched_at
+        self.stale = stale
+
+    @property
+    def hours(self):
+        return self.hourly.shape[1]
+
+    def timestamps(self):
+        """Unix-время каждого часа прогноза"""
+
+        return self.hourly_time + np.arange(self.hours, dtype=np.int64) * self.hourly_interval
+
+    def replace(self, **changes):
+        """Копия с измененными полями (массивы значений общие)"""
+
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return Forecast(**fields)
+
+    def __repr__(self):
+        return f'Forecast({self.timezone!r}, hours={self.hours}, stale={self.stale})'
+
+
+class HourlyTable(Mapping):
+    """
+    Почасовая таблица, сгруппированная по локальным датам: {date: DayRows}.
+
+    Значения хранятся столбцами в порядке FIELDS (списки значений VARIABLES_HOURLY и подписи времени),
+    дни - смещениями в общей оси (offsets[i]:offsets[i + 1] - часы дня days[i]).
+    """
+
+    __slots__ = ('columns', 'days', 'offsets', '_index')
+
+    # Поля строки: переменные VARIABLES_HOURLY и время
+    FIELDS = (*VARIABLES_HOURLY, 'time')
+
+    def __init__(self, columns, days, offsets):
+        self.columns = columns
+        self.days = days
+        self.offsets = offsets
+        self._index = {day: i for i, day in enumerate(days)}
+
+    def day(self, i):
+        return DayRows(self, self.offsets[i], self.offsets[i + 1])
+
+    def __getitem__(self, day):
+        # Django-шаблон сначала пробует hourly_by_day['items'], поэтому KeyError и для не-дат
+        try:
+            return self.day(self._index[day])
+        except (KeyError, TypeError):
+            raise KeyError(day) from None
+
+    def __iter__(self):
+        return iter(self.days)
+
+    def __len__(self):
+        return len(self.days)
+
+
+class DayRows(Sequence):
+    """Часы одного дня: строки таблицы [start, stop)"""
+
+    __slots__ = ('table', 'start', 'stop')
+
+    def __init__(self, table, start, stop):
+        self.table = table
+        self.start = start
+        self.stop = stop
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return HourRow(self.table, self.start + i)
+
+    def __iter__(self):
+        table = self.table
+        for i in range(self.start, self.stop):
+            yield HourRow(table, i)
+
+    def __len__(self):
+        return self.stop - self.start
+
+
+class HourRow:
+    """Строка почасовой таблицы: hour['temperature'] или hour.temperature, без копирования значений"""
+
+    __slots__ = ('table', 'index')
+
+    _COLUMNS = {name: i for i, name in enumerate(HourlyTable.FIELDS)}
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, name):
+        return self.table.columns[self._COLUMNS[name]][self.index]
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def as_dict(self):
+        return {name: self[name] for name in HourlyTable.FIELDS}
+
+    def __repr__(self):
+        return f'HourRow({self.as_dict()!r})'
@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from weather_search.benchmarks import (BASELINE_PATH, STAGES, ForecastBenchmark, run_benchmarks,
+                                       save_baseline, load_baseline, compare)
+
+
+class Command(BaseCommand):
+    help = (
+        'Микробенчмарки обработки прогноза (разбор ответа, текущая погода, почасовая таблица, рендер) '
+        'для forecast_days от 1 до 16. Сравнивает результат с сохраненным baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', default='1-16', help='forecast_days: диапазон "1-16" или список "1,3,7,16"')
+        parser.add_argument('--stages', default=','.join(STAGES), help='Этапы через запятую')
+        parser.add_argument('--repeat', type=int, default=5, help='Кол-во повторов каждого замера')
+        parser.add_argument('--min-time', type=float, default=0.05, help='Длительность одного замера в секундах')
+        parser.add_argument('--baseline', default=str(BASELINE_PATH), help='Файл baseline')
+        parser.add_argument('--save-baseline', action='store_true', help='Сохранить результат как новый baseline')
+        parser.add_argument('--threshold', type=float, default=1.25,
+                            help='Замедление относительно baseline, считающееся регрессией')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Завершиться с ошибкой, если есть регрессии')
+
+    def handle(self, *args, **options):
+        days = self._parse_days(options['days'])
+        stages = [stage for stage in options['stages'].split(',') if stage]
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            raise CommandError(f'Неизвестные этапы: {", ".join(sorted(unknown))}')
+
+        results = run_benchmarks(days=days, stages=stages, repeat=options['repeat'], min_time=options['min_time'])
+        self._report(results, days)
+
+        if options['save_baseline']:
+            save_baseline(results, options['baseline'])
+            self.stdout.write(self.style.SUCCESS(f'Baseline сохранен: {options["baseline"]}'))
+            return
+
+        try:
+            baseline = load_baseline(options['baseline'])
+        except FileNotFoundError:
+            self.stdout.write(self.style.WARNING('Baseline не найден, сравнение пропущено (--save-baseline)'))
+            return
+
+        regressions = self._report_comparison(compare(results, baseline['results'], options['threshold']))
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'Регрессий: {regressions}')
+
+    @staticmethod
+    def _parse_days(value):
+        try:
+            if '-' in value:
+                first, last = map(int, value.split('-'))
+                days = list(range(first, last + 1))
+            else:
+                days = [int(item) for item in value.split(',')]
+        except ValueError:
+            raise CommandError(f'Некорректный --days: {value}')
+
+        if not days or not all(1 <= day <= 16 for day in days):
+            raise CommandError('forecast_days должны быть от 1 до 16')
+        return days
+
+    def _report(self, results, days):
+        self.stdout.write('Медиана на вызов, мкс')
+        self.stdout.write(f'{"days":>5}{"rows":>6}' + ''.join(f'{stage:>12}' for stage in results))
+        for forecast_days in days:
+            rows = ForecastBenchmark(forecast_days).hourly_rows()
+            self.stdout.write(
+                f'{forecast_days:>5}{rows:>6}'
+                + ''.join(f'{results[stage][forecast_days]["median"] * 1e6:>12.1f}' for stage in results)
+            )
+
+    def _report_comparison(self, rows):
+        regressions = 0
+        self.stdout.write('Сравнение с baseline (отношение медиан, > 1 - медленнее)')
+        for stage, forecast_days, current, base, ratio, regression in rows:
+            line = (f'{stage:>8} {forecast_days:>3} дн.: {current * 1e6:>10.1f} мкс '
+                    f'(baseline {base * 1e6:>10.1f} мкс) x{ratio:.2f}')
+            if regression:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        return regressions
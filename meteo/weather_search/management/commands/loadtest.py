@@ -0,0 +1,139 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import niquests
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from weather_search.openmeteo_stub import STUB_CITIES
+
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест запущенного приложения: запросы к поиску, автодополнению и статистике '
+        'с заданной частотой (RPS). Выводит пропускную способность и перцентили задержки. '
+        'Для изоляции от настоящего Open-Meteo приложение стоит направить на заглушку (manage.py openmeteo_stub).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='Адрес тестируемого приложения')
+        parser.add_argument('--rps', type=float, default=20, help='Целевое кол-во запросов в секунду')
+        parser.add_argument('--duration', type=float, default=30, help='Длительность теста в секундах')
+        parser.add_argument('--concurrency', type=int, default=50, help='Максимум одновременных запросов')
+        parser.add_argument('--timeout', type=float, default=30, help='Таймаут одного запроса в секундах')
+        parser.add_argument('--mix', default='search=6,autocomplete=3,stats=1',
+                            help='Доли запросов к search, autocomplete и stats')
+        parser.add_argument('--forecast-days', type=int, default=None,
+                            help='forecast_days для поиска (по умолчанию случайное от 1 до 16)')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options['rps'] <= 0 or options['duration'] <= 0:
+            raise CommandError('--rps и --duration должны быть больше 0')
+
+        self.base_url = options['base_url'].rstrip('/')
+        self.timeout = options['timeout']
+        self.forecast_days = options['forecast_days']
+        self.rng = random.Random(options['seed'])
+        self.cities = [city['name_ru'] for city in STUB_CITIES]
+
+        endpoints, weights = self._parse_mix(options['mix'])
+        total = int(options['rps'] * options['duration'])
+        interval = 1 / options['rps']
+
+        self.session = niquests.Session(pool_maxsize=options['concurrency'], retries=0)
+        self.results = {name: [] for name in endpoints}
+        self.errors = {name: 0 for name in endpoints}
+        self.lock = threading.Lock()
+
+        self.stdout.write(f'{total} запросов к {self.base_url}, {options["rps"]:g} RPS, {options["duration"]:g} с')
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            for i in range(total):
+                # Открытая модель нагрузки: время отправки задано расписанием, а не ответами сервера,
+                # задержка считается от запланированного момента, поэтому очередь тоже попадает в результат
+                scheduled = started + i * interval
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+                endpoint = self.rng.choices(endpoints, weights)[0]
+                executor.submit(self._send, endpoint, self._build_request(endpoint), scheduled)
+        elapsed = time.perf_counter() - started
+
+        self.session.close()
+        self._report(elapsed)
+
+    @staticmethod
+    def _parse_mix(mix):
+        endpoints, weights = [], []
+        try:
+            for item in mix.split(','):
+                name, weight = item.split('=')
+                if name not in ('search', 'autocomplete', 'stats'):
+                    raise ValueError(name)
+                endpoints.append(name)
+                weights.append(float(weight))
+        except ValueError:
+            raise CommandError(f'Некорректный --mix: {mix}')
+
+        return endpoints, weights
+
+    def _build_request(self, endpoint):
+        """(путь, параметры) запроса к endpoint"""
+
+        city = self.rng.choice(self.cities)
+
+        if endpoint == 'search':
+            forecast_days = self.forecast_days or self.rng.randint(1, 16)
+            return reverse('weather_search:search'), {'city': city, 'forecast_days': forecast_days}
+        if endpoint == 'autocomplete':
+            return reverse('search_field_autocomplete:autocomplete_city'), {'q': city[:self.rng.randint(2, 5)]}
+        return reverse('weather_api:total_search'), {'window': 'week', 'limit': 10}
+
+    def _send(self, endpoint, request, scheduled):
+        path, params = request
+        try:
+            response = self.session.get(self.base_url + path, params=params, timeout=self.timeout)
+            ok = response.status_code < 400
+        except niquests.RequestException:
+            ok = False
+
+        latency = time.perf_counter() - scheduled
+        with self.lock:
+            self.results[endpoint].append(latency)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def _report(self, elapsed):
+        header = f'{"endpoint":<14}{"count":>8}{"errors":>8}{"rps":>9}' + ''.join(
+            f'{f"p{p}, ms":>11}' for p in PERCENTILES
+        ) + f'{"max, ms":>11}'
+        self.stdout.write(header)
+
+        all_latencies = []
+        for endpoint, latencies in self.results.items():
+            all_latencies.extend(latencies)
+            self.stdout.write(self._row(endpoint, latencies, self.errors[endpoint], elapsed))
+
+        self.stdout.write(self._row('total', all_latencies, sum(self.errors.values()), elapsed))
+
+    @staticmethod
+    def _row(name, latencies, errors, elapsed):
+        if not latencies:
+            return f'{name:<14}{0:>8}{errors:>8}{0:>9.1f}'
+
+        ms = np.asarray(latencies) * 1000
+        percentiles = np.percentile(ms, PERCENTILES)
+        return (
+            f'{name:<14}{len(ms):>8}{errors:>8}{len(ms) / elapsed:>9.1f}'
+            + ''.join(f'{value:>11.1f}' for value in percentiles)
+            + f'{ms.max():>11.1f}'
+        )
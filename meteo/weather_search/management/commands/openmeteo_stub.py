@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from weather_search.openmeteo_stub import OpenMeteoStubServer, StubConfig
+
+
+class Command(BaseCommand):
+    help = (
+        'Запускает локальную заглушку Open-Meteo (Geocoding API и Forecast API) для нагрузочного тестирования. '
+        'Приложение направляется на неё переменными окружения OPEN_METEO_GEOCODING_URL и OPEN_METEO_FORECAST_URL.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8081)
+        parser.add_argument('--latency-ms', type=float, default=0, help='Задержка каждого ответа')
+        parser.add_argument('--jitter-ms', type=float, default=0, help='Случайная добавка к задержке (0..jitter)')
+        parser.add_argument('--error-rate', type=float, default=0, help='Доля ответов с ошибкой, от 0 до 1')
+        parser.add_argument('--error-status', type=int, default=503, help='HTTP-код ответов с ошибкой')
+        parser.add_argument('--synthetic-cities', action='store_true',
+                            help='Отвечать придуманным городом на любое название, а не только на известные')
+        parser.add_argument('--verbose-log', action='store_true', help='Логировать каждый запрос')
+
+    def handle(self, *args, **options):
+        config = StubConfig(
+            latency=options['latency_ms'] / 1000,
+            jitter=options['jitter_ms'] / 1000,
+            error_rate=options['error_rate'],
+            error_status=options['error_status'],
+            synthetic_cities=options['synthetic_cities'],
+            verbose=options['verbose_log'],
+        )
+        server = OpenMeteoStubServer((options['host'], options['port']), config)
+
+        self.stdout.write(self.style.SUCCESS(f'Заглушка Open-Meteo запущена на {server.base_url}'))
+        self.stdout.write(f'OPEN_METEO_GEOCODING_URL={server.base_url}/v1/search')
+        self.stdout.write(f'OPEN_METEO_FORECAST_URL={server.base_url}/v1/forecast')
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
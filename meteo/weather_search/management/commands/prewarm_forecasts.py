@@ -0,0 +1,61 @@
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+
+from weather_search.forecast import forecast_cache
+from weather_search.prewarm import ForecastPrewarmer
+
+
+class Command(BaseCommand):
+    help = (
+        'Держит в кэше прогнозы для самых популярных городов: обновляет их сразу после устаревания, '
+        'чтобы первый пользователь после обновления прогноза Open-Meteo не ждал ответа. '
+        'Кэш прогнозов должен быть общим с веб-воркерами (FORECAST_CACHE_BACKEND). Параметры по умолчанию - settings.PREWARM.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Выполнить один проход и завершиться')
+        parser.add_argument('--top-n', type=int, help='Кол-во популярных городов')
+        parser.add_argument('--window-days', type=int, help='За сколько дней считать популярность')
+        parser.add_argument('--concurrency', type=int, help='Одновременных запросов к Open-Meteo')
+        parser.add_argument('--rate', type=float, help='Запросов к Open-Meteo в секунду')
+        parser.add_argument('--batch-size', type=int, help='Городов в одном запросе прогноза')
+
+    def handle(self, *args, **options):
+        for name in ('top_n', 'window_days', 'concurrency', 'rate', 'batch_size'):
+            if options[name] is not None and options[name] <= 0:
+                raise CommandError(f'--{name.replace("_", "-")} должно быть больше 0')
+
+        # Прогрев идет отдельным процессом: кэш в его памяти веб-воркерам не виден
+        if isinstance(forecast_cache(), (LocMemCache, DummyCache)):
+            raise CommandError(
+                'Кэш прогнозов не общий для процессов (LocMemCache/DummyCache), прогрев ничего не даст. '
+                'Укажите FORECAST_CACHE_BACKEND, например django.core.cache.backends.filebased.FileBasedCache'
+            )
+
+        prewarmer = ForecastPrewarmer.from_settings(
+            top_n=options['top_n'],
+            window_days=options['window_days'],
+            concurrency=options['concurrency'],
+            rate=options['rate'],
+            batch_size=options['batch_size'],
+        )
+
+        if options['once']:
+            warmed, _ = prewarmer.run_once()
+            self._report(warmed, None)
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Прогрев прогнозов для {prewarmer.top_n} популярных городов запущен'
+        ))
+        try:
+            prewarmer.run_forever(on_pass=self._report)
+        except KeyboardInterrupt:
+            pass
+
+    def _report(self, warmed, interval):
+        message = f'Обновлено прогнозов: {warmed}'
+        if interval is not None:
+            message += f', следующий проход через {interval:.0f} с'
+        self.stdout.write(message)
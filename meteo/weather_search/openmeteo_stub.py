@@ -0,0 +1,384 @@
+# Локальная заглушка Open-Meteo (Geocoding API и Forecast API) для нагрузочных и end-to-end тестов.
+# Прогноз отдается в формате FlatBuffers, как у настоящего API, значения синтетические, но правдоподобные
+# (суточный ход температуры, день/ночь по местному времени) и детерминированные для координат и дня.
+# Задержка ответа и доля ошибок настраиваются через StubConfig.
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from zoneinfo import ZoneInfo
+
+import flatbuffers
+import numpy as np
+from openmeteo_sdk.Unit import Unit
+from openmeteo_sdk.Variable import Variable
+
+
+STUB_CITIES = [
+    {'id': 524901, 'name': 'Moscow', 'name_ru': 'Москва', 'latitude': 55.75222, 'longitude': 37.61556,
+     'country_code': 'RU', 'country': 'Russia', 'country_ru': 'Россия', 'admin1': 'Moscow', 'admin1_ru': 'Москва',
+     'population': 10381222, 'timezone': 'Europe/Moscow'},
+    {'id': 498817, 'name': 'Saint Petersburg', 'name_ru': 'Санкт-Петербург', 'latitude': 59.93863,
+     'longitude': 30.31413, 'country_code': 'RU', 'country': 'Russia', 'country_ru': 'Россия',
+     'admin1': 'St.-Petersburg', 'admin1_ru': 'Санкт-Петербург', 'population': 5351935, 'timezone': 'Europe/Moscow'},
+    {'id': 1496747, 'name': 'Novosibirsk', 'name_ru': 'Новосибирск', 'latitude': 55.0415, 'longitude': 82.9346,
+     'country_code': 'RU', 'country': 'Russia', 'country_ru': 'Россия', 'admin1': 'Novosibirsk Oblast',
+     'admin1_ru': 'Новосибирская область', 'population': 1612833, 'timezone': 'Asia/Novosibirsk'},
+    {'id': 1486209, 'name': 'Yekaterinburg', 'name_ru': 'Екатеринбург', 'latitude': 56.8519, 'longitude': 60.6122,
+     'country_code': 'RU', 'country': 'Russia', 'country_ru': 'Россия', 'admin1': 'Sverdlovsk Oblast',
+     'admin1_ru': 'Свердловская область', 'population': 1495066, 'timezone': 'Asia/Yekaterinburg'},
+    {'id': 551487, 'name': 'Kazan', 'name_ru': 'Казань', 'latitude': 55.78874, 'longitude': 49.12214,
+     'country_code': 'RU', 'country': 'Russia', 'country_ru': 'Россия', 'admin1': 'Tatarstan',
+     'admin1_ru': 'Татарстан', 'population': 1243500, 'timezone': 'Europe/Moscow'},
+    {'id': 2013348, 'name': 'Vladivostok', 'name_ru': 'Владивосток', 'latitude': 43.10562, 'longitude': 131.87353,
+     'country_code': 'RU', 'country': 'Russia', 'country_ru': 'Россия', 'admin1': 'Primorye',
+     'admin1_ru': 'Приморский край', 'population': 604901, 'timezone': 'Asia/Vladivostok'},
+    {'id': 2643743, 'name': 'London', 'name_ru': 'Лондон', 'latitude': 51.50853, 'longitude': -0.12574,
+     'country_code': 'GB', 'country': 'United Kingdom', 'country_ru': 'Великобритания', 'admin1': 'England',
+     'admin1_ru': 'Англия', 'population': 8961989, 'timezone': 'Europe/London'},
+    {'id': 2950159, 'name': 'Berlin', 'name_ru': 'Берлин', 'latitude': 52.52437, 'longitude': 13.41053,
+     'country_code': 'DE', 'country': 'Germany', 'country_ru': 'Германия', 'admin1': 'Land Berlin',
+     'admin1_ru': 'Берлин', 'population': 3426354, 'timezone': 'Europe/Berlin'},
+    {'id': 5128581, 'name': 'New York', 'name_ru': 'Нью-Йорк', 'latitude': 40.71427, 'longitude': -74.00597,
+     'country_code': 'US', 'country': 'United States', 'country_ru': 'США', 'admin1': 'New York',
+     'admin1_ru': 'Нью-Йорк', 'population': 8804190, 'timezone': 'America/New_York'},
+    {'id': 1850147, 'name': 'Tokyo', 'name_ru': 'Токио', 'latitude': 35.6895, 'longitude': 139.69171,
+     'country_code': 'JP', 'country': 'Japan', 'country_ru': 'Япония', 'admin1': 'Tokyo', 'admin1_ru': 'Токио',
+     'population': 8336599, 'timezone': 'Asia/Tokyo'},
+    {'id': 5601538, 'name': 'Moscow', 'name_ru': 'Москва', 'latitude': 46.73239, 'longitude': -117.00017,
+     'country_code': 'US', 'country': 'United States', 'country_ru': 'США', 'admin1': 'Idaho', 'admin1_ru': 'Айдахо',
+     'population': 25435, 'timezone': 'America/Los_Angeles'},
+]
+
+# Переменные прогноза: имя параметра Open-Meteo -> (Variable, Unit, высота)
+STUB_VARIABLES = {
+    'temperature_2m': (Variable.temperature, Unit.celsius, 2),
+    'apparent_temperature': (Variable.apparent_temperature, Unit.celsius, 0),
+    'relative_humidity_2m': (Variable.relative_humidity, Unit.percentage, 2),
+    'rain': (Variable.rain, Unit.millimetre, 0),
+    'is_day': (Variable.is_day, Unit.dimensionless_integer, 0),
+    'wind_speed_10m': (Variable.wind_speed, Unit.kilometres_per_hour, 10),
+}
+
+# Кол-во полей таблиц схемы openmeteo_sdk
+_RESPONSE_FIELDS = 14
+_VARIABLES_WITH_TIME_FIELDS = 4
+_VARIABLE_WITH_VALUES_FIELDS = 12
+
+
+@dataclass
+class StubConfig:
+    """
+    latency/jitter - задержка ответа в секундах (jitter - равномерный разброс сверху),
+    error_rate - доля ответов с кодом error_status,
+    synthetic_cities - для незнакомых названий геокодер придумывает город, а не отвечает пустым списком.
+    """
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 503
+    synthetic_cities: bool = False
+    verbose: bool = False
+
+
+def geocoding_results(name, count=10, language='en', country_code=None, synthetic=False):
+    """Ответ Geocoding API: города, название которых начинается с name, по убыванию населения"""
+
+    query = name.strip().casefold()
+    if len(query) < 2:
+        return []
+
+    ru = language == 'ru'
+    cities = [
+        city for city in STUB_CITIES
+        if (city['name'].casefold().startswith(query) or city['name_ru'].casefold().startswith(query))
+        and (not country_code or city['country_code'] == country_code)
+    ]
+    if not cities and synthetic:
+        cities = [_synthetic_city(name)]
+
+    cities.sort(key=lambda city: city['population'], reverse=True)
+
+    return [
+        {
+            'id': city['id'],
+            'name': city['name_ru'] if ru else city['name'],
+            'latitude': city['latitude'],
+            'longitude': city['longitude'],
+            'country_code': city['country_code'],
+            'country': city['country_ru'] if ru else city['country'],
+            'admin1': city['admin1_ru'] if ru else city['admin1'],
+            'population': city['population'],
+            'timezone': city['timezone'],
+        }
+        for city in cities[:count]
+    ]
+
+
+def _synthetic_city(name):
+    seed = zlib.crc32(name.casefold().encode())
+    rng = random.Random(seed)
+    latitude = round(rng.uniform(-50, 65), 5)
+    longitude = round(rng.uniform(-170, 170), 5)
+    return {
+        'id': seed, 'name': name, 'name_ru': name, 'latitude': latitude, 'longitude': longitude,
+        'country_code': 'XX', 'country': 'Stubland', 'country_ru': 'Stubland', 'admin1': '', 'admin1_ru': '',
+        'population': rng.randint(1000, 1000000), 'timezone': timezone_for(latitude, longitude),
+    }
+
+
+def timezone_for(latitude, longitude):
+    """Часовой пояс для timezone=auto: ближайший известный город или Etc/GMT по долготе"""
+
+    for city in STUB_CITIES:
+        if abs(city['latitude'] - latitude) < 1 and abs(city['longitude'] - longitude) < 1:
+            return city['timezone']
+
+    offset = round(longitude / 15)
+    if offset == 0:
+        return 'GMT'
+    # В зонах Etc/GMT знак обратный: Etc/GMT-3 это UTC+3
+    return f'Etc/GMT{-offset:+d}'
+
+
+def local_hours(start, hours, tz):
+    """Местный час для каждого часа от start (unix time)"""
+
+    timestamps = start + 3600 * np.arange(hours, dtype=np.int64)
+    return np.array([datetime.fromtimestamp(ts, tz).hour for ts in timestamps.tolist()], dtype=np.float32)
+
+
+def forecast_series(latitude, longitude, variable, start, hours_of_day):
+    """Почасовые значения переменной от start, зависят только от координат и времени; hours_of_day - местные часы"""
+
+    hours = len(hours_of_day)
+    rng = np.random.default_rng(zlib.crc32(f'{latitude:.2f}:{longitude:.2f}:{variable}:{start}'.encode()))
+
+    base = 25 - abs(latitude) * 0.45
+    temperature = base + 6 * np.sin((hours_of_day - 9) / 24 * 2 * math.pi) + rng.normal(0, 0.8, hours)
+    wind = np.abs(rng.normal(12, 5, hours))
+
+    if variable == 'temperature_2m':
+        values = temperature
+    elif variable == 'apparent_temperature':
+        values = temperature - wind * 0.15
+    elif variable == 'relative_humidity_2m':
+        values = np.clip(70 - 3 * (temperature - base) + rng.normal(0, 5, hours), 15, 100).round()
+    elif variable == 'rain':
+        values = np.where(rng.random(hours) < 0.15, rng.gamma(1.2, 0.8, hours), 0.0)
+    elif variable == 'is_day':
+        values = ((hours_of_day >= 7) & (hours_of_day < 20)).astype(np.float32)
+    elif variable == 'wind_speed_10m':
+        values = wind
+    else:
+        values = np.zeros(hours)
+
+    return np.asarray(values, dtype=np.float32)
+
+
+def forecast_message(latitude, longitude, current, hourly, forecast_days, now=None):
+    """Один WeatherApiResponse (FlatBuffers) для точки, как при timezone=auto"""
+
+    now = time.time() if now is None else now
+    tz_name = timezone_for(latitude, longitude)
+    tz = ZoneInfo(tz_name)
+
+    local_now = datetime.fromtimestamp(now, tz)
+    midnight = local_now.replace(hour=0, minute=0, second=0, microsecond=0)
+    hourly_start = int(midnight.astimezone(dt_timezone.utc).timestamp())
+    hours = forecast_days * 24
+    current_time = int(now) - int(now) % 900
+
+    builder = flatbuffers.Builder(1024 + hours * len(hourly) * 4)
+
+    current_hour = current_time - current_time % 3600
+    current_local_hours = local_hours(current_hour, 1, tz)
+    hourly_local_hours = local_hours(hourly_start, hours, tz)
+
+    current_series = {
+        name: forecast_series(latitude, longitude, name, current_hour, current_local_hours)[0]
+        for name in current
+    }
+    current_block = _variables_with_time(
+        builder, current_time, current_time + 900, 900,
+        [_variable(builder, name, value=float(current_series[name])) for name in current],
+    )
+    hourly_block = _variables_with_time(
+        builder, hourly_start, hourly_start + hours * 3600, 3600,
+        [
+            _variable(builder, name,
+                      values=forecast_series(latitude, longitude, name, hourly_start, hourly_local_hours))
+            for name in hourly
+        ],
+    )
+    tz_name_offset = builder.CreateString(tz_name)
+    tz_abbreviation = builder.CreateString(local_now.tzname() or '')
+
+    builder.StartObject(_RESPONSE_FIELDS)
+    builder.PrependFloat32Slot(0, latitude, 0.0)
+    builder.PrependFloat32Slot(1, longitude, 0.0)
+    builder.PrependFloat32Slot(3, 0.5, 0.0)
+    builder.PrependInt32Slot(6, int(local_now.utcoffset().total_seconds()), 0)
+    builder.PrependUOffsetTRelativeSlot(7, tz_name_offset, 0)
+    builder.PrependUOffsetTRelativeSlot(8, tz_abbreviation, 0)
+    builder.PrependUOffsetTRelativeSlot(9, current_block, 0)
+    builder.PrependUOffsetTRelativeSlot(11, hourly_block, 0)
+    builder.Finish(builder.EndObject())
+
+    return bytes(builder.Output())
+
+
+def forecast_payload(latitudes, longitudes, current, hourly, forecast_days, now=None):
+    """Тело ответа Forecast API: сообщения по каждой точке с префиксом длины (4 байта, little-endian)"""
+
+    chunks = []
+    for latitude, longitude in zip(latitudes, longitudes):
+        message = forecast_message(latitude, longitude, current, hourly, forecast_days, now=now)
+        chunks.append(len(message).to_bytes(4, 'little'))
+        chunks.append(message)
+    return b''.join(chunks)
+
+
+def _variable(builder, name, value=None, values=None):
+    variable, unit, altitude = STUB_VARIABLES[name]
+
+    values_offset = builder.CreateNumpyVector(values) if values is not None else None
+
+    builder.StartObject(_VARIABLE_WITH_VALUES_FIELDS)
+    builder.PrependUint8Slot(0, variable, 0)
+    builder.PrependUint8Slot(1, unit, 0)
+    if value is not None:
+        builder.PrependFloat32Slot(2, value, 0.0)
+    if values_offset is not None:
+        builder.PrependUOffsetTRelativeSlot(3, values_offset, 0)
+    builder.PrependInt16Slot(5, altitude, 0)
+    return builder.EndObject()
+
+
+def _variables_with_time(builder, start, end, interval, variables):
+    builder.StartVector(4, len(variables), 4)
+    for offset in reversed(variables):
+        builder.PrependUOffsetTRelative(offset)
+    variables_offset = builder.EndVector()
+
+    builder.StartObject(_VARIABLES_WITH_TIME_FIELDS)
+    builder.PrependInt64Slot(0, start, 0)
+    builder.PrependInt64Slot(1, end, 0)
+    builder.PrependInt32Slot(2, interval, 0)
+    builder.PrependUOffsetTRelativeSlot(3, variables_offset, 0)
+    return builder.EndObject()
+
+
+def _list_param(params, name):
+    """Параметр-список: повторяющийся ключ (hourly=a&hourly=b) или значения через запятую"""
+
+    return [item for value in params.get(name, []) for item in value.split(',') if item]
+
+
+class OpenMeteoStubHandler(BaseHTTPRequestHandler):
+    server_version = 'OpenMeteoStub/1.0'
+    # keep-alive, как у настоящего API: проверяется и пул соединений клиента
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        config = self.server.config
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+
+        if config.latency or config.jitter:
+            time.sleep(config.latency + random.uniform(0, config.jitter))
+
+        if config.error_rate and random.random() < config.error_rate:
+            return self._send_json(config.error_status, {'error': True, 'reason': 'Injected error'})
+
+        if url.path == '/v1/search':
+            return self._search(params)
+        if url.path == '/v1/forecast':
+            return self._forecast(params)
+
+        self._send_json(404, {'error': True, 'reason': 'Not Found'})
+
+    def _search(self, params):
+        name = params.get('name', [''])[0]
+        try:
+            count = int(params.get('count', ['10'])[0])
+        except ValueError:
+            return self._send_json(400, {'error': True, 'reason': 'Invalid count'})
+
+        results = geocoding_results(
+            name,
+            count=count,
+            language=params.get('language', ['en'])[0],
+            country_code=params.get('countryCode', [None])[0],
+            synthetic=self.server.config.synthetic_cities,
+        )
+
+        body = {'generationtime_ms': 0.5}
+        if results:
+            body['results'] = results
+        self._send_json(200, body)
+
+    def _forecast(self, params):
+        try:
+            latitudes = [float(value) for value in _list_param(params, 'latitude')]
+            longitudes = [float(value) for value in _list_param(params, 'longitude')]
+            forecast_days = int(params.get('forecast_days', ['7'])[0])
+        except ValueError:
+            return self._send_json(400, {'error': True, 'reason': 'Invalid coordinates or forecast_days'})
+
+        current = _list_param(params, 'current')
+        hourly = _list_param(params, 'hourly')
+        unknown = [name for name in current + hourly if name not in STUB_VARIABLES]
+
+        if not latitudes or len(latitudes) != len(longitudes):
+            return self._send_json(400, {'error': True, 'reason': 'Latitude and longitude must have the same length'})
+        if not 1 <= forecast_days <= 16:
+            return self._send_json(400, {'error': True, 'reason': 'forecast_days must be between 1 and 16'})
+        if unknown:
+            return self._send_json(400, {'error': True, 'reason': f'Unsupported variables: {", ".join(unknown)}'})
+
+        if params.get('format', ['json'])[0] != 'flatbuffers':
+            return self._send_json(400, {'error': True, 'reason': 'Only format=flatbuffers is supported by the stub'})
+
+        body = forecast_payload(latitudes, longitudes, current, hourly, forecast_days)
+        self._send(200, body, 'application/octet-stream')
+
+    def _send_json(self, status, body):
+        self._send(status, json.dumps(body).encode(), 'application/json; charset=utf-8')
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.config.verbose:
+            super().log_message(format, *args)
+
+
+class OpenMeteoStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config=None):
+        super().__init__(address, OpenMeteoStubHandler)
+        self.config = config or StubConfig()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start_in_thread(self):
+        """Запуск в фоновом потоке (для тестов), возвращает поток"""
+
+        thread = threading.Thread(target=self.serve_forever, name='openmeteo-stub', daemon=True)
+        thread.start()
+        return thread
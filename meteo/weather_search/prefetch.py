@@ -0,0 +1,142 @@
+# Упреждающая загрузка прогноза (FORECAST_PREFETCH): пока пользователь выбирает город в автодополнении,
+# прогноз для первых подсказок и подсвеченного варианта запрашивается в фоне и попадает в кэш,
+# поэтому поиск после выбора обычно обходится без ожидания Open-Meteo. Если поиск начнется раньше,
+# чем придет ответ, он дождется того же запроса (forecast_flight), а не отправит второй.
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core import signing
+
+from .forecast import get_forecast, forecast_cache_key, ForecastApiException
+from .upstream import breaker_for
+from .utils import validate_forecast_days
+
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд после выдачи подсказки ее токен принимается сигналом о подсветке
+PREFETCH_TOKEN_MAX_AGE = 10 * 60
+PREFETCH_TOKEN_SALT = 'weather_search.prefetch'
+
+
+class ForecastPrefetcher:
+    """
+    Фоновая загрузка прогнозов: не больше concurrency запросов одновременно.
+    Когда все места заняты, новые координаты отбрасываются, а не ждут очереди - прогноз для них
+    просто запросится при поиске, как без упреждающей загрузки.
+    """
+
+    def __init__(self, concurrency=2):
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='forecast-prefetch')
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def prefetch(self, locations, forecast_days):
+        """Ставит в очередь прогнозы для [(lat, lon), ...], возвращает кол-во поставленных"""
+
+        if breaker_for('forecast').is_open():
+            return 0
+
+        submitted = 0
+        for lat, lon in locations:
+            cache_key = forecast_cache_key(lat, lon, forecast_days)
+
+            with self._lock:
+                if cache_key in self._pending:
+                    continue
+                if not self._slots.acquire(blocking=False):
+                    break
+                self._pending.add(cache_key)
+
+            self._executor.submit(self._warm, cache_key, lat, lon, forecast_days)
+            submitted += 1
+
+        return submitted
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _warm(self, cache_key, lat, lon, forecast_days):
+        try:
+            # Актуальный прогноз из кэша возвращается сразу, без запроса
+            get_forecast(lat, lon, forecast_days)
+        except ForecastApiException as e:
+            logger.info('Упреждающая загрузка прогноза для %s, %s не удалась: %s', lat, lon, e)
+        except Exception:
+            logger.exception('Упреждающая загрузка прогноза для %s, %s завершилась ошибкой', lat, lon)
+        finally:
+            with self._lock:
+                self._pending.discard(cache_key)
+            self._slots.release()
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def forecast_prefetcher():
+    """Фоновая загрузка прогнозов, общая для процесса"""
+
+    global _prefetcher
+
+    if _prefetcher is None:
+        with _prefetcher_lock:
+            if _prefetcher is None:
+                _prefetcher = ForecastPrefetcher(concurrency=settings.FORECAST_PREFETCH['CONCURRENCY'])
+
+    return _prefetcher
+
+
+def prefetch_forecasts(candidates, raw_forecast_days=None):
+    """
+    Упреждающая загрузка прогноза для первых FORECAST_PREFETCH['TOP_N'] городов из candidates
+    (подсказок автодополнения с latitude/longitude). raw_forecast_days - значение из формы поиска.
+    Возвращает кол-во поставленных в очередь прогнозов (0, если режим выключен).
+    """
+    conf = settings.FORECAST_PREFETCH
+    if not conf['ENABLED']:
+        return 0
+
+    forecast_days, error = validate_forecast_days(raw_forecast_days)
+    if error:
+        return 0
+
+    locations = [
+        (candidate['latitude'], candidate['longitude'])
+        for candidate in candidates
+        if candidate.get('latitude') is not None and candidate.get('longitude') is not None
+    ]
+    return forecast_prefetcher().prefetch(locations[:conf['TOP_N']], forecast_days)
+
+
+def sign_candidates(candidates):
+    """
+    Копии подсказок автодополнения с подписанными координатами (prefetch_token).
+    Сигнал о подсвеченной подсказке принимает только такой токен, а не произвольные координаты клиента.
+    Если режим выключен, подсказки возвращаются как есть.
+    """
+    if not settings.FORECAST_PREFETCH['ENABLED']:
+        return candidates
+
+    signer = signing.TimestampSigner(salt=PREFETCH_TOKEN_SALT)
+    return [
+        {**candidate, 'prefetch_token': signer.sign(f"{candidate['latitude']},{candidate['longitude']}")}
+        if candidate.get('latitude') is not None and candidate.get('longitude') is not None else candidate
+        for candidate in candidates
+    ]
+
+
+def read_prefetch_token(token):
+    """Координаты (lat, lon) из токена sign_candidates или None, если токен поддельный или устарел"""
+
+    try:
+        value = signing.TimestampSigner(salt=PREFETCH_TOKEN_SALT).unsign(token or '', max_age=PREFETCH_TOKEN_MAX_AGE)
+        latitude, longitude = (float(part) for part in value.split(','))
+    except (signing.BadSignature, ValueError):
+        return None
+
+    return latitude, longitude
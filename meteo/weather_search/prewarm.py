@@ -0,0 +1,242 @@
+# Фоновый прогрев прогнозов для самых популярных городов (manage.py prewarm_forecasts).
+# Записи кэша прогноза актуальны до публикации нового прогноза Open-Meteo (forecast_cache_ttl),
+# поэтому запрашивать их раньше бессмысленно - ответ будет тем же. Прогрев просыпается к моменту,
+# когда записи популярных городов устаревают, и обновляет их пачками (get_forecasts), соблюдая лимит
+# одновременных запросов и частоты обращений к Open-Meteo.
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Sum
+from django.utils import timezone
+
+from search_history.models import HistoryModel
+from search_history.rollup import top_searched_cities
+from .forecast import forecast_cache, forecast_cache_key, get_forecasts
+from .upstream import breaker_for
+from .utils import geo_coding_request, GeoApiException
+
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Ограничение частоты запросов (token bucket): rate запросов в секунду, не больше burst подряд"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Ждет, пока запрос можно будет выполнить, возвращает время ожидания"""
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+
+            time.sleep(delay)
+            waited += delay
+
+
+class PrewarmTarget:
+    """Прогреваемая запись: город, координаты и кол-во дней прогноза"""
+
+    __slots__ = ('city', 'latitude', 'longitude', 'forecast_days')
+
+    def __init__(self, city, latitude, longitude, forecast_days):
+        self.city = city
+        self.latitude = latitude
+        self.longitude = longitude
+        self.forecast_days = forecast_days
+
+    @property
+    def cache_key(self):
+        return forecast_cache_key(self.latitude, self.longitude, self.forecast_days)
+
+    def __repr__(self):
+        return f'PrewarmTarget({self.city!r}, {self.latitude}, {self.longitude}, {self.forecast_days})'
+
+
+class ForecastPrewarmer:
+    """
+    top_n - сколько популярных городов (за window_days дней) держать в кэше,
+    days_per_city - сколько самых частых вариантов forecast_days прогревать для города,
+    concurrency - одновременных запросов к Open-Meteo, rate - запросов в секунду,
+    batch_size - городов в одном запросе, min_interval/max_interval - границы паузы между проходами.
+    """
+
+    def __init__(self, top_n=50, window_days=7, days_per_city=2, concurrency=2, rate=2.0,
+                 batch_size=20, min_interval=5.0, max_interval=300.0):
+        self.top_n = top_n
+        self.window_days = window_days
+        self.days_per_city = days_per_city
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        self.limiter = RateLimiter(rate, burst=concurrency)
+        self._backoff = 0.0
+        self._locations = {}
+
+    @classmethod
+    def from_settings(cls, **overrides):
+        conf = settings.PREWARM
+        options = {
+            'top_n': conf['TOP_N'],
+            'window_days': conf['WINDOW_DAYS'],
+            'days_per_city': conf['DAYS_PER_CITY'],
+            'concurrency': conf['CONCURRENCY'],
+            'rate': conf['RATE'],
+            'batch_size': conf['BATCH_SIZE'],
+            'max_interval': conf['MAX_INTERVAL'],
+        }
+        options.update({k: v for k, v in overrides.items() if v is not None})
+        return cls(**options)
+
+    def targets(self):
+        """Записи для прогрева: популярные города с координатами из истории поиска (или геокодирования)"""
+
+        cities = [row['city'] for row in top_searched_cities(self.window_days)[:self.top_n]]
+        if not cities:
+            return []
+
+        since = timezone.now() - timedelta(days=self.window_days)
+        rows = (
+            HistoryModel.objects
+            .filter(city__in=cities, last_searched__gte=since)
+            .values('city', 'latitude', 'longitude', 'forecast_days')
+            .annotate(count=Sum('hit_count'))
+            .order_by()
+        )
+
+        locations = defaultdict(Counter)
+        days = defaultdict(Counter)
+        for row in rows:
+            if row['latitude'] is not None:
+                locations[row['city']][(row['latitude'], row['longitude'])] += row['count']
+            days[row['city']][row['forecast_days']] += row['count']
+
+        targets = []
+        for city in cities:
+            location = locations[city].most_common(1)[0][0] if locations[city] else self._geocode(city)
+            if location is None:
+                continue
+
+            for forecast_days, _ in days[city].most_common(self.days_per_city) or [(1, 0)]:
+                targets.append(PrewarmTarget(city, *location, forecast_days))
+
+        return targets
+
+    def _geocode(self, city):
+        """Координаты города без сохраненных координат в истории (запоминаются на время работы)"""
+
+        if city not in self._locations:
+            self.limiter.acquire()
+            try:
+                geo_data = geo_coding_request(city=city)
+                self._locations[city] = (geo_data['latitude'], geo_data['longitude'])
+            except GeoApiException as e:
+                logger.warning('Прогрев: не удалось найти координаты %s: %s', city, e)
+                return None
+
+        return self._locations[city]
+
+    def due(self, targets):
+        """
+        (записи без актуального прогноза в кэше, секунды до ближайшего устаревания остальных)
+        """
+        entries = forecast_cache().get_many([target.cache_key for target in targets])
+        now = time.time()
+
+        due = []
+        next_expiry = None
+        for target in targets:
+            entry = entries.get(target.cache_key)
+            if entry is None or entry[0] <= now:
+                due.append(target)
+            else:
+                next_expiry = entry[0] if next_expiry is None else min(next_expiry, entry[0])
+
+        return due, (None if next_expiry is None else next_expiry - now)
+
+    def run_once(self):
+        """Один проход прогрева: возвращает (кол-во прогретых записей, секунды до следующего прохода)"""
+
+        targets = self.targets()
+        due, until_expiry = self.due(targets)
+
+        warmed = 0
+        if due and breaker_for('forecast').is_open():
+            logger.info('Прогрев: Open-Meteo недоступен, проход пропущен')
+        elif due:
+            warmed = self._warm(due)
+            # Что осталось без прогноза и срок актуальности только что обновленных записей
+            due, until_expiry = self.due(targets)
+
+        return warmed, self._next_interval(due, until_expiry)
+
+    def run_forever(self, stop_event=None, on_pass=None):
+        stop_event = stop_event or threading.Event()
+
+        while not stop_event.is_set():
+            try:
+                warmed, interval = self.run_once()
+            except Exception:
+                logger.exception('Прогрев прогнозов завершился ошибкой')
+                warmed, interval = 0, self.max_interval
+            finally:
+                close_old_connections()
+
+            if on_pass is not None:
+                on_pass(warmed, interval)
+            stop_event.wait(interval)
+
+    def _warm(self, due):
+        """Обновляет записи пачками по batch_size, не больше concurrency запросов одновременно"""
+
+        batches = []
+        by_days = defaultdict(list)
+        for target in due:
+            by_days[target.forecast_days].append(target)
+        for forecast_days, targets in by_days.items():
+            for start in range(0, len(targets), self.batch_size):
+                batches.append((forecast_days, targets[start:start + self.batch_size]))
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='forecast-prewarm') as executor:
+            results = executor.map(lambda batch: self._warm_batch(*batch), batches)
+            return sum(results)
+
+    def _warm_batch(self, forecast_days, targets):
+        self.limiter.acquire()
+        forecasts = get_forecasts([(t.latitude, t.longitude) for t in targets], forecast_days)
+        return sum(1 for forecast in forecasts if forecast is not None and not forecast.stale)
+
+    def _next_interval(self, due, until_expiry):
+        """
+        Все записи актуальны - до ближайшего устаревания (но не дольше max_interval).
+        Часть записей обновить не удалось (ошибки Open-Meteo, в т.ч. 429) - пауза растет вдвое с каждым проходом.
+        """
+        if due:
+            self._backoff = min(self.max_interval, max(self.min_interval, self._backoff * 2))
+            return self._backoff
+
+        self._backoff = 0.0
+        interval = self.max_interval if until_expiry is None else until_expiry + 1
+        return min(self.max_interval, max(self.min_interval, interval))
@@ -0,0 +1,67 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одинаковым ключом в пределах процесса:
+    функция выполняется один раз, остальные вызовы ждут и получают тот же результат (или исключение).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def pending(self, key):
+        """Future выполняющегося вызова с ключом key или None"""
+
+        with self._lock:
+            return self._calls.get(key)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """Асинхронный вариант SingleFlight: одна задача на ключ, остальные корутины ожидают её"""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, func, *args, **kwargs):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+
+        # Отмена одного из ожидающих не должна отменять общий запрос
+        return await asyncio.shield(task)
+
+    def in_flight(self):
+        return len(self._calls)
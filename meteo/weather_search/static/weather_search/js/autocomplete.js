@@ -3,6 +3,12 @@ document.addEventListener("DOMContentLoaded", function () {
     const endpoint = input.dataset.autocompleteUrl;
     const hiddenSelection = document.querySelector("#city-selection");
     const form = document.querySelector("#search-form");
+    const forecastDaysInput = document.querySelector('input[name="forecast_days"]');
+    // Задан, если включена упреждающая загрузка прогноза (FORECAST_PREFETCH)
+    const prefetchEndpoint = input.dataset.prefetchUrl;
+    const csrfToken = input.dataset.csrfToken;
+    // Подписанные сервером координаты подсказок (prefetch_token) по значению подсказки
+    let prefetchTokens = new Map();
 
     const awesomplete = new Awesomplete(input, {
         minChars: 2,
@@ -29,7 +35,7 @@ document.addEventListener("DOMContentLoaded", function () {
         if (query.length < 2) return;
 
         timeout = setTimeout(() => {
-            const url = `${endpoint}?q=${encodeURIComponent(query)}`;
+            const url = `${endpoint}?q=${encodeURIComponent(query)}&forecast_days=${encodeURIComponent(forecastDays())}`;
             console.log("Запрос к:", url);
             fetch(url)
                 .then((response) => {
@@ -37,6 +43,7 @@ document.addEventListener("DOMContentLoaded", function () {
                     return response.json();
                 })
                 .then((data) => {
+                    prefetchTokens = new Map();
                     // ожидаем от сервера массив объектов с полями
                     const suggestions = data.map((item) => {
                         const admin = item.admin1 ? `, рег. ${item.admin1}` : "";
@@ -48,11 +55,14 @@ document.addEventListener("DOMContentLoaded", function () {
                             country_code: item.country_code,
                             lat: item.latitude,
                             lon: item.longitude,
+                            timezone: item.timezone,
                             admin: item.admin1,
                         };
+                        const value = JSON.stringify(payload);
+                        if (item.prefetch_token) prefetchTokens.set(value, item.prefetch_token);
                         return {
                             label,
-                            value: JSON.stringify(payload),
+                            value,
                         };
                     });
 
@@ -62,6 +72,33 @@ document.addEventListener("DOMContentLoaded", function () {
         }, 2000);
     });
 
+    function forecastDays() {
+        return forecastDaysInput ? forecastDaysInput.value.trim() : "";
+    }
+
+    // Подсвеченная подсказка: сервер заранее загружает прогноз для нее
+    let prefetchTimeout = null;
+
+    input.addEventListener("awesomplete-highlight", function (evt) {
+        if (!prefetchEndpoint || !evt.text) return;
+
+        const token = prefetchTokens.get(typeof evt.text === "object" ? evt.text.value : evt.text);
+        if (!token) return;
+
+        clearTimeout(prefetchTimeout);
+        prefetchTimeout = setTimeout(() => {
+            const body = new URLSearchParams({
+                prefetch_token: token,
+                forecast_days: forecastDays(),
+            });
+            fetch(prefetchEndpoint, {
+                method: "POST",
+                headers: {"X-CSRFToken": csrfToken},
+                body,
+            }).catch(() => {});
+        }, 300);
+    });
+
     input.addEventListener("awesomplete-selectcomplete", function (evt) {
         const t = evt.text;
         const rawValue = typeof t === "object" && t !== null ? t.value : t;
@@ -0,0 +1,39 @@
+document.addEventListener("DOMContentLoaded", function () {
+    // Почасовой прогноз дальних дней подгружается фрагментом, когда блок дня появляется на экране или по кнопке
+    const placeholders = document.querySelectorAll("[data-lazy-day]");
+    if (!placeholders.length) return;
+
+    function loadDay(placeholder) {
+        if (placeholder.dataset.loading) return;
+        placeholder.dataset.loading = "true";
+
+        fetch(placeholder.dataset.url)
+            .then((response) => {
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                return response.text();
+            })
+            .then((html) => {
+                placeholder.outerHTML = html;
+            })
+            .catch((err) => {
+                delete placeholder.dataset.loading;
+                console.error("Ошибка при загрузке прогноза на день:", err);
+            });
+    }
+
+    const observer = "IntersectionObserver" in window
+        ? new IntersectionObserver((entries) => {
+            entries.forEach((entry) => {
+                if (entry.isIntersecting) {
+                    observer.unobserve(entry.target);
+                    loadDay(entry.target);
+                }
+            });
+        }, {rootMargin: "200px"})
+        : null;
+
+    placeholders.forEach((placeholder) => {
+        placeholder.querySelector("[data-load-day]").addEventListener("click", () => loadDay(placeholder));
+        if (observer) observer.observe(placeholder);
+    });
+});
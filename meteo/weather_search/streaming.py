@@ -0,0 +1,50 @@
+import uuid
+
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .timing import phase
+
+
+class StreamedPage:
+    """
+    Потоковый рендер страницы частями.
+
+    В шаблоне точки отправки отмечены переменной {{ stream_marker }} (без потокового режима она пустая).
+    Каждый flush рендерит всю страницу с уже известным context и отдает готовые части до последнего маркера,
+    finish - остаток страницы. Части до маркера должны зависеть только от данных, известных к этому flush,
+    тогда склеенный ответ совпадает с обычным рендером страницы.
+    """
+
+    def __init__(self, request, template_name):
+        self.request = request
+        self.template_name = template_name
+        self.marker = mark_safe(f'<!--stream-{uuid.uuid4().hex}-->')
+        self.sent = 0
+
+    def flush(self, context):
+        parts = self._render_parts(context)
+        chunk = ''.join(parts[self.sent:-1])
+        self.sent = max(self.sent, len(parts) - 1)
+        return chunk
+
+    def finish(self, context):
+        return ''.join(self._render_parts(context)[self.sent:])
+
+    def _render_parts(self, context):
+        with phase('render'):
+            html = render_to_string(self.template_name, {**context, 'stream_marker': self.marker}, request=self.request)
+        return html.split(self.marker)
+
+
+def streaming_enabled(request, user):
+    """
+    Потоковый ответ включается настройкой SEARCH_STREAMING.
+
+    История неавторизованного пользователя пишется в сессию уже после отправки заголовков,
+    поэтому сессия должна храниться на сервере: с signed_cookies страница рендерится целиком.
+    """
+    if not settings.SEARCH_STREAMING:
+        return False
+    return user.is_authenticated or settings.SESSION_ENGINE != 'django.contrib.sessions.backends.signed_cookies'
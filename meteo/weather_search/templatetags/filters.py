@@ -1,4 +1,6 @@
 from django import template
+from django.conf import settings
+from django.urls import reverse
 from django.http import QueryDict
 
 register = template.Library()
@@ -7,6 +9,15 @@ register = template.Library()
 @register.filter
 def dict_to_querystring(value):
     q = QueryDict('', mutable=True)
-    q.update(value)
+    # Записи истории без координат (сохраненные до их появления) не передают пустые поля
+    q.update({k: v for k, v in value.items() if v is not None and v != ''})
     q['history'] = 'true'
-    return q.urlencode()
\ No newline at end of file
+    return q.urlencode()
+
+@register.simple_tag
+def forecast_prefetch_url():
+    """Адрес сигнала о подсвеченной подсказке автодополнения, если включен FORECAST_PREFETCH"""
+
+    if not settings.FORECAST_PREFETCH['ENABLED']:
+        return ''
+    return reverse('search_field_autocomplete:prefetch_forecast')
@@ -1,14 +1,86 @@
+import html
 import json
-import requests
-from django.test import TestCase
+import re
+import niquests
+from django.core.cache import caches
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.conf import settings
+from django.test import Client, TestCase, AsyncRequestFactory, override_settings
 from django.urls import reverse
-from unittest.mock import patch, MagicMock, ANY
+from unittest.mock import patch, MagicMock, AsyncMock, ANY
 from .utils import (mock_geocoding_api_request, mock_current_data,
-                    mock_hourly_variables_test, mock_timestamp, expected_hour_rows)
+                    mock_hourly_variables_test, mock_timestamp, expected_hour_rows,
+                    geocoding_cache, geo_coding_request, async_geo_coding_request, GeoApiException, CityNotFound,
+                    mock_weather_api_response)
+from .views import search_city_async
+from .forecast import (get_forecast, aget_forecast, get_forecasts, aget_forecasts, build_daily_summary, forecast_cache_key, forecast_cache_ttl,
+                       build_hourly_by_day, utc_offsets, forecast_flight, ForecastApiException,
+                       FORECAST_REQUEST_FAILED, FORECAST_UNAVAILABLE)
+from .singleflight import SingleFlight
+from .circuit import CircuitBreaker, CircuitOpenError
+from .timing import metrics_registry, phase, Histogram, RequestTiming
+from .openmeteo_stub import OpenMeteoStubServer, StubConfig
+from .benchmarks import ForecastBenchmark, run_benchmarks, compare, STAGES
+from .upstream import forecast_client, reset_breakers, breaker_for
+from datetime import date, datetime, timezone
+from zoneinfo import ZoneInfo
+import numpy as np
 import random
+import shutil
+import tempfile
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from search_history.models import HistoryModel, CityDailySearchCount
+from django.core.management import call_command, CommandError
+from django.utils import timezone as django_timezone
+from io import StringIO
+from .prewarm import ForecastPrewarmer, RateLimiter
+from .prefetch import ForecastPrefetcher, forecast_prefetcher, prefetch_forecasts
+from .forecast_data import Forecast, HourlyTable, HourRow
 
 
-class WeatherViewTest(TestCase):
+METRICS_TOKEN = 'metrics-token'
+METRICS_AUTH = {'Authorization': f'Bearer {METRICS_TOKEN}'}
+
+
+class UpstreamStateMixin:
+    """Перед каждым тестом кэши геокодирования и прогнозов пусты, а circuit breaker закрыты"""
+
+    def setUp(self):
+        super().setUp()
+        geocoding_cache.clear()
+        caches['forecast'].clear()
+        reset_breakers()
+
+
+class OpenMeteoStubMixin(UpstreamStateMixin):
+    """Запросы к Open-Meteo уходят в локальную заглушку, а не в настоящий API"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = OpenMeteoStubServer(('127.0.0.1', 0), StubConfig())
+        cls.stub.start_in_thread()
+        cls.addClassCleanup(cls.stub.server_close)
+        cls.addClassCleanup(cls.stub.shutdown)
+
+        cls.enterClassContext(override_settings(UPSTREAM_HTTP={
+            **settings.UPSTREAM_HTTP,
+            'URLS': {
+                'geocoding': f'{cls.stub.base_url}/v1/search',
+                'autocomplete': f'{cls.stub.base_url}/v1/search',
+                'forecast': f'{cls.stub.base_url}/v1/forecast',
+            },
+        }))
+
+
+@override_settings(HISTORY_WRITE_BEHIND={'ENABLED': False})
+class WeatherViewTest(OpenMeteoStubMixin, TestCase):
     def test_get_request_return_correct_response(self):
         response = self.client.get(reverse('weather_search:search'))
 
@@ -83,9 +155,9 @@ class WeatherViewTest(TestCase):
         self.assertContains(response, "<h3>Почасовой прогноз</h3>")
         self.assertContains(response, '<table class="weather-table">')
 
-    @patch('weather_search.utils.requests.get')
+    @patch('weather_search.upstream.niquests.Session.get')
     def test_geolocation_api_failure(self, mock_get):
-        mock_get.return_value.raise_for_status.side_effect = requests.HTTPError
+        mock_get.return_value.raise_for_status.side_effect = niquests.HTTPError
 
         response = self.client.get(reverse('weather_search:search'), {
             'city': 'Москва',
@@ -94,7 +166,7 @@ class WeatherViewTest(TestCase):
 
         self.assertContains(response, 'Ошибка при запросе геоданных')
 
-    @patch('weather_search.utils.requests.get')
+    @patch('weather_search.upstream.niquests.Session.get')
     def test_geolocation_json_incorrect(self, mock_get):
         mock_get.return_value.json.side_effect = json.JSONDecodeError('err', "()", 0)
 
@@ -140,7 +212,9 @@ class WeatherViewTest(TestCase):
             'city': 'Москва',
             'forecast_days': random_days_from_one_to_five,
         })
-        self.assertContains(response, '<table class="weather-table">', count=random_days_from_one_to_five)
+        inline_days = min(random_days_from_one_to_five, settings.FORECAST_INLINE_DAYS)
+        self.assertContains(response, '<table class="weather-table">', count=inline_days)
+        self.assertContains(response, 'data-lazy-day', count=random_days_from_one_to_five - inline_days)
 
     def test_forecast_days_with_non_numeric_value(self):
         response = self.client.get(reverse('weather_search:search'), {
@@ -168,10 +242,46 @@ class WeatherViewTest(TestCase):
         self.assertContains(response, '<li data-history-city>',
                             count=len(session['city_history']))
 
+    @patch('weather_search.upstream.openmeteo_requests.Client.weather_api')
+    @patch('weather_search.upstream.niquests.Session.get')
+    def test_history_link_with_coordinates_skips_geocoding(self, mock_get, mock_weather_api):
+        mock_weather_api.return_value = [mock_weather_api_response()]
+        session = self.client.session
+        session['city_history'] = [{
+            'city': 'Москва', 'country': 'Россия', 'country_code': 'RU', 'admin': 'Москва', 'forecast_days': 2,
+            'latitude': 55.75222, 'longitude': 37.61556, 'timezone': 'Europe/Moscow',
+        }]
+        session.save()
+
+        response = self.client.get(reverse('weather_search:search'))
+        link = re.search(r'href="([^"]+)"\s+title="Показать', response.content.decode()).group(1)
+        self.assertIn('latitude=55.75222', link)
+
+        response = self.client.get(html.unescape(link))
+
+        mock_get.assert_not_called()
+        self.assertContains(response, '<table class="weather-table">', count=2)
+        self.assertEqual(len(self.client.session['city_history']), 1)
+
+    def test_history_link_without_coordinates_uses_geocoding(self):
+        session = self.client.session
+        session['city_history'] = [{'city': 'Москва', 'admin': 'Москва', 'forecast_days': 1}]
+        session.save()
+
+        response = self.client.get(reverse('weather_search:search'))
+
+        self.assertNotContains(response, 'latitude=')
+        response = self.client.get(reverse('weather_search:search'), {
+            'city': 'Москва', 'admin': 'Москва', 'forecast_days': 1, 'history': 'true',
+        })
+        self.assertContains(response, '<table class="weather-table">', count=1)
+        self.assertEqual(self.client.session['city_history'][-1]['timezone'], 'Europe/Moscow')
+
 
-class WeatherForecastMockTest(TestCase):
-    @patch('weather_search.views.openmeteo_requests.Client.weather_api')
-    @patch('weather_search.utils.requests.get')
+@override_settings(HISTORY_WRITE_BEHIND={'ENABLED': False})
+class WeatherForecastMockTest(UpstreamStateMixin, TestCase):
+    @patch('weather_search.upstream.openmeteo_requests.Client.weather_api')
+    @patch('weather_search.upstream.niquests.Session.get')
     def test_forecast_with_mocked_api_renders_two_days(self, mock_get, mock_weather_api):
 
         mock_get.return_value.status_code = 200
@@ -212,10 +322,1121 @@ class WeatherForecastMockTest(TestCase):
                 'count': 5,
                 'language': 'ru',
                 'countryCode': None
-            }
+            },
+            timeout=(3.05, 5)
         )
 
         mock_weather_api.assert_called_with(
             'https://api.open-meteo.com/v1/forecast',
-            params=ANY
+            params=ANY,
+            timeout=(3.05, 10)
+        )
+
+
+class GeoCodingCacheTest(UpstreamStateMixin, TestCase):
+    @patch('weather_search.upstream.niquests.Session.get')
+    def test_repeated_request_served_from_cache(self, mock_get):
+        mock_get.return_value.json.return_value = mock_geocoding_api_request()
+
+        first = geo_coding_request(city='Москва')
+        second = geo_coding_request(city='  москва ')
+
+        self.assertEqual(first, second)
+        mock_get.assert_called_once()
+        self.assertEqual(geocoding_cache.stats()['hits'], 1)
+        self.assertEqual(geocoding_cache.stats()['misses'], 1)
+
+    @patch('weather_search.upstream.niquests.Session.get')
+    def test_city_not_found_is_cached(self, mock_get):
+        mock_get.return_value.json.return_value = {}
+
+        for _ in range(2):
+            with self.assertRaisesMessage(CityNotFound, 'Город не найден'):
+                geo_coding_request(city='safgre21')
+
+        mock_get.assert_called_once()
+
+    @patch('weather_search.upstream.niquests.Session.get')
+    def test_cache_counters_on_metrics_endpoint(self, mock_get):
+        mock_get.return_value.json.return_value = mock_geocoding_api_request()
+
+        geo_coding_request(city='Москва')
+        geo_coding_request(city='Москва')
+        with override_settings(REQUEST_TIMING={**settings.REQUEST_TIMING, 'METRICS_TOKEN': METRICS_TOKEN}):
+            response = self.client.get(reverse('metrics'), headers=METRICS_AUTH)
+
+        self.assertContains(response, 'meteo_cache_hits_total{cache="geocoding"} 1')
+        self.assertContains(response, 'meteo_cache_misses_total{cache="geocoding"} 1')
+        self.assertContains(response, 'meteo_cache_entries{cache="geocoding"} 1')
+
+    @patch('weather_search.upstream.niquests.Session.get')
+    def test_upstream_errors_are_not_cached(self, mock_get):
+        mock_get.return_value.raise_for_status.side_effect = niquests.HTTPError
+
+        for _ in range(2):
+            with self.assertRaisesMessage(GeoApiException, 'Ошибка при запросе геоданных'):
+                geo_coding_request(city='Москва')
+
+        self.assertEqual(mock_get.call_count, 2)
+
+    @patch('weather_search.upstream.niquests.Session.get')
+    def test_connection_errors_are_reported(self, mock_get):
+        mock_get.side_effect = niquests.ConnectTimeout
+
+        with self.assertRaisesMessage(GeoApiException, 'Ошибка при запросе геоданных'):
+            geo_coding_request(city='Москва')
+
+    @patch('weather_search.upstream.niquests.Session.get')
+    def test_cache_evicts_least_recently_used(self, mock_get):
+        mock_get.return_value.json.return_value = mock_geocoding_api_request()
+
+        with patch.object(geocoding_cache, 'maxsize', 2):
+            geo_coding_request(city='Москва')
+            geo_coding_request(city='Тула')
+            geo_coding_request(city='Москва')
+            geo_coding_request(city='Омск')
+
+            self.assertEqual(len(geocoding_cache), 2)
+            geo_coding_request(city='Москва')
+            self.assertEqual(mock_get.call_count, 3)
+
+
+class ForecastCacheTest(UpstreamStateMixin, TestCase):
+    @patch('weather_search.upstream.openmeteo_requests.Client.weather_api')
+    def test_repeated_forecast_served_from_cache(self, mock_weather_api):
+        mock_weather_api.return_value = [mock_weather_api_response()]
+
+        first = get_forecast(55.75222, 37.61556, 3)
+        second = get_forecast(55.7524, 37.6171, 3)
+
+        mock_weather_api.assert_called_once()
+        self.assertEqual(first.timezone, second.timezone)
+        np.testing.assert_array_equal(first.hourly[0], second.hourly[0])
+        self.assertEqual(first.timezone, 'Europe/Moscow')
+        self.assertEqual(len(first.hourly[0]), 48)
+
+    @patch('weather_search.upstream.openmeteo_requests.Client.weather_api')
+    def test_forecast_days_is_part_of_cache_key(self, mock_weather_api):
+        mock_weather_api.return_value = [mock_weather_api_response()]
+
+        get_forecast(55.75, 37.61, 3)
+        get_forecast(55.75, 37.61, 5)
+
+        self.assertEqual(mock_weather_api.call_count, 2)
+        self.assertNotEqual(forecast_cache_key(55.75, 37.61, 3), forecast_cache_key(55.75, 37.61, 5))
+
+    def test_cache_ttl_ends_at_upstream_refresh(self):
+        # 12:00 + 5 мин задержки обновления
+        self.assertEqual(forecast_cache_ttl(now=12 * 3600), 5 * 60)
+        self.assertEqual(forecast_cache_ttl(now=12 * 3600 + 5 * 60), 3600)
+        self.assertEqual(forecast_cache_ttl(now=12 * 3600 + 30 * 60), 35 * 60)
+
+
+class HourlyPipelineTest(TestCase):
+    @staticmethod
+    def make_forecast(start, hours):
+        return Forecast(
+            timezone='Europe/Berlin',
+            current=(1, 2, 3, 4, 5),
+            hourly_time=start,
+            hourly_interval=3600,
+            hourly=[np.arange(hours, dtype=np.float32) / 3 + idx for idx in range(6)],
         )
+
+    def test_utc_offsets_follow_dst_transition(self):
+        tz = ZoneInfo('Europe/Berlin')
+        # 2025-03-29 00:00 UTC, переход на летнее время 2025-03-30 01:00 UTC
+        start = int(datetime(2025, 3, 29, tzinfo=timezone.utc).timestamp())
+        timestamps = start + np.arange(96, dtype=np.int64) * 3600
+
+        expected = [int(datetime.fromtimestamp(int(ts), tz=tz).utcoffset().total_seconds()) for ts in timestamps]
+        self.assertEqual(utc_offsets(timestamps, tz, step=24).tolist(), expected)
+
+    def test_hourly_by_day_matches_per_hour_conversion(self):
+        tz = ZoneInfo('Europe/Berlin')
+        start = int(datetime(2025, 3, 29, tzinfo=timezone.utc).timestamp())
+        now = datetime(2025, 3, 29, 10, 30, tzinfo=timezone.utc)
+        forecast = self.make_forecast(start, 72)
+
+        result = build_hourly_by_day(forecast, tz, now=now)
+
+        rounded_local = now.astimezone(tz).replace(minute=0)
+        expected = {}
+        for i in range(72):
+            current_hour = datetime.fromtimestamp(start + i * 3600, tz=tz)
+            if current_hour < rounded_local:
+                continue
+            expected.setdefault(current_hour.date(), []).append(current_hour.strftime('%Y-%m-%d %H:%M'))
+
+        self.assertEqual(list(result), list(expected))
+        for day, hours in result.items():
+            self.assertEqual([hour['time'] for hour in hours], expected[day])
+
+        first_hour = result[rounded_local.date()][0]
+        self.assertEqual(first_hour['temperature'], round(float(np.float32(10 / 3)), 2))
+        self.assertEqual(first_hour['humidity'], float(np.float32(10 / 3) + 2))
+
+    def test_hourly_table_rows_are_views_over_columns(self):
+        start = int(datetime(2025, 6, 1, tzinfo=timezone.utc).timestamp())
+        forecast = self.make_forecast(start, 48)
+
+        result = build_hourly_by_day(forecast, ZoneInfo('UTC'), now=datetime(2025, 6, 1, tzinfo=timezone.utc))
+
+        self.assertIsInstance(result, HourlyTable)
+        hours = result[date(2025, 6, 2)]
+        self.assertEqual(len(hours), 24)
+        self.assertIsInstance(hours[-1], HourRow)
+        self.assertEqual(hours[-1]['time'], '2025-06-02 23:00')
+        self.assertEqual(hours[-1].time, hours[-1]['time'])
+        self.assertEqual(set(hours[0].as_dict()), set(HourlyTable.FIELDS))
+        with self.assertRaises(KeyError):
+            result['items']
+
+    def test_forecast_survives_cache_roundtrip(self):
+        forecast = self.make_forecast(1_700_000_000, 24)
+        caches['forecast'].set('forecast-roundtrip', forecast)
+
+        cached = caches['forecast'].get('forecast-roundtrip')
+
+        self.assertEqual(cached.timezone, 'Europe/Berlin')
+        self.assertEqual(cached.hourly.dtype, np.float32)
+        np.testing.assert_array_equal(cached.timestamps(), forecast.timestamps())
+        self.assertTrue(cached.replace(stale=True).stale)
+        self.assertFalse(cached.stale)
+
+
+@override_settings(HISTORY_WRITE_BEHIND={'ENABLED': False})
+class SearchCityAsyncTest(UpstreamStateMixin, TestCase):
+    async def get_search_page(self, params):
+        request = AsyncRequestFactory().get(reverse('weather_search:search'), params)
+        request.session = SessionStore()
+        request.user = AnonymousUser()
+
+        async def auser():
+            return request.user
+
+        request.auser = auser
+        return request, await search_city_async(request)
+
+    @patch('weather_search.upstream.openmeteo_requests.AsyncClient.weather_api', new_callable=AsyncMock)
+    @patch('weather_search.upstream.niquests.AsyncSession.get', new_callable=AsyncMock)
+    async def test_async_search_renders_forecast(self, mock_get, mock_weather_api):
+        mock_get.return_value = MagicMock()
+        mock_get.return_value.json.return_value = mock_geocoding_api_request()
+        mock_weather_api.return_value = [mock_weather_api_response()]
+
+        request, response = await self.get_search_page({'city': 'Москва', 'forecast_days': 2})
+
+        self.assertContains(response, '<strong>Город:</strong> Москва')
+        self.assertContains(response, '<table class="weather-table">', count=2)
+        self.assertContains(response, '<tr data-hour-row>', count=expected_hour_rows(forecast_days=2))
+        self.assertEqual((await request.session.aget('city_history'))[0]['city'], 'Москва')
+        self.assertEqual(await HistoryModel.objects.filter(city='Москва', user=None).acount(), 1)
+
+    @patch('weather_search.upstream.niquests.AsyncSession.get', new_callable=AsyncMock)
+    async def test_async_search_geocoding_error(self, mock_get):
+        mock_get.return_value = MagicMock()
+        mock_get.return_value.json.return_value = {}
+
+        request, response = await self.get_search_page({'city': 'safgre21', 'forecast_days': 2})
+
+        self.assertContains(response, 'Город не найден')
+        self.assertNotContains(response, '<table')
+
+
+class UpstreamClientTest(TestCase):
+    def test_sessions_are_shared(self):
+        from .upstream import http_session, forecast_client
+
+        self.assertIs(http_session(), http_session())
+        self.assertIs(forecast_client().session, http_session())
+
+    def test_session_has_pool_and_retries(self):
+        from .upstream import http_session
+
+        adapter = http_session().get_adapter('https://api.open-meteo.com/v1/forecast')
+        self.assertEqual(adapter.max_retries.total, 2)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+
+
+class SingleFlightTest(UpstreamStateMixin, TestCase):
+    @patch('weather_search.upstream.openmeteo_requests.Client.weather_api')
+    def test_concurrent_forecast_requests_are_coalesced(self, mock_weather_api):
+        release = threading.Event()
+
+        def slow_weather_api(*args, **kwargs):
+            release.wait(timeout=5)
+            return [mock_weather_api_response()]
+
+        mock_weather_api.side_effect = slow_weather_api
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [executor.submit(get_forecast, 55.75, 37.61, 3) for _ in range(8)]
+            while forecast_flight.in_flight() == 0:
+                time.sleep(0.001)
+            time.sleep(0.05)
+            release.set()
+            results = [future.result() for future in futures]
+
+        mock_weather_api.assert_called_once()
+        self.assertTrue(all(result.timezone == 'Europe/Moscow' for result in results))
+
+    def test_errors_are_shared_with_waiters(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def failing():
+            calls.append(1)
+            started.set()
+            release.wait(timeout=5)
+            raise GeoApiException('Ошибка при запросе геоданных')
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            leader = executor.submit(flight.do, 'key', failing)
+            started.wait(timeout=5)
+            waiter = executor.submit(flight.do, 'key', failing)
+            time.sleep(0.05)
+            release.set()
+
+            for future in (leader, waiter):
+                with self.assertRaises(GeoApiException):
+                    future.result()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.in_flight(), 0)
+
+    @patch('weather_search.upstream.niquests.AsyncSession.get', new_callable=AsyncMock)
+    async def test_concurrent_async_geocoding_is_coalesced(self, mock_get):
+        async def slow_get(*args, **kwargs):
+            await asyncio.sleep(0.05)
+            response = MagicMock()
+            response.json.return_value = mock_geocoding_api_request()
+            return response
+
+        mock_get.side_effect = slow_get
+
+        results = await asyncio.gather(*(async_geo_coding_request(city='Москва') for _ in range(10)))
+
+        mock_get.assert_called_once()
+        self.assertTrue(all(result['name'] == 'Москва' for result in results))
+
+
+@override_settings(HISTORY_WRITE_BEHIND={'ENABLED': False},
+                   REQUEST_TIMING={**settings.REQUEST_TIMING, 'METRICS_TOKEN': METRICS_TOKEN})
+class RequestTimingTest(UpstreamStateMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        metrics_registry().clear()
+
+    @patch('weather_search.upstream.openmeteo_requests.Client.weather_api')
+    @patch('weather_search.upstream.niquests.Session.get')
+    def test_search_phases_in_server_timing(self, mock_get, mock_weather_api):
+        mock_get.return_value.json.return_value = mock_geocoding_api_request()
+        mock_weather_api.return_value = [mock_weather_api_response()]
+
+        response = self.client.get(reverse('weather_search:search'), {'city': 'Москва', 'forecast_days': 1})
+
+        phases = [item.split(';')[0] for item in response['Server-Timing'].split(', ')]
+        for name in ('history', 'geocoding', 'forecast', 'forecast_fetch', 'forecast_decode',
+                     'forecast_build', 'render', 'db', 'total'):
+            self.assertIn(name, phases)
+        self.assertRegex(response['Server-Timing'], r'db;desc="[1-9]\d* queries"')
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('weather_search:search'))
+        self.client.get(reverse('weather_search:search'))
+
+        response = self.client.get(reverse('metrics'), headers=METRICS_AUTH)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'meteo_request_phase_seconds_count{view="weather_search:search",phase="render"} 2')
+        self.assertContains(response, 'meteo_request_phase_seconds_bucket{view="weather_search:search",phase="total",le="+Inf"} 2')
+        self.assertContains(response, 'meteo_request_db_queries_count{view="weather_search:search"} 2')
+
+    def test_other_views_are_not_timed(self):
+        response = self.client.get(reverse('metrics'), headers=METRICS_AUTH)
+
+        self.assertNotIn('Server-Timing', response)
+
+    def test_metrics_endpoint_access(self):
+        url = reverse('metrics')
+
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+
+        self.client.force_login(get_user_model().objects.create_user(username='user', password='password'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(get_user_model().objects.create_user(username='staff', password='password', is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_metrics_without_token_only_for_staff(self):
+        with override_settings(REQUEST_TIMING={**settings.REQUEST_TIMING, 'METRICS_TOKEN': ''}):
+            self.assertEqual(self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer '}).status_code, 403)
+
+    def test_phase_outside_request_is_noop(self):
+        with phase('geocoding'):
+            pass
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram((0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.cumulative(), [(0.1, 2), (1, 3), (float('inf'), 4)])
+        self.assertEqual(histogram.count, 4)
+
+    def test_server_timing_format(self):
+        timing = RequestTiming()
+        timing.add('geocoding', 0.0123)
+        timing.add('geocoding', 0.001)
+        timing.add_query(0.002)
+
+        self.assertEqual(timing.server_timing(0.5),
+                         'geocoding;dur=13.3, db;desc="1 queries";dur=2.0, total;dur=500.0')
+
+
+class OpenMeteoStubTest(OpenMeteoStubMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(setattr, self.stub, 'config', StubConfig())
+
+    def test_geocoding(self):
+        result = geo_coding_request(city='Москва')
+
+        self.assertEqual(result['name'], 'Москва')
+        self.assertEqual(result['country_code'], 'RU')
+
+    def test_forecast_is_decoded_by_openmeteo_client(self):
+        forecast = get_forecast(55.75, 37.62, 3)
+
+        self.assertEqual(forecast.timezone, 'Europe/Moscow')
+        self.assertEqual(forecast.hourly_interval, 3600)
+        self.assertEqual([len(values) for values in forecast.hourly], [72] * 6)
+
+        tz = ZoneInfo(forecast.timezone)
+        hourly_by_day = build_hourly_by_day(forecast, tz)
+        self.assertEqual(datetime.fromtimestamp(forecast.hourly_time, tz).hour, 0)
+        self.assertLessEqual(len(hourly_by_day), 3)
+
+    def test_several_locations_in_one_response(self):
+        responses = forecast_client().weather_api(
+            f'{self.stub.base_url}/v1/forecast',
+            params={'latitude': '55.75,51.51', 'longitude': '37.62,-0.13', 'hourly': 'temperature_2m',
+                    'forecast_days': 1},
+        )
+
+        self.assertEqual([response.Timezone() for response in responses], [b'Europe/Moscow', b'Europe/London'])
+
+    def test_error_injection(self):
+        self.stub.config = StubConfig(error_rate=1, error_status=429)
+
+        response = self.client.get(reverse('weather_search:search'), {'city': 'Москва', 'forecast_days': 1})
+
+        self.assertContains(response, 'Ошибка при запросе геоданных')
+
+    def test_latency(self):
+        self.stub.config = StubConfig(latency=0.2)
+
+        started = time.perf_counter()
+        geo_coding_request(city='Москва')
+
+        self.assertGreaterEqual(time.perf_counter() - started, 0.2)
+
+
+class ForecastBenchmarkTest(TestCase):
+    def test_stages_produce_full_page(self):
+        benchmark = ForecastBenchmark(16)
+
+        self.assertEqual(benchmark.hourly_rows(), 16 * 24)
+        self.assertEqual(benchmark.render().count('<tr data-hour-row>'), 16 * 24)
+        self.assertEqual(benchmark.total(), benchmark.render())
+
+    def test_run_benchmarks(self):
+        results = run_benchmarks(days=[1, 2], repeat=1, min_time=0)
+
+        self.assertEqual(set(results), set(STAGES))
+        for stage in STAGES:
+            self.assertEqual(set(results[stage]), {1, 2})
+            self.assertGreater(results[stage][1]['median'], 0)
+
+    def test_compare_marks_regressions(self):
+        results = {'render': {1: {'median': 0.003, 'min': 0.003}, 2: {'median': 0.002, 'min': 0.002}}}
+        baseline = {'render': {1: {'median': 0.002, 'min': 0.002}}}
+
+        self.assertEqual(compare(results, baseline, threshold=1.25), [('render', 1, 0.003, 0.002, 1.5, True)])
+
+
+class CircuitBreakerTest(TestCase):
+    def failing(self):
+        raise niquests.ConnectionError
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker('test', failure_threshold=2, recovery_timeout=60)
+
+        for _ in range(2):
+            with self.assertRaises(niquests.ConnectionError):
+                breaker.call(self.failing)
+
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.call(lambda: 'ok')
+
+    def test_success_resets_failure_count(self):
+        breaker = CircuitBreaker('test', failure_threshold=2, recovery_timeout=60)
+
+        with self.assertRaises(niquests.ConnectionError):
+            breaker.call(self.failing)
+        breaker.call(lambda: 'ok')
+        with self.assertRaises(niquests.ConnectionError):
+            breaker.call(self.failing)
+
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_allows_single_probe(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, recovery_timeout=0)
+        with self.assertRaises(niquests.ConnectionError):
+            breaker.call(self.failing)
+
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        self.assertTrue(breaker.is_open())
+
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_probe_opens_circuit_again(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, recovery_timeout=0.05)
+        with self.assertRaises(niquests.ConnectionError):
+            breaker.call(self.failing)
+        time.sleep(0.06)
+
+        with self.assertRaises(niquests.ConnectionError):
+            breaker.call(self.failing)
+
+        self.assertTrue(breaker.is_open())
+
+
+@override_settings(HISTORY_WRITE_BEHIND={'ENABLED': False})
+class ForecastResilienceTest(UpstreamStateMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(reset_breakers)
+
+    def put_stale(self, lat, lon, days):
+        """Кладет в кэш прогноз, срок актуальности которого истек"""
+
+        snapshot = Forecast(
+            timezone='Europe/Moscow',
+            current=(1.0, 2.0, 3.0, 0.0, 1.0),
+            hourly_time=int(time.time()) // 3600 * 3600,
+            hourly_interval=3600,
+            hourly=np.zeros((6, days * 24), dtype=np.float32),
+            fetched_at=time.time() - 7200,
+        )
+        caches['forecast'].set(forecast_cache_key(lat, lon, days), (time.time() - 1, snapshot), 3600)
+        return snapshot
+
+    @patch('weather_search.upstream.openmeteo_requests.Client.weather_api')
+    def test_stale_forecast_served_on_upstream_error(self, mock_weather_api):
+        mock_weather_api.side_effect = niquests.ConnectionError
+        self.put_stale(55.75, 37.62, 1)
+
+        forecast = get_forecast(55.75, 37.62, 1)
+
+        self.assertTrue(forecast.stale)
+        self.assertEqual(forecast.timezone, 'Europe/Moscow')
+
+    @patch('weather_search.upstream.openmeteo_requests.Client.weather_api')
+    def test_stale_forecast_served_when_upstream_is_slow(self, mock_weather_api):
+        def slow(*args, **kwargs):
+            time.sleep(0.3)
+            return [mock_weather_api_response()]
+
+        mock_weather_api.side_effect = slow
+        self.put_stale(55.75, 37.62, 2)
+
+        with override_settings(FORECAST_CACHE={**settings.FORECAST_CACHE, 'LATENCY_BUDGET': 0.05}):
+            started = time.perf_counter()
+            forecast = get_forecast(55.75, 37.62, 2)
+            self.assertLess(time.perf_counter() - started, 0.25)
+            self.assertTrue(forecast.stale)
+
+            # Обновление завершается в фоне и следующий запрос получает свежий прогноз
+            forecast_flight.pending(forecast_cache_key(55.75, 37.62, 2)).result(timeout=5)
+            forecast = get_forecast(55.75, 37.62, 2)
+
+        self.assertFalse(forecast.stale)
+        mock_weather_api.assert_called_once()
+
+    @patch('weather_search.upstream.openmeteo_requests.Client.weather_api')
+    def test_fresh_response_within_budget_replaces_stale(self, mock_weather_api):
+        mock_weather_api.return_value = [mock_weather_api_response()]
+        self.put_stale(55.75, 37.62, 2)
+
+        forecast = get_forecast(55.75, 37.62, 2)
+
+        self.assertFalse(forecast.stale)
+        self.assertEqual(len(forecast.hourly[0]), 48)
+
+    @patch('weather_search.upstream.openmeteo_requests.Client.weather_api')
+    def test_error_without_stale_copy_is_cached(self, mock_weather_api):
+        mock_weather_api.side_effect = niquests.ConnectionError
+
+        for _ in range(2):
+            with self.assertRaisesMessage(ForecastApiException, FORECAST_REQUEST_FAILED):
+                get_forecast(55.75, 37.62, 3)
+
+        mock_weather_api.assert_called_once()
+
+    @patch('weather_search.upstream.openmeteo_requests.Client.weather_api')
+    def test_open_circuit_fails_fast(self, mock_weather_api):
+        mock_weather_api.side_effect = niquests.ConnectionError
+        breaker = breaker_for('forecast')
+
+        for lat in range(breaker.failure_threshold):
+            with self.assertRaises(ForecastApiException):
+                get_forecast(10 + lat, 37.62, 3)
+
+        with self.assertRaisesMessage(ForecastApiException, FORECAST_UNAVAILABLE):
+            get_forecast(50, 37.62, 3)
+        self.assertEqual(mock_weather_api.call_count, breaker.failure_threshold)
+
+        # При разомкнутой цепи устаревшая копия отдается без обращения к Open-Meteo
+        self.put_stale(55.75, 37.62, 1)
+        self.assertTrue(get_forecast(55.75, 37.62, 1).stale)
+        self.assertEqual(mock_weather_api.call_count, breaker.failure_threshold)
+
+    @patch('weather_search.upstream.openmeteo_requests.AsyncClient.weather_api', new_callable=AsyncMock)
+    async def test_async_stale_forecast_served_on_upstream_error(self, mock_weather_api):
+        mock_weather_api.side_effect = niquests.ConnectionError
+        self.put_stale(55.75, 37.62, 1)
+
+        forecast = await aget_forecast(55.75, 37.62, 1)
+
+        self.assertTrue(forecast.stale)
+
+    @patch('weather_search.upstream.openmeteo_requests.Client.weather_api')
+    @patch('weather_search.upstream.niquests.Session.get')
+    def test_search_page_marks_stale_forecast(self, mock_get, mock_weather_api):
+        mock_get.return_value.json.return_value = mock_geocoding_api_request()
+        mock_weather_api.side_effect = niquests.ConnectionError
+        geo = mock_geocoding_api_request()['results'][0]
+        self.put_stale(geo['latitude'], geo['longitude'], 1)
+
+        response = self.client.get(reverse('weather_search:search'), {'city': 'Москва', 'forecast_days': 1})
+
+        self.assertContains(response, 'data-forecast-stale')
+        self.assertContains(response, '<h3>Текущая погода</h3>')
+
+    @patch('weather_search.upstream.openmeteo_requests.Client.weather_api')
+    @patch('weather_search.upstream.niquests.Session.get')
+    def test_search_page_reports_forecast_error(self, mock_get, mock_weather_api):
+        mock_get.return_value.json.return_value = mock_geocoding_api_request()
+        mock_weather_api.side_effect = niquests.ConnectionError
+
+        response = self.client.get(reverse('weather_search:search'), {'city': 'Москва', 'forecast_days': 1})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, FORECAST_REQUEST_FAILED)
+        self.assertNotContains(response, '<table')
+
+    @patch('weather_search.upstream.niquests.Session.get')
+    def test_stale_geocoding_served_when_geocoder_fails(self, mock_get):
+        mock_get.return_value.json.return_value = mock_geocoding_api_request()
+        geo_coding_request(city='Москва')
+        with patch.object(geocoding_cache, 'ttl', 0):
+            geocoding_cache.clear()
+            geo_coding_request(city='Москва')
+
+        mock_get.side_effect = niquests.ConnectTimeout
+
+        self.assertEqual(geo_coding_request(city='Москва')['name'], 'Москва')
+        self.assertEqual(mock_get.call_count, 3)
+
+
+class MultiCityForecastTest(OpenMeteoStubMixin, TestCase):
+    LOCATIONS = [(55.75222, 37.61556), (59.93863, 30.31413), (51.50853, -0.12574)]
+
+    def test_single_upstream_call_for_all_locations(self):
+        client = forecast_client()
+        with patch.object(client, 'weather_api', wraps=client.weather_api) as weather_api:
+            forecasts = get_forecasts(self.LOCATIONS, 2)
+
+        weather_api.assert_called_once()
+        self.assertEqual(weather_api.call_args.kwargs['params']['latitude'], '55.75,59.94,51.51')
+        self.assertEqual([f.timezone for f in forecasts], ['Europe/Moscow', 'Europe/Moscow', 'Europe/London'])
+        self.assertTrue(all(len(f.hourly[0]) == 48 for f in forecasts))
+
+    def test_shares_cache_with_single_forecast(self):
+        single = get_forecast(*self.LOCATIONS[0], 2)
+
+        client = forecast_client()
+        with patch.object(client, 'weather_api', wraps=client.weather_api) as weather_api:
+            forecasts = get_forecasts(self.LOCATIONS + [self.LOCATIONS[1]], 2)
+            self.assertEqual(get_forecast(*self.LOCATIONS[2], 2).current, forecasts[2].current)
+
+        weather_api.assert_called_once()
+        # В запрос попадают только точки без записи в кэше, повторы - один раз
+        self.assertEqual(weather_api.call_args.kwargs['params']['latitude'], '59.94,51.51')
+        self.assertEqual(forecasts[0].current, single.current)
+        self.assertIs(forecasts[1], forecasts[3])
+
+    def test_stale_copies_on_upstream_error(self):
+        get_forecasts(self.LOCATIONS[:1], 1)
+        cache_key = forecast_cache_key(*self.LOCATIONS[0], 1)
+        fresh_until, snapshot = caches['forecast'].get(cache_key)
+        caches['forecast'].set(cache_key, (time.time() - 1, snapshot), 3600)
+
+        with patch.object(forecast_client(), 'weather_api', side_effect=niquests.ConnectionError):
+            forecasts = get_forecasts(self.LOCATIONS[:2], 1)
+
+        self.assertTrue(forecasts[0].stale)
+        self.assertIsNone(forecasts[1])
+
+    def test_stale_batch_waits_only_latency_budget(self):
+        get_forecasts(self.LOCATIONS, 1)
+        cache_keys = [forecast_cache_key(lat, lon, 1) for lat, lon in self.LOCATIONS]
+        for cache_key in cache_keys:
+            fresh_until, snapshot = caches['forecast'].get(cache_key)
+            caches['forecast'].set(cache_key, (time.time() - 1, snapshot), 3600)
+
+        self.addCleanup(setattr, self.stub, 'config', StubConfig())
+        self.stub.config = StubConfig(latency=0.3)
+
+        with override_settings(FORECAST_CACHE={**settings.FORECAST_CACHE, 'LATENCY_BUDGET': 0.05}):
+            started = time.perf_counter()
+            forecasts = get_forecasts(self.LOCATIONS, 1)
+            self.assertLess(time.perf_counter() - started, 0.25)
+            self.assertTrue(all(forecast.stale for forecast in forecasts))
+
+            # Пакет дообновляется в фоне
+            forecast_flight.pending(('batch', *cache_keys)).result(timeout=5)
+
+        self.assertFalse(any(forecast.stale for forecast in get_forecasts(self.LOCATIONS, 1)))
+
+    async def test_async_batch(self):
+        forecasts = await aget_forecasts(self.LOCATIONS, 1)
+
+        self.assertEqual(len(forecasts), 3)
+        self.assertEqual(forecasts[2].timezone, 'Europe/London')
+
+    def test_daily_summary(self):
+        forecast = get_forecast(*self.LOCATIONS[0], 3)
+        summary = build_daily_summary(forecast, ZoneInfo(forecast.timezone))
+
+        self.assertEqual(len(summary), 3)
+        first_day = forecast.hourly[0][:24]
+        self.assertAlmostEqual(summary[0]['temperature_max'], float(first_day.max()), places=2)
+        self.assertAlmostEqual(summary[0]['temperature_min'], float(first_day.min()), places=2)
+
+    def test_compare_page_for_session_history(self):
+        session = self.client.session
+        session['city_history'] = [
+            {'city': 'Москва', 'country': 'Россия', 'forecast_days': 1,
+             'latitude': 55.75222, 'longitude': 37.61556, 'timezone': 'Europe/Moscow'},
+            # Запись без координат геокодируется
+            {'city': 'Лондон', 'forecast_days': 2},
+        ]
+        session.save()
+
+        client = forecast_client()
+        with patch.object(client, 'weather_api', wraps=client.weather_api) as weather_api:
+            response = self.client.get(reverse('weather_search:compare'), {'forecast_days': 4})
+
+        weather_api.assert_called_once()
+        self.assertContains(response, '<div class="weather-block" data-compare-city>', count=2)
+        self.assertContains(response, '<tr data-day-row>', count=8)
+        self.assertContains(response, 'Лондон')
+
+    def test_compare_page_without_history(self):
+        response = self.client.get(reverse('weather_search:compare'))
+
+        self.assertContains(response, 'История поиска пуста')
+        self.assertNotContains(response, 'data-compare-city')
+
+
+class ForecastPrewarmTest(OpenMeteoStubMixin, TestCase):
+    MOSCOW = {'city': 'Москва', 'country': 'Россия', 'country_code': 'RU', 'admin': 'Москва',
+              'latitude': 55.75222, 'longitude': 37.61556, 'timezone': 'Europe/Moscow'}
+    LONDON = {'city': 'Лондон', 'country': 'Великобритания', 'country_code': 'GB', 'admin': 'Англия',
+              'latitude': 51.50853, 'longitude': -0.12574, 'timezone': 'Europe/London'}
+
+    def setUp(self):
+        super().setUp()
+
+        today = django_timezone.localdate()
+        CityDailySearchCount.objects.bulk_create([
+            CityDailySearchCount(city='Москва', day=today, count=10),
+            CityDailySearchCount(city='Лондон', day=today, count=5),
+            CityDailySearchCount(city='Тула', day=today, count=1),
+        ])
+        HistoryModel.objects.bulk_create(
+            [HistoryModel(**self.MOSCOW, forecast_days=3) for _ in range(2)]
+            + [HistoryModel(**self.MOSCOW, forecast_days=1), HistoryModel(**self.LONDON, forecast_days=1)]
+        )
+        self.prewarmer = ForecastPrewarmer(top_n=2, days_per_city=2, rate=100, min_interval=0)
+
+    def test_targets_are_popular_cities_with_history_coordinates(self):
+        targets = [(t.city, t.latitude, t.forecast_days) for t in self.prewarmer.targets()]
+
+        self.assertEqual(targets, [('Москва', 55.75222, 3), ('Москва', 55.75222, 1), ('Лондон', 51.50853, 1)])
+
+    def test_city_without_coordinates_is_geocoded(self):
+        HistoryModel.objects.filter(city='Лондон').update(latitude=None, longitude=None)
+
+        targets = self.prewarmer.targets()
+
+        self.assertEqual(targets[-1].city, 'Лондон')
+        self.assertAlmostEqual(targets[-1].latitude, 51.50853)
+
+    def test_run_once_warms_due_entries_in_batches(self):
+        client = forecast_client()
+        with patch.object(client, 'weather_api', wraps=client.weather_api) as weather_api:
+            warmed, interval = self.prewarmer.run_once()
+
+            # Один запрос на каждое значение forecast_days
+            self.assertEqual(weather_api.call_count, 2)
+            self.assertEqual(warmed, 3)
+            self.assertGreater(interval, 0)
+            self.assertLessEqual(interval, self.prewarmer.max_interval)
+
+            warmed, _ = self.prewarmer.run_once()
+            self.assertEqual(warmed, 0)
+            self.assertEqual(weather_api.call_count, 2)
+
+        self.assertIsNotNone(caches['forecast'].get(forecast_cache_key(51.50853, -0.12574, 1)))
+
+    def test_expired_entries_are_refreshed(self):
+        self.prewarmer.run_once()
+        cache_key = forecast_cache_key(55.75222, 37.61556, 3)
+        _, snapshot = caches['forecast'].get(cache_key)
+        caches['forecast'].set(cache_key, (time.time() - 1, snapshot), 3600)
+
+        warmed, _ = self.prewarmer.run_once()
+
+        self.assertEqual(warmed, 1)
+        self.assertGreater(caches['forecast'].get(cache_key)[0], time.time())
+
+    def test_open_circuit_skips_pass_and_backs_off(self):
+        breaker = breaker_for('forecast')
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        self.prewarmer.min_interval = 5
+
+        client = forecast_client()
+        with patch.object(client, 'weather_api') as weather_api:
+            warmed, interval = self.prewarmer.run_once()
+            warmed, next_interval = self.prewarmer.run_once()
+
+        weather_api.assert_not_called()
+        self.assertEqual(warmed, 0)
+        self.assertEqual(interval, 5)
+        self.assertEqual(next_interval, 10)
+
+    def test_command_once(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        shared_cache = {**settings.CACHES['forecast'], 'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                        'LOCATION': location}
+
+        out = StringIO()
+        with override_settings(CACHES={**settings.CACHES, 'forecast': shared_cache}):
+            call_command('prewarm_forecasts', '--once', '--top-n', '1', stdout=out)
+
+        self.assertIn('Обновлено прогнозов: 2', out.getvalue())
+
+    def test_command_requires_shared_cache(self):
+        with self.assertRaisesMessage(CommandError, 'FORECAST_CACHE_BACKEND'):
+            call_command('prewarm_forecasts', '--once', stdout=StringIO())
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(rate=20, burst=1)
+
+        started = time.perf_counter()
+        for _ in range(3):
+            limiter.acquire()
+
+        self.assertGreaterEqual(time.perf_counter() - started, 0.09)
+
+
+@override_settings(SEARCH_STREAMING=True, HISTORY_WRITE_BEHIND={'ENABLED': False})
+class StreamedSearchTest(OpenMeteoStubMixin, TestCase):
+    PARAMS = {'city': 'Москва', 'forecast_days': 2}
+
+    def test_streamed_page_matches_regular_page(self):
+        # Город попадает в историю сессии, дальше оба ответа показывают одинаковую историю
+        b''.join(self.client.get(reverse('weather_search:search'), self.PARAMS).streaming_content)
+
+        with override_settings(SEARCH_STREAMING=False):
+            regular = self.client.get(reverse('weather_search:search'), self.PARAMS)
+        streamed = self.client.get(reverse('weather_search:search'), self.PARAMS)
+
+        self.assertFalse(regular.streaming)
+        self.assertTrue(streamed.streaming)
+        self.assertEqual(b''.join(streamed.streaming_content).decode(), regular.content.decode())
+
+    def test_shell_is_sent_before_forecast(self):
+        client = forecast_client()
+        with patch.object(client, 'weather_api', wraps=client.weather_api) as weather_api:
+            response = self.client.get(reverse('weather_search:search'), self.PARAMS)
+            chunks = iter(response.streaming_content)
+
+            shell = next(chunks).decode()
+            self.assertIn('<form class="center"', shell)
+            self.assertNotIn('Результат', shell)
+            weather_api.assert_not_called()
+
+            location = next(chunks).decode()
+            self.assertIn('<strong>Город:</strong> Москва', location)
+            weather_api.assert_not_called()
+
+            rest = b''.join(chunks).decode()
+            weather_api.assert_called_once()
+
+        self.assertIn('<h3>Текущая погода</h3>', rest)
+        self.assertEqual(rest.count('<table class="weather-table">'), 2)
+
+    def test_new_session_history_is_saved(self):
+        response = self.client.get(reverse('weather_search:search'), self.PARAMS)
+        b''.join(response.streaming_content)
+
+        self.assertEqual(self.client.session['city_history'][0]['city'], 'Москва')
+
+    def test_first_visit_gets_csrf_cookie(self):
+        response = self.client.get(reverse('weather_search:search'), self.PARAMS)
+        b''.join(response.streaming_content)
+
+        self.assertIn(settings.CSRF_COOKIE_NAME, response.cookies)
+        self.assertTrue(response.cookies[settings.CSRF_COOKIE_NAME].value)
+
+    @override_settings(FORECAST_PREFETCH={'ENABLED': True, 'TOP_N': 2, 'CONCURRENCY': 2})
+    @patch('search_field_autocomplete.views.prefetch_forecasts')
+    def test_prefetch_signal_from_streamed_first_visit(self, mock_prefetch):
+        client = Client(enforce_csrf_checks=True)
+        page = b''.join(client.get(reverse('weather_search:search'), self.PARAMS).streaming_content).decode()
+        csrf_token = re.search(r'data-csrf-token="([^"]+)"', page).group(1)
+        candidates = client.get(reverse('search_field_autocomplete:autocomplete_city'), {'q': 'Москва'}).json()
+
+        response = client.post(reverse('search_field_autocomplete:prefetch_forecast'), {
+            'prefetch_token': candidates[0]['prefetch_token'], 'forecast_days': 2,
+        }, headers={'X-CSRFToken': csrf_token})
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(mock_prefetch.call_args.args[1], '2')
+
+    def test_error_is_streamed(self):
+        response = self.client.get(reverse('weather_search:search'), {'city': 'safgre21', 'forecast_days': 2})
+
+        self.assertIn('Город не найден', b''.join(response.streaming_content).decode())
+
+    def test_page_without_search_is_not_streamed(self):
+        response = self.client.get(reverse('weather_search:search'))
+
+        self.assertFalse(response.streaming)
+
+    def test_server_timing_and_metrics(self):
+        registry = metrics_registry()
+        before = registry.render()
+
+        response = self.client.get(reverse('weather_search:search'), self.PARAMS)
+
+        self.assertIn('history;dur=', response['Server-Timing'])
+        self.assertNotIn('forecast;dur=', response['Server-Timing'])
+        b''.join(response.streaming_content)
+        self.assertNotEqual(registry.render(), before)
+        self.assertIn('phase="forecast"', registry.render())
+
+    async def test_async_streamed_page_matches_regular_page(self):
+        async def get(streaming):
+            request = AsyncRequestFactory().get(reverse('weather_search:search'), self.PARAMS)
+            request.session = SessionStore()
+            request.user = AnonymousUser()
+
+            async def auser():
+                return request.user
+
+            request.auser = auser
+            with override_settings(SEARCH_STREAMING=streaming):
+                response = await search_city_async(request)
+                if not streaming:
+                    return response.content.decode()
+                return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        self.assertEqual(await get(True), await get(False))
+
+    async def test_async_first_visit_gets_csrf_cookie(self):
+        request = AsyncRequestFactory().get(reverse('weather_search:search'), self.PARAMS)
+        request.session = SessionStore()
+        request.user = AnonymousUser()
+
+        async def auser():
+            return request.user
+
+        request.auser = auser
+        await search_city_async(request)
+
+        # По этому флагу CsrfViewMiddleware выставляет cookie до отправки тела ответа
+        self.assertTrue(request.META.get('CSRF_COOKIE_NEEDS_UPDATE'))
+
+
+@override_settings(FORECAST_INLINE_DAYS=2, HISTORY_WRITE_BEHIND={'ENABLED': False})
+class LazyForecastDayTest(OpenMeteoStubMixin, TestCase):
+    PARAMS = {'city': 'Москва', 'forecast_days': 4}
+
+    def _lazy_urls(self, response):
+        return [html.unescape(url) for url in re.findall(r'data-url="([^"]+)"', response.content.decode())]
+
+    def test_days_beyond_inline_are_placeholders(self):
+        response = self.client.get(reverse('weather_search:search'), self.PARAMS)
+
+        self.assertContains(response, '<table class="weather-table">', count=2)
+        self.assertEqual(len(self._lazy_urls(response)), 2)
+
+    def test_all_days_inline_when_disabled(self):
+        with override_settings(FORECAST_INLINE_DAYS=0):
+            response = self.client.get(reverse('weather_search:search'), self.PARAMS)
+
+        self.assertContains(response, '<table class="weather-table">', count=4)
+        self.assertNotContains(response, 'data-lazy-day')
+
+    def test_day_fragment_uses_cached_forecast(self):
+        response = self.client.get(reverse('weather_search:search'), self.PARAMS)
+        url = self._lazy_urls(response)[0]
+
+        client = forecast_client()
+        with patch.object(client, 'weather_api', wraps=client.weather_api) as weather_api:
+            fragment = self.client.get(url)
+            weather_api.assert_not_called()
+
+        self.assertEqual(fragment.status_code, 200)
+        self.assertTemplateUsed(fragment, 'weather_search/_hourly_day.html')
+        self.assertContains(fragment, '<table class="weather-table">', count=1)
+        self.assertNotContains(fragment, '<form')
+        self.assertRegex(fragment['Server-Timing'], r'(^|, )forecast;dur=')
+
+    def test_fragments_match_inline_page(self):
+        with override_settings(FORECAST_INLINE_DAYS=0):
+            full = self.client.get(reverse('weather_search:search'), self.PARAMS).content.decode()
+        response = self.client.get(reverse('weather_search:search'), self.PARAMS)
+
+        for url in self._lazy_urls(response):
+            with self.subTest(url=url):
+                self.assertIn(self.client.get(url).content.decode().strip(), full)
+
+    def test_day_fragment_bad_params(self):
+        params = {'latitude': 55.75, 'longitude': 37.62, 'forecast_days': 4, 'date': '2025-01-01'}
+
+        for bad in [{'latitude': 'abc'}, {'longitude': 200}, {'forecast_days': 20}, {'date': '01.01.2025'}, {'date': ''}]:
+            with self.subTest(bad=bad):
+                response = self.client.get(reverse('weather_search:forecast_day'), {**params, **bad})
+                self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(reverse('weather_search:forecast_day'), {**params, 'date': '1999-01-01'})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(HISTORY_WRITE_BEHIND={'ENABLED': False})
+class SessionHistoryStorageTest(OpenMeteoStubMixin, TestCase):
+    PARAMS = {'city': 'Москва', 'forecast_days': 1}
+
+    def setUp(self):
+        super().setUp()
+        caches['sessions'].clear()
+
+    def test_repeated_search_does_not_save_session(self):
+        self.client.get(reverse('weather_search:search'), self.PARAMS)
+
+        with patch.object(SessionStore, 'save', autospec=True, side_effect=SessionStore.save) as save:
+            self.client.get(reverse('weather_search:search'), self.PARAMS)
+            save.assert_not_called()
+
+            self.client.get(reverse('weather_search:search'), {**self.PARAMS, 'city': 'Владивосток'})
+            save.assert_called_once()
+
+    @override_settings(SEARCH_STREAMING=True)
+    def test_repeated_streamed_search_does_not_save_session(self):
+        b''.join(self.client.get(reverse('weather_search:search'), self.PARAMS).streaming_content)
+
+        with patch.object(SessionStore, 'save', autospec=True, side_effect=SessionStore.save) as save:
+            b''.join(self.client.get(reverse('weather_search:search'), self.PARAMS).streaming_content)
+            save.assert_not_called()
+
+        self.assertEqual(self.client.session['city_history'][0]['city'], 'Москва')
+
+    def test_history_without_db_sessions(self):
+        for engine in ['django.contrib.sessions.backends.cache', 'django.contrib.sessions.backends.signed_cookies']:
+            with self.subTest(engine=engine), override_settings(SESSION_ENGINE=engine):
+                self.client.cookies.clear()
+                self.client.get(reverse('weather_search:search'), self.PARAMS)
+                response = self.client.get(reverse('weather_search:search'))
+
+                self.assertContains(response, '<li data-history-city>', count=1)
+                self.assertFalse(Session.objects.exists())
+
+
+class ForecastPrefetchTest(OpenMeteoStubMixin, TestCase):
+    def wait_for(self, prefetcher):
+        deadline = time.monotonic() + 5
+        while prefetcher.pending() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(prefetcher.pending(), 0)
+
+    @override_settings(FORECAST_PREFETCH={'ENABLED': True, 'TOP_N': 2, 'CONCURRENCY': 2},
+                       GAZETTEER={'ENABLED': False})
+    def test_search_after_autocomplete_is_cache_hit(self):
+        response = self.client.get(reverse('search_field_autocomplete:autocomplete_city'), {
+            'q': 'Москва', 'forecast_days': '2',
+        })
+        city = response.json()[0]
+        self.wait_for(forecast_prefetcher())
+
+        client = forecast_client()
+        with patch.object(client, 'weather_api', wraps=client.weather_api) as weather_api:
+            get_forecast(city['latitude'], city['longitude'], 2)
+            weather_api.assert_not_called()
+
+    async def test_async_search_joins_running_prefetch(self):
+        self.addCleanup(setattr, self.stub, 'config', StubConfig())
+        self.stub.config = StubConfig(latency=0.3)
+        prefetcher = ForecastPrefetcher(concurrency=1)
+        cache_key = forecast_cache_key(55.75, 37.62, 2)
+
+        self.assertEqual(prefetcher.prefetch([(55.75, 37.62)], 2), 1)
+        deadline = time.monotonic() + 5
+        while forecast_flight.pending(cache_key) is None and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+        with patch('weather_search.upstream.openmeteo_requests.AsyncClient.weather_api',
+                   new_callable=AsyncMock) as weather_api:
+            forecast = await aget_forecast(55.75, 37.62, 2)
+            weather_api.assert_not_called()
+
+        self.assertEqual(forecast.timezone, 'Europe/Moscow')
+        await asyncio.to_thread(self.wait_for, prefetcher)
+
+    def test_disabled_by_default(self):
+        self.assertEqual(prefetch_forecasts([{'latitude': 55.75, 'longitude': 37.62}], '2'), 0)
+
+    def test_concurrency_cap(self):
+        prefetcher = ForecastPrefetcher(concurrency=1)
+        release = threading.Event()
+
+        with patch('weather_search.prefetch.get_forecast', side_effect=lambda *args: release.wait(5)) as mock_get_forecast:
+            self.assertEqual(prefetcher.prefetch([(55.75, 37.62), (59.94, 30.31)], 2), 1)
+            # Уже загружаемые координаты и координаты сверх лимита не ставятся в очередь
+            self.assertEqual(prefetcher.prefetch([(55.75, 37.62)], 2), 0)
+            release.set()
+            self.wait_for(prefetcher)
+
+        mock_get_forecast.assert_called_once_with(55.75, 37.62, 2)
+        self.assertEqual(prefetcher.prefetch([(59.94, 30.31)], 2), 1)
+        self.wait_for(prefetcher)
+
+    def test_open_breaker_skips_prefetch(self):
+        breaker = breaker_for('forecast')
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+
+        self.assertEqual(ForecastPrefetcher(concurrency=1).prefetch([(55.75, 37.62)], 2), 0)
@@ -0,0 +1,336 @@
+# Замер времени этапов обработки запроса (геокодирование, прогноз, история, рендер и т.п.).
+# RequestTimingMiddleware заводит на каждый запрос RequestTiming, код отмечает этапы через phase(),
+# количество и время SQL-запросов считаются обёрткой над курсором. В ответ добавляется Server-Timing,
+# а длительности копятся в гистограммах процесса и отдаются по /metrics/ в формате Prometheus.
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse
+
+
+_current = ContextVar('request_timing', default=None)
+
+
+class RequestTiming:
+    """Длительности этапов одного запроса (в секундах) и статистика SQL-запросов"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.db_queries = 0
+        self.db_time = 0.0
+        # Этапы синхронного кода под ASGI выполняются в других потоках
+        self._lock = threading.Lock()
+
+    def add(self, name, duration):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    def add_query(self, duration):
+        with self._lock:
+            self.db_queries += 1
+            self.db_time += duration
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        """Значение заголовка Server-Timing (длительности в миллисекундах)"""
+
+        metrics = [f'{name};dur={duration * 1000:.1f}' for name, duration in self.phases.items()]
+        metrics.append(f'db;desc="{self.db_queries} queries";dur={self.db_time * 1000:.1f}')
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+def current_timing():
+    return _current.get()
+
+
+@contextmanager
+def phase(name):
+    """Отмечает этап запроса, вне RequestTimingMiddleware ничего не делает"""
+
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, time.perf_counter() - start)
+
+
+def count_queries(execute, sql, params, many, context):
+    """Обёртка курсора (connection.execute_wrappers), считает SQL-запросы текущего запроса"""
+
+    timing = _current.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.add_query(time.perf_counter() - start)
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """Обработчик connection_created: подключает count_queries к новому соединению"""
+
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+class Histogram:
+    """Гистограмма с накопительными корзинами, как histogram в Prometheus"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """[(граница, кол-во значений <= границы), ...], последняя граница - +Inf"""
+
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class MetricsRegistry:
+    """Гистограммы длительностей этапов и кол-ва SQL-запросов по view, общие для процесса"""
+
+    def __init__(self, duration_buckets, query_buckets):
+        self.duration_buckets = duration_buckets
+        self.query_buckets = query_buckets
+        self.phases = {}
+        self.queries = {}
+        self._lock = threading.Lock()
+
+    def observe(self, view, timing, total):
+        with self._lock:
+            for name, duration in [*timing.phases.items(), ('db', timing.db_time), ('total', total)]:
+                key = (view, name)
+                if key not in self.phases:
+                    self.phases[key] = Histogram(self.duration_buckets)
+                self.phases[key].observe(duration)
+
+            if view not in self.queries:
+                self.queries[view] = Histogram(self.query_buckets)
+            self.queries[view].observe(timing.db_queries)
+
+    def clear(self):
+        with self._lock:
+            self.phases.clear()
+            self.queries.clear()
+
+    def render(self):
+        """Текстовый формат Prometheus"""
+
+        lines = []
+        with self._lock:
+            lines.append('# HELP meteo_request_phase_seconds Длительность этапов обработки запроса')
+            lines.append('# TYPE meteo_request_phase_seconds histogram')
+            for (view, name), histogram in sorted(self.phases.items()):
+                lines.extend(_histogram_lines(
+                    'meteo_request_phase_seconds', f'view="{view}",phase="{name}"', histogram
+                ))
+
+            lines.append('# HELP meteo_request_db_queries Кол-во SQL-запросов за запрос')
+            lines.append('# TYPE meteo_request_db_queries histogram')
+            for view, histogram in sorted(self.queries.items()):
+                lines.extend(_histogram_lines('meteo_request_db_queries', f'view="{view}"', histogram))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _histogram_lines(metric, labels, histogram):
+    for bound, count in histogram.cumulative():
+        le = '+Inf' if bound == float('inf') else f'{bound:g}'
+        yield f'{metric}_bucket{{{labels},le="{le}"}} {count}'
+    yield f'{metric}_sum{{{labels}}} {histogram.sum:.6f}'
+    yield f'{metric}_count{{{labels}}} {histogram.count}'
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def metrics_registry():
+    global _registry
+
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MetricsRegistry(
+                    duration_buckets=settings.REQUEST_TIMING['DURATION_BUCKETS'],
+                    query_buckets=settings.REQUEST_TIMING['QUERY_BUCKETS'],
+                )
+    return _registry
+
+
+class RequestTimingMiddleware:
+    """
+    Замер времени запросов к view из settings.REQUEST_TIMING['VIEWS'].
+
+    Добавляет заголовок Server-Timing и записывает длительности этапов в гистограммы процесса.
+    Работает как под WSGI, так и под ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if not settings.REQUEST_TIMING['ENABLED']:
+            return self.get_response(request)
+
+        timing = RequestTiming()
+        token = _current.set(timing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        return self._finish(request, response, timing)
+
+    async def __acall__(self, request):
+        if not settings.REQUEST_TIMING['ENABLED']:
+            return await self.get_response(request)
+
+        timing = RequestTiming()
+        token = _current.set(timing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        return self._finish(request, response, timing)
+
+    @staticmethod
+    def _finish(request, response, timing):
+        match = request.resolver_match
+        view = match.view_name if match else None
+        if view not in settings.REQUEST_TIMING['VIEWS']:
+            return response
+
+        total = timing.total()
+        response['Server-Timing'] = timing.server_timing(total)
+
+        if response.streaming:
+            # Заголовок содержит только этапы до отправки первого байта, в гистограммы запрос попадает целиком,
+            # когда тело ответа отдано
+            if response.is_async:
+                response.streaming_content = _atimed_stream(response.streaming_content, timing, view)
+            else:
+                response.streaming_content = _timed_stream(response.streaming_content, timing, view)
+            return response
+
+        metrics_registry().observe(view, timing, total)
+        return response
+
+
+def _timed_stream(content, timing, view):
+    """Части потокового ответа вырабатываются с тем же RequestTiming, что и сам view"""
+
+    iterator = iter(content)
+    while True:
+        token = _current.set(timing)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            break
+        finally:
+            _current.reset(token)
+        yield chunk
+
+    metrics_registry().observe(view, timing, timing.total())
+
+
+async def _atimed_stream(content, timing, view):
+    iterator = aiter(content)
+    while True:
+        token = _current.set(timing)
+        try:
+            chunk = await anext(iterator)
+        except StopAsyncIteration:
+            break
+        finally:
+            _current.reset(token)
+        yield chunk
+
+    metrics_registry().observe(view, timing, timing.total())
+
+
+def render_cache_stats(caches):
+    """Счетчики попаданий и промахов кэшей процесса ({имя: TTLCache}) в формате Prometheus"""
+
+    lines = []
+    stats = {name: cache.stats() for name, cache in caches.items()}
+    for metric, key, kind, help_text in (
+        ('meteo_cache_hits_total', 'hits', 'counter', 'Попадания в кэш'),
+        ('meteo_cache_misses_total', 'misses', 'counter', 'Промахи кэша'),
+        ('meteo_cache_entries', 'size', 'gauge', 'Кол-во записей в кэше'),
+    ):
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {kind}')
+        for name, values in sorted(stats.items()):
+            lines.append(f'{metric}{{cache="{name}"}} {values[key]}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_allowed(request):
+    """Доступ к /metrics/: staff-пользователь или заголовок "Authorization: Bearer <REQUEST_TIMING['METRICS_TOKEN']>" """
+
+    token = settings.REQUEST_TIMING.get('METRICS_TOKEN')
+    if token:
+        scheme, _, value = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(value.strip().encode(), token.encode()):
+            return True
+
+    user = getattr(request, 'user', None)
+    return bool(user is not None and user.is_authenticated and user.is_staff)
+
+
+def metrics(request):
+    """
+    Гистограммы этапов запросов и счетчики кэшей текущего процесса в формате Prometheus.
+    Без доступа (metrics_allowed) - 403: по гистограммам и счетчикам видна нагрузка на сервис.
+    """
+
+    # utils импортирует модели, поэтому импорт не на уровне модуля (timing подключается в AppConfig.ready)
+    from .utils import geocoding_cache
+
+    if not settings.REQUEST_TIMING['ENABLED']:
+        raise Http404
+
+    if not metrics_allowed(request):
+        raise PermissionDenied
+
+    body = metrics_registry().render() + render_cache_stats({'geocoding': geocoding_cache})
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
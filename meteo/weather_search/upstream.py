@@ -0,0 +1,127 @@
+# Общие HTTP-клиенты для запросов к Open-Meteo (геокодирование, автодополнение, прогноз).
+# Сессии создаются один раз на процесс (асинхронные - на event loop) и держат keep-alive пул,
+# ошибки соединения и ответы 5xx повторяются с экспоненциальной задержкой и разбросом.
+# Если сервис продолжает отвечать ошибками, предохранитель (CircuitBreaker) временно прекращает обращения к нему.
+import asyncio
+import threading
+import weakref
+
+import niquests
+import openmeteo_requests
+from django.conf import settings
+
+from .circuit import CircuitBreaker
+
+
+_lock = threading.RLock()
+_session = None
+_forecast_client = None
+_async_sessions = weakref.WeakKeyDictionary()
+_breakers = {}
+
+
+def upstream_url(endpoint):
+    """Адрес endpoint из settings.UPSTREAM_HTTP['URLS']"""
+
+    return settings.UPSTREAM_HTTP['URLS'][endpoint]
+
+
+def breaker_for(service):
+    """Предохранитель сервиса ('geocoding', 'autocomplete' или 'forecast'), общий для процесса"""
+
+    with _lock:
+        breaker = _breakers.get(service)
+        if breaker is None:
+            conf = settings.UPSTREAM_HTTP['CIRCUIT_BREAKER']
+            breaker = CircuitBreaker(
+                service,
+                failure_threshold=conf['FAILURE_THRESHOLD'],
+                recovery_timeout=conf['RECOVERY_TIMEOUT'],
+            )
+            _breakers[service] = breaker
+    return breaker
+
+
+def reset_breakers():
+    with _lock:
+        for breaker in _breakers.values():
+            breaker.reset()
+
+
+def timeout_for(endpoint):
+    """(connect, read) таймауты в секундах для endpoint из settings.UPSTREAM_HTTP['TIMEOUTS']"""
+
+    return tuple(settings.UPSTREAM_HTTP['TIMEOUTS'][endpoint])
+
+
+def _retry_configuration():
+    conf = settings.UPSTREAM_HTTP
+    return niquests.RetryConfiguration(
+        total=conf['RETRIES'],
+        backoff_factor=conf['BACKOFF_FACTOR'],
+        backoff_jitter=conf['BACKOFF_JITTER'],
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset({'GET'}),
+        raise_on_status=False,
+    )
+
+
+def _session_kwargs():
+    return {
+        'retries': _retry_configuration(),
+        'pool_connections': settings.UPSTREAM_HTTP['POOL_CONNECTIONS'],
+        'pool_maxsize': settings.UPSTREAM_HTTP['POOL_MAXSIZE'],
+    }
+
+
+def http_session():
+    """Сессия с пулом соединений, общая для всех потоков процесса"""
+
+    global _session
+
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = niquests.Session(**_session_kwargs())
+    return _session
+
+
+def forecast_client():
+    """
+    Клиент Open-Meteo поверх общей сессии.
+    Создается один раз: Client закрывает свою сессию при удалении объекта.
+    """
+    global _forecast_client
+
+    if _forecast_client is None:
+        with _lock:
+            if _forecast_client is None:
+                _forecast_client = openmeteo_requests.Client(session=http_session())
+    return _forecast_client
+
+
+def async_http_session():
+    """Асинхронная сессия с пулом соединений, общая для текущего event loop"""
+
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None:
+        session = niquests.AsyncSession(**_session_kwargs())
+        _async_sessions[loop] = session
+    return session
+
+
+def async_forecast_client():
+    return openmeteo_requests.AsyncClient(session=async_http_session())
+
+
+def upstream_get(endpoint, params):
+    """GET-запрос к endpoint через общую сессию с его таймаутами"""
+
+    return http_session().get(upstream_url(endpoint), params=params, timeout=timeout_for(endpoint))
+
+
+async def async_upstream_get(endpoint, params):
+    """Асинхронный GET-запрос к endpoint через общую сессию с его таймаутами"""
+
+    return await async_http_session().get(upstream_url(endpoint), params=params, timeout=timeout_for(endpoint))
@@ -1,10 +1,14 @@
+from django.conf import settings
 from django.urls import path
-from .views import search_city
+from .views import (search_city, search_city_async, compare_cities, compare_cities_async,
+                    forecast_day, forecast_day_async)
 
 
 app_name = 'weather_search'
 
 
 urlpatterns = [
-    path('', search_city, name='search'),
+    path('', search_city_async if settings.ASYNC_VIEWS else search_city, name='search'),
+    path('day/', forecast_day_async if settings.ASYNC_VIEWS else forecast_day, name='forecast_day'),
+    path('compare/', compare_cities_async if settings.ASYNC_VIEWS else compare_cities, name='compare'),
 ]
@@ -3,17 +3,34 @@ from datetime import datetime
 from unittest.mock import MagicMock
 from zoneinfo import ZoneInfo
 
-import requests
+import niquests
+import numpy as np
+from django.conf import settings
 
 from search_field_autocomplete.utils import is_cyrillic
 from search_history.models import HistoryModel
 from . import weather_variables
+from .cache import TTLCache
+from .singleflight import SingleFlight, AsyncSingleFlight
+from .circuit import CircuitOpenError
+from .upstream import upstream_get, async_upstream_get, breaker_for
 
 
 class GeoApiException(Exception):
     pass
 
 
+class GeoApiUnavailable(GeoApiException):
+    """Геосервис не ответил или ответил ошибкой (в отличие от CityNotFound)"""
+
+
+class CityNotFound(GeoApiException):
+    """Геосервис ответил, но такого города нет (этот ответ кэшируется)"""
+
+    def __init__(self, message='Город не найден'):
+        super().__init__(message)
+
+
 def mock_geocoding_api_request():
     json_response = {'results': [
         {
@@ -67,6 +84,7 @@ def mock_hourly_variables_test(view_index):
         mock_val.ValuesLength.return_value = 48
 
     mock_val.Values.side_effect = lambda i: weather_data[i]
+    mock_val.ValuesAsNumpy.return_value = np.array(weather_data, dtype=np.float32)
 
     mock_val.Values.call_count = 48
 
@@ -86,6 +104,23 @@ def mock_timestamp():
     return datetime.now(tz=ZoneInfo('Europe/Moscow')).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
 
 
+def mock_weather_api_response(timezone='Europe/Moscow'):
+    fake_response = MagicMock()
+    fake_response.Timezone.return_value = timezone
+
+    fake_current = MagicMock()
+    fake_current.Variables.side_effect = mock_current_data
+    fake_response.Current.return_value = fake_current
+
+    fake_hourly = MagicMock()
+    fake_hourly.Variables.side_effect = mock_hourly_variables_test
+    fake_hourly.Time.return_value = mock_timestamp()
+    fake_hourly.Interval.return_value = 3600
+    fake_response.Hourly.return_value = fake_hourly
+
+    return fake_response
+
+
 def expected_hour_rows(forecast_days: int = 2):
     # Часов осталось в текущем дне
     now = datetime.now(tz=ZoneInfo('Europe/Moscow'))
@@ -104,46 +139,115 @@ class CityHistoryContextService:
         функция для добавления истории поиска городов в context для авторизованного
         или неавторизованного пользователя
         """
+        city_history = CityHistoryContextService.get_city_history(user, session)
+        if city_history:
+            context['city_history'] = city_history
+
+    @staticmethod
+    async def aattach_city_history_to_context(user, context, session):
+        """Асинхронная версия attach_city_history_to_context"""
+
+        city_history = await CityHistoryContextService.aget_city_history(user, session)
+        if city_history:
+            context['city_history'] = city_history
+
+    @staticmethod
+    def get_city_history(user, session):
+        """Последние 5 городов из истории поиска пользователя (БД) или сессии (для неавторизованного)"""
+
         if user.is_authenticated:
-            history = (
+            return list(
                 HistoryModel.objects
                 .filter(user=user)
-                .values('city', 'country', 'country_code', 'admin', 'forecast_days')
-                .order_by('-timestamp')[:5]
+                .values(*weather_variables.HISTORY_FIELDS)
+                .order_by('-last_searched')[:5]
             )
 
-            context['city_history'] = history
+        return list(session.get('city_history') or [])
+
+    @staticmethod
+    async def aget_city_history(user, session):
+        """Асинхронная версия get_city_history"""
+
+        if user.is_authenticated:
+            history = (
+                HistoryModel.objects
+                .filter(user=user)
+                .values(*weather_variables.HISTORY_FIELDS)
+                .order_by('-last_searched')[:5]
+            )
+            return [item async for item in history]
 
-        # Для неавторизованного пользователя
-        else:
-            city_history = session.get('city_history')
-            if city_history:
-                city_history_copy = city_history.copy()
-                context['city_history'] = city_history_copy
+        return list(await session.aget('city_history') or [])
 
     @staticmethod
     def add_city_to_session_history(session, city_values_dict):
         """
         Функция добавления города в сессию неавторизованного пользователя
-        Если город уже есть в сессии, то добавление не происходит
+        Если город уже есть в сессии, то добавление не происходит,
+        а сессия не помечается измененной и повторно не сохраняется
         """
         city_history = session.get('city_history', [])
+        merged = _merge_session_history(city_history, city_values_dict)
+        if merged != city_history:
+            session['city_history'] = merged
 
-        new_entry = {field: city_values_dict[field] for field in weather_variables.SEARCH_FIELDS if city_values_dict.get(field)}
+    @staticmethod
+    async def aadd_city_to_session_history(session, city_values_dict):
+        """Асинхронная версия add_city_to_session_history"""
 
-        if new_entry not in city_history:
-            city_history.append(new_entry)
+        city_history = await session.aget('city_history', [])
+        merged = _merge_session_history(city_history, city_values_dict)
+        if merged != city_history:
+            await session.aset('city_history', merged)
 
-        session['city_history'] = city_history[-5:]
 
-    @staticmethod
-    def save_anonymous_city_history(city_values_dict):
-        """
-        Функция добавления города в историю поиска для неавторизованного пользователя
-        Нужна для учета кол-ва запросов городов в total-city-searched/
-        """
+def _merge_session_history(city_history, city_values_dict):
+    """
+    Добавляет город в историю сессии (последние 5 городов).
+
+    Город из истории определяется полями SEARCH_FIELDS, координаты к ним только добавляются:
+    записи, сохраненные без координат, дополняются ими при повторном поиске.
+    Возвращает новый список, city_history не изменяется.
+    """
+    city_history = [dict(entry) for entry in city_history]
+    new_entry = {field: city_values_dict[field] for field in weather_variables.HISTORY_FIELDS if city_values_dict.get(field)}
+    search_key = {field: new_entry[field] for field in weather_variables.SEARCH_FIELDS if field in new_entry}
+
+    for entry in city_history:
+        if {field: entry[field] for field in weather_variables.SEARCH_FIELDS if field in entry} == search_key:
+            entry.update(new_entry)
+            break
+    else:
+        city_history.append(new_entry)
+
+    return city_history[-5:]
+
+
+# Кэш результатов геокодирования, общий для всего процесса
+geocoding_cache = TTLCache(
+    maxsize=settings.GEOCODING_CACHE['MAX_SIZE'],
+    ttl=settings.GEOCODING_CACHE['TTL'],
+    stale_ttl=settings.GEOCODING_CACHE['STALE_TTL'],
+)
 
-        HistoryModel.objects.create(user=None, **city_values_dict)
+# Объединение одновременных одинаковых запросов к геосервису
+geocoding_flight = SingleFlight()
+async_geocoding_flight = AsyncSingleFlight()
+
+# Отметка о том, что город не найден (кэшируется на меньшее время)
+_CITY_NOT_FOUND = object()
+
+
+def geocoding_cache_key(city, country_code=None, admin=None, language=None):
+    """Нормализованный ключ кэша геокодирования"""
+
+    return (
+        ' '.join(city.split()).casefold(),
+        (country_code or '').upper(),
+        (admin or '').strip(),
+        language or '',
+    )
 
 
 def geo_coding_request(city, country_code=None, admin=None):
@@ -151,45 +255,168 @@ def geo_coding_request(city, country_code=None, admin=None):
     Возвращает данные города с заданными параметрами (params).
     Или ошибку, если чnо-то пошло не так.
 
+    Результаты (и промахи "Город не найден") кэшируются в geocoding_cache.
     """
 
-    geo_url = "https://geocoding-api.open-meteo.com/v1/search"
+    language = 'ru' if is_cyrillic(city) else None
+    cache_key = geocoding_cache_key(city, country_code, admin, language)
+
+    cached = _geocoding_cache_lookup(cache_key)
+    if cached is not None:
+        return cached
+
+    # Одновременные одинаковые запросы ждут результат одного обращения к геосервису
+    return geocoding_flight.do(cache_key, _geo_coding_fetch_and_cache, cache_key, city, country_code, admin, language)
+
+
+def _geo_coding_fetch_and_cache(cache_key, city, country_code, admin, language):
+    try:
+        geo_data = _geo_coding_fetch(city, country_code, admin, language)
+    except GeoApiUnavailable as e:
+        return _geocoding_stale_or_raise(cache_key, e)
+    except GeoApiException as e:
+        _geocoding_cache_store_miss(cache_key, e)
+        raise
+
+    geocoding_cache.set(cache_key, geo_data)
+    return geo_data
+
+
+async def async_geo_coding_request(city, country_code=None, admin=None):
+    """Асинхронная версия geo_coding_request, использует тот же кэш"""
 
+    language = 'ru' if is_cyrillic(city) else None
+    cache_key = geocoding_cache_key(city, country_code, admin, language)
+
+    cached = _geocoding_cache_lookup(cache_key)
+    if cached is not None:
+        return cached
+
+    return await async_geocoding_flight.do(
+        cache_key, _async_geo_coding_fetch_and_cache, cache_key, city, country_code, admin, language
+    )
+
+
+async def _async_geo_coding_fetch_and_cache(cache_key, city, country_code, admin, language):
+    try:
+        geo_data = await _async_geo_coding_fetch(city, country_code, admin, language)
+    except GeoApiUnavailable as e:
+        return _geocoding_stale_or_raise(cache_key, e)
+    except GeoApiException as e:
+        _geocoding_cache_store_miss(cache_key, e)
+        raise
+
+    geocoding_cache.set(cache_key, geo_data)
+    return geo_data
+
+
+def _geocoding_cache_lookup(cache_key):
+    """Данные города из кэша, None при промахе кэша или исключение, если город ранее не был найден"""
+
+    cached = geocoding_cache.get(cache_key)
+    if cached is _CITY_NOT_FOUND:
+        raise CityNotFound()
+    return cached
+
+
+def _geocoding_stale_or_raise(cache_key, error):
+    """
+    Геосервис недоступен: координаты города не меняются, поэтому подходит и устаревшая запись кэша.
+    Если её нет - пробрасывается error.
+    """
+    stale = geocoding_cache.get_stale(cache_key)
+    if stale is None or stale is _CITY_NOT_FOUND:
+        raise error
+    return stale
+
+
+def _geocoding_cache_store_miss(cache_key, error):
+    """Кэширует только CityNotFound, ошибки сети и сервиса не кэшируются"""
+
+    if isinstance(error, CityNotFound):
+        geocoding_cache.set(cache_key, _CITY_NOT_FOUND, ttl=settings.GEOCODING_CACHE['NEGATIVE_TTL'])
+
+
+def _geocoding_params(city, country_code, language):
     params = {
         'name': city,
         'countryCode': country_code,
         'count': 5,
     }
 
-    if is_cyrillic(city):
-        params['language'] = 'ru'
+    if language:
+        params['language'] = language
 
-    response = requests.get(geo_url, params=params)
+    return params
 
-    try:
-        response.raise_for_status()
-    except requests.RequestException as e:
-        raise GeoApiException('Ошибка при запросе геоданных') from e
 
-    try:
-        data = response.json()
-    except json.JSONDecodeError as e:
-        raise GeoApiException('Некорректный ответ от геосервиса') from e
+def _select_geo_result(data, admin):
+    """Выбирает город из ответа геосервиса"""
 
     results = data.get('results') or []
     if not results:
-        raise GeoApiException('Город не найден')
+        raise CityNotFound()
 
     # Если передано название области, то происходит выбор конкретного объекта с этой областью
     if admin:
-        match_obj = next(geo_obj for geo_obj in data['results'] if admin == geo_obj.get('admin1'))
+        match_obj = next((geo_obj for geo_obj in results if admin == geo_obj.get('admin1')), None)
         if match_obj:
             return match_obj
 
-    results_data = data['results'][0]
+    results_data = results[0]
     return results_data
 
 
+def _geocoding_get(params):
+    response = upstream_get('geocoding', params=params)
+    response.raise_for_status()
+    return response
+
+
+async def _async_geocoding_get(params):
+    response = await async_upstream_get('geocoding', params=params)
+    response.raise_for_status()
+    return response
+
+
+def _geo_coding_fetch(city, country_code, admin, language):
+    """Запрос к Open-Meteo Geocoding API без кэширования"""
+
+    try:
+        response = breaker_for('geocoding').call(_geocoding_get, _geocoding_params(city, country_code, language))
+    except CircuitOpenError as e:
+        raise GeoApiUnavailable('Геосервис временно недоступен, попробуйте позже') from e
+    except niquests.RequestException as e:
+        raise GeoApiUnavailable('Ошибка при запросе геоданных') from e
+
+    try:
+        data = response.json()
+    except json.JSONDecodeError as e:
+        raise GeoApiException('Некорректный ответ от геосервиса') from e
+
+    return _select_geo_result(data, admin)
+
+
+async def _async_geo_coding_fetch(city, country_code, admin, language):
+    """Неблокирующий запрос к Open-Meteo Geocoding API без кэширования"""
+
+    try:
+        response = await breaker_for('geocoding').acall(
+            _async_geocoding_get, _geocoding_params(city, country_code, language)
+        )
+    except CircuitOpenError as e:
+        raise GeoApiUnavailable('Геосервис временно недоступен, попробуйте позже') from e
+    except niquests.RequestException as e:
+        raise GeoApiUnavailable('Ошибка при запросе геоданных') from e
+
+    try:
+        data = response.json()
+    except json.JSONDecodeError as e:
+        raise GeoApiException('Некорректный ответ от геосервиса') from e
+
+    return _select_geo_result(data, admin)
+
+
 def validate_forecast_days(raw_value):
     """
     Возвращает (forecast_days, error_message).
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def safe_round(value, digits=2):
     "Округляет значение, если оно числовое (float или int)."
 
@@ -5,3 +8,9 @@ def safe_round(value, digits=2):
         return round(value, digits)
     except (TypeError, ValueError):
         return value
+
+
+def round_array(values, digits=2):
+    "Округляет все значения numpy-массива."
+
+    return np.round(values, digits)
@@ -1,11 +1,20 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.middleware.csrf import get_token
+from django.http import StreamingHttpResponse, HttpResponse, HttpResponseBadRequest, Http404
 from django.shortcuts import render
-import openmeteo_requests
-from datetime import datetime
+from datetime import date, datetime
+from urllib.parse import urlencode
 from zoneinfo import ZoneInfo
-from .utils import CityHistoryContextService, geo_coding_request, validate_forecast_days, GeoApiException, extract_params
-from .weather_variables import VARIABLES_CURRENT, VARIABLES_HOURLY, SEARCH_FIELDS
-from collections import defaultdict
-from search_history.utils import add_history_city_to_user
+from .utils import (CityHistoryContextService, geo_coding_request, async_geo_coding_request,
+                    validate_forecast_days, GeoApiException, extract_params)
+from .weather_variables import HISTORY_FIELDS, LOCATION_FIELDS
+from .forecast import (get_forecast, aget_forecast, build_current_weather, build_hourly_by_day, forecast_local_days,
+                       ForecastApiException)
+from .timing import phase
+from .streaming import StreamedPage, streaming_enabled
+from .compare import compare_forecasts, acompare_forecasts
+from search_history.utils import record_city_search, arecord_city_search
 import json
 
 
@@ -15,200 +24,513 @@ def search_city(request):
     extracted_get_parameters = extract_params(request)
 
     # Добавление последних городов в context
-    CityHistoryContextService.attach_city_history_to_context(
-        user=request.user,
-        context=context,
-        session=request.session
-    )
+    with phase('history'):
+        CityHistoryContextService.attach_city_history_to_context(
+            user=request.user,
+            context=context,
+            session=request.session
+        )
 
     if all(extracted_get_parameters[key] is None for key in extracted_get_parameters):
-        return render(request, 'weather_search/search.html', context)
+        return _render(request, 'weather_search/search.html', context)
+
+    steps = _search_steps(request, context, extracted_get_parameters)
+
+    if streaming_enabled(request, request.user):
+        return _stream(request, context, steps)
+
+    for _ in steps:
+        pass
+    return _render(request, 'weather_search/search.html', context)
 
+
+def _search_steps(request, context, extracted_get_parameters):
+    """
+    Поиск города с заполнением context.
+    Генератор останавливается в точках, где часть страницы уже можно отправить (для потокового режима).
+    """
     raw_city = (extracted_get_parameters.get('city')) or ''.strip()
     if not raw_city:
         context['error'] = 'Нужно ввести название города!'
-        return render(request, 'weather_search/search.html', context)
+        return
 
-    selected_in_autocomplete = extracted_get_parameters.get('selection', '').strip()
-    sel = None
-    if selected_in_autocomplete:
-        try:
-            sel = json.loads(selected_in_autocomplete)
-        except json.JSONDecodeError:
-            pass
-    # Ветка с готовой структурой
-    if sel:
-        city = sel.get("city")
-        country_code = sel.get("country_code")
-        country = sel.get("country")
-        lat = sel.get("lat")
-        lon = sel.get("lon")
-        admin = sel.get('admin')
+    # Шапка, форма и история поиска
+    yield
 
-        # попытка поиска по city + country_code
-        if lat is None or lon is None:
-            try:
-                geo_data = geo_coding_request(city=city, country_code=country_code)
-                lat, lon = geo_data.get('latitude'), geo_data.get('longitude')
-            except GeoApiException as e:
-                context['error'] = str(e)
-                return render(request, 'weather_search/search.html', context)
-    # Ветка с сырыми данными
-    else:
+    location, geo_kwargs = _plan_location(extracted_get_parameters, raw_city)
+    if geo_kwargs:
         try:
-            # Поиск по города по истории поиска городов
-            if extracted_get_parameters.get('history'):
-                geo_data = geo_coding_request(city=raw_city, admin=extracted_get_parameters.get('admin'))
+            with phase('geocoding'):
+                geo_data = geo_coding_request(**geo_kwargs)
+        except GeoApiException as e:
+            context['error'] = str(e)
+            return
+
+        location = _apply_geo_data(location, geo_data)
+
+    _fill_location_context(context, location)
+
+    # Валидация значения forecast_days
+    forecast_days, error = validate_forecast_days(request.GET.get('forecast_days'))
+    if error:
+        context['error'] = error
+        return
+
+    context['forecast_days'] = forecast_days
+
+    # Найденный город
+    yield
+
+    # Добавление найденного города в историю авторизованного или неавторизованного пользователя
+    city_values_dict = _city_values_dict(context)
+
+    with phase('history'):
+        # Для неавторизованного пользователя - добавление нового города к session
+        if not request.user.is_authenticated:
+            CityHistoryContextService.add_city_to_session_history(
+                session=request.session,
+                city_values_dict=city_values_dict
+            )
+
+        # Добавление истории в БД (через буфер записи, если он включен)
+        record_city_search(user=request.user, city_values_dict=city_values_dict)
+
+    # Прогноз из кэша или запрос к Open Meteo
+    try:
+        with phase('forecast'):
+            forecast = get_forecast(context['latitude'], context['longitude'], forecast_days)
+    except ForecastApiException as e:
+        context['error'] = str(e)
+        return
+    with phase('forecast_build'):
+        _fill_forecast_context(context, forecast)
+
+
+def _stream(request, context, steps):
+    """Потоковый ответ: шапка страницы уходит до геокодирования и запроса прогноза"""
+
+    page = StreamedPage(request, 'weather_search/search.html')
+    save_session = _prepare_session_for_streaming(request)
+    # Шаблон рендерится уже после CsrfViewMiddleware: без этого {% csrf_token %} не выставит cookie
+    get_token(request)
+
+    def content():
+        for _ in steps:
+            yield page.flush(context)
+        yield page.finish(context)
+
+        # Заголовки с cookie сессии уже отправлены, изменения истории сохраняются в ту же сессию
+        if save_session and request.session.modified:
+            request.session.save()
+
+    return StreamingHttpResponse(content())
+
+
+def _prepare_session_for_streaming(request):
+    """
+    SessionMiddleware сохраняет сессию и выставляет cookie до отправки тела ответа.
+    Чтобы cookie была и у новой сессии, в ней заранее сохраняется пустая история,
+    существующая сессия до изменения истории не сохраняется.
+    Возвращает True, если сессию нужно сохранить еще раз после отправки страницы.
+    """
+    if request.user.is_authenticated:
+        return False
+
+    city_history = request.session.get('city_history')
+    if request.session.session_key is None:
+        request.session['city_history'] = city_history or []
+    return True
+
+
+async def search_city_async(request):
+    """
+    Асинхронная версия search_city для запуска под ASGI.
+    Запросы к геосервису, Open-Meteo и записи истории не блокируют поток воркера.
+    """
+    context = {}
+    user = await request.auser()
+
+    extracted_get_parameters = extract_params(request)
+
+    # Добавление последних городов в context
+    with phase('history'):
+        await CityHistoryContextService.aattach_city_history_to_context(
+            user=user,
+            context=context,
+            session=request.session
+        )
+
+    if all(extracted_get_parameters[key] is None for key in extracted_get_parameters):
+        return await _arender(request, 'weather_search/search.html', context)
+
+    steps = _asearch_steps(request, user, context, extracted_get_parameters)
+
+    if streaming_enabled(request, user):
+        return await _astream(request, user, context, steps)
+
+    async for _ in steps:
+        pass
+    return await _arender(request, 'weather_search/search.html', context)
+
+
+async def _asearch_steps(request, user, context, extracted_get_parameters):
+    """Асинхронная версия _search_steps"""
+
+    raw_city = (extracted_get_parameters.get('city')) or ''.strip()
+    if not raw_city:
+        context['error'] = 'Нужно ввести название города!'
+        return
 
-            # Попытка поиска по сырой строке города
-            else:
-                geo_data = geo_coding_request(city=raw_city)
+    yield
 
+    location, geo_kwargs = _plan_location(extracted_get_parameters, raw_city)
+    if geo_kwargs:
+        try:
+            with phase('geocoding'):
+                geo_data = await async_geo_coding_request(**geo_kwargs)
         except GeoApiException as e:
             context['error'] = str(e)
-            return render(request, 'weather_search/search.html', context)
-
-        lat, lon = geo_data.get('latitude'), geo_data.get('longitude')
-        country, country_code, city, admin = (
-            geo_data.get('country'),
-            geo_data.get('country_code'),
-            geo_data.get('name'),
-            geo_data.get('admin1')
-        )
+            return
+
+        location = _apply_geo_data(location, geo_data)
 
-    context['city_name'] = city
-    context['latitude'] = lat
-    context['longitude'] = lon
-    context['country'] = country
-    context['admin'] = admin
-    context['country_code'] = country_code
+    _fill_location_context(context, location)
 
     # Валидация значения forecast_days
     forecast_days, error = validate_forecast_days(request.GET.get('forecast_days'))
     if error:
         context['error'] = error
-        return render(request, "weather_search/search.html", context)
+        return
 
     context['forecast_days'] = forecast_days
 
-    # запрос к Open Meteo
-    client = openmeteo_requests.Client()
-    url = "https://api.open-meteo.com/v1/forecast"
-    params = {
-        "latitude": lat,
-        "longitude": lon,
-        "current": [
-            "temperature_2m",
-            "apparent_temperature",
-            "relative_humidity_2m",
-            "rain",
-            "is_day"
-        ],
-        "hourly": [
-            "temperature_2m",
-            "apparent_temperature",
-            "relative_humidity_2m",
-            "rain",
-            "is_day",
-            "wind_speed_10m"
-        ],
-        "timezone": "auto",
-        "forecast_days": forecast_days,
-    }
+    yield
 
-    # словарь с данными о найденном городе
-    city_values_dict = {
-        k: v
-        for k, v in context.items()
-        if k in SEARCH_FIELDS
-    }
+    # Добавление найденного города в историю авторизованного или неавторизованного пользователя
+    city_values_dict = _city_values_dict(context)
 
-    city_values_dict.update({'city': context['city_name']})
+    with phase('history'):
+        if not user.is_authenticated:
+            await CityHistoryContextService.aadd_city_to_session_history(
+                session=request.session,
+                city_values_dict=city_values_dict
+            )
 
-    # Добавление найденного города в историю авторизованного или неавторизованного пользователя
+        await arecord_city_search(user=user, city_values_dict=city_values_dict)
 
-    # Для неавторизованного пользователя
-    if not request.user.is_authenticated:
-        # Добавление нового города к session
-        CityHistoryContextService.add_city_to_session_history(
-            session=request.session,
-            city_values_dict=city_values_dict
-        )
+    # Прогноз из кэша или запрос к Open Meteo
+    try:
+        with phase('forecast'):
+            forecast = await aget_forecast(context['latitude'], context['longitude'], forecast_days)
+    except ForecastApiException as e:
+        context['error'] = str(e)
+        return
+    with phase('forecast_build'):
+        _fill_forecast_context(context, forecast)
+
+
+async def _astream(request, user, context, steps):
+    """Асинхронная версия _stream"""
+
+    page = StreamedPage(request, 'weather_search/search.html')
+    save_session = not user.is_authenticated
+    if save_session:
+        city_history = await request.session.aget('city_history')
+        if request.session.session_key is None:
+            await request.session.aset('city_history', city_history or [])
+    get_token(request)
+
+    async def content():
+        # Рендер вне event loop (контекстный процессор auth обращается к БД)
+        async for _ in steps:
+            yield await sync_to_async(page.flush)(context)
+        yield await sync_to_async(page.finish)(context)
+
+        if save_session and request.session.modified:
+            await request.session.asave()
+
+    return StreamingHttpResponse(content())
+
+
+def compare_cities(request):
+    """
+    Прогноз для последних городов из истории поиска на одной странице.
+    Прогнозы всех городов запрашиваются у Open-Meteo одним запросом.
+    """
+    context = {}
 
-        # Добавление истории в БД
-        CityHistoryContextService.save_anonymous_city_history(city_values_dict=city_values_dict)
-    else:
-        # Добавление нового города к текущему user
-        created = add_history_city_to_user(
-            user=request.user,
-            city_values_dict=city_values_dict
-        )
+    forecast_days, error = validate_forecast_days(request.GET.get('forecast_days'))
+    if error:
+        context['error'] = error
+        return _render(request, 'weather_search/compare.html', context)
+    context['forecast_days'] = forecast_days
 
-        # Если объект HistoryModel не создан, то нужно всё равно его учесть в БД, для отобржения в total-city-searched/
-        if not created:
-            CityHistoryContextService.save_anonymous_city_history(city_values_dict=city_values_dict)
+    with phase('history'):
+        cities = CityHistoryContextService.get_city_history(request.user, request.session)
 
-    responses = client.weather_api(url, params=params)
-    response = responses[0]
+    if cities:
+        with phase('forecast'):
+            context['compare_rows'] = compare_forecasts(cities, forecast_days)
 
-    tz_raw = response.Timezone()
-    if isinstance(tz_raw, bytes):
-        tz_name = tz_raw.decode('utf-8', errors='replace')
-    else:
-        tz_name = str(tz_raw)
+    return _render(request, 'weather_search/compare.html', context)
+
+
+async def compare_cities_async(request):
+    """Асинхронная версия compare_cities"""
+
+    context = {}
+    user = await request.auser()
+
+    forecast_days, error = validate_forecast_days(request.GET.get('forecast_days'))
+    if error:
+        context['error'] = error
+        return await _arender(request, 'weather_search/compare.html', context)
+    context['forecast_days'] = forecast_days
+
+    with phase('history'):
+        cities = await CityHistoryContextService.aget_city_history(user, request.session)
+
+    if cities:
+        with phase('forecast'):
+            context['compare_rows'] = await acompare_forecasts(cities, forecast_days)
+
+    return await _arender(request, 'weather_search/compare.html', context)
+
+
+def forecast_day(request):
+    """
+    Фрагмент страницы поиска с почасовым прогнозом на один день (date) для координат,
+    прогноз берется из того же кэша, что и для страницы поиска
+    """
+    params, error = _forecast_day_params(request)
+    if error:
+        return HttpResponseBadRequest(error)
 
-    # Создание объекта зоны
     try:
-        tz = ZoneInfo(tz_name)
-    except Exception as e:
-        raise RuntimeError(f"Не удалось создать ZoneInfo для '{tz_name}': {e}")
+        with phase('forecast'):
+            forecast = get_forecast(params['latitude'], params['longitude'], params['forecast_days'])
+    except ForecastApiException as e:
+        return HttpResponse(str(e), status=503)
 
-    # Формирование current_weather в context
-    current = response.Current()
+    return _render_forecast_day(request, forecast, params['date'])
+
+
+async def forecast_day_async(request):
+    """Асинхронная версия forecast_day"""
+
+    params, error = _forecast_day_params(request)
+    if error:
+        return HttpResponseBadRequest(error)
+
+    try:
+        with phase('forecast'):
+            forecast = await aget_forecast(params['latitude'], params['longitude'], params['forecast_days'])
+    except ForecastApiException as e:
+        return HttpResponse(str(e), status=503)
+
+    return await sync_to_async(_render_forecast_day)(request, forecast, params['date'])
+
+
+def _forecast_day_params(request):
+    """Возвращает (параметры, error_message) запроса forecast_day"""
+
+    try:
+        latitude = float(request.GET.get('latitude'))
+        longitude = float(request.GET.get('longitude'))
+        day = date.fromisoformat(request.GET.get('date') or '')
+    except (TypeError, ValueError):
+        return None, 'Некорректные координаты или дата'
+
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None, 'Некорректные координаты или дата'
+
+    forecast_days, error = validate_forecast_days(request.GET.get('forecast_days'))
+    if error:
+        return None, error
+
+    return {'latitude': latitude, 'longitude': longitude, 'forecast_days': forecast_days, 'date': day}, None
+
+
+def _render_forecast_day(request, forecast, day):
+    tz = ZoneInfo(forecast.timezone)
+
+    with phase('forecast_build'):
+        days = forecast_local_days(forecast, tz)
+        if day not in days:
+            raise Http404('Нет прогноза на эту дату')
+        hourly_by_day = build_hourly_by_day(forecast, tz, first_day=days.index(day), max_days=1)
+
+    if day not in hourly_by_day:
+        raise Http404('Нет прогноза на эту дату')
+
+    return _render(request, 'weather_search/_hourly_day.html', {'date': day, 'hours': hourly_by_day[day]})
+
+
+def _render(request, template_name, context):
+    with phase('render'):
+        return render(request, template_name, context)
+
+
+async def _arender(request, template_name, context):
+    """Рендер шаблона вне event loop (контекстный процессор auth обращается к БД)"""
+
+    with phase('render'):
+        return await sync_to_async(render)(request, template_name, context)
+
+
+def _plan_location(extracted_get_parameters, raw_city):
+    """
+    Возвращает (location, geo_kwargs).
 
-    current_weather_data = {}
-    for name, (idx, func) in VARIABLES_CURRENT.items():
-        processor = func if func else (lambda x: x)
-        current_weather_data[name] = processor(current.Variables(idx).Value())
+    location - данные города, известные без геокодирования (или None),
+    geo_kwargs - параметры geo_coding_request, если координаты нужно получить у геосервиса (или None).
+    """
+    selected_in_autocomplete = extracted_get_parameters.get('selection', '').strip()
+    sel = None
+    if selected_in_autocomplete:
+        try:
+            sel = json.loads(selected_in_autocomplete)
+        except json.JSONDecodeError:
+            pass
+
+    # Ветка с готовой структурой
+    if sel:
+        location = {
+            'city': sel.get('city'),
+            'country': sel.get('country'),
+            'country_code': sel.get('country_code'),
+            'admin': sel.get('admin'),
+            'latitude': sel.get('lat'),
+            'longitude': sel.get('lon'),
+            'timezone': sel.get('timezone'),
+        }
+
+        # попытка поиска по city + country_code
+        if location['latitude'] is None or location['longitude'] is None:
+            return location, {'city': location['city'], 'country_code': location['country_code']}
+
+        return location, None
+
+    # Ветка с сырыми данными
+    # Поиск по города по истории поиска городов
+    if extracted_get_parameters.get('history'):
+        # Координаты сохранены в истории - геокодирование не нужно
+        location = _history_location(extracted_get_parameters, raw_city)
+        if location is not None:
+            return location, None
+
+        return None, {'city': raw_city, 'admin': extracted_get_parameters.get('admin')}
+
+    # Попытка поиска по сырой строке города
+    return None, {'city': raw_city}
+
+
+def _history_location(extracted_get_parameters, raw_city):
+    """Данные города из ссылки истории поиска или None, если координат в ней нет или они некорректны"""
+
+    try:
+        latitude = float(extracted_get_parameters.get('latitude'))
+        longitude = float(extracted_get_parameters.get('longitude'))
+    except (TypeError, ValueError):
+        return None
+
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+
+    return {
+        'city': raw_city,
+        'country': extracted_get_parameters.get('country'),
+        'country_code': extracted_get_parameters.get('country_code'),
+        'admin': extracted_get_parameters.get('admin'),
+        'latitude': latitude,
+        'longitude': longitude,
+        'timezone': extracted_get_parameters.get('timezone'),
+    }
+
+
+def _apply_geo_data(location, geo_data):
+    """Дополняет данные города ответом геосервиса"""
+
+    # Для выбранного в автодополнении города нужны только координаты
+    if location is not None:
+        location['latitude'] = geo_data.get('latitude')
+        location['longitude'] = geo_data.get('longitude')
+        location['timezone'] = location.get('timezone') or geo_data.get('timezone')
+        return location
+
+    return {
+        'city': geo_data.get('name'),
+        'country': geo_data.get('country'),
+        'country_code': geo_data.get('country_code'),
+        'admin': geo_data.get('admin1'),
+        'latitude': geo_data.get('latitude'),
+        'longitude': geo_data.get('longitude'),
+        'timezone': geo_data.get('timezone'),
+    }
 
-    context["current_weather"] = current_weather_data
 
-    # Формирование hourly_by_day в context
-    hourly = response.Hourly()
-    length = hourly.Variables(1).ValuesLength()
+def _fill_location_context(context, location):
+    context['city_name'] = location['city']
+    context['latitude'] = location['latitude']
+    context['longitude'] = location['longitude']
+    context['country'] = location['country']
+    context['admin'] = location['admin']
+    context['country_code'] = location['country_code']
+    context['timezone'] = _valid_timezone(location.get('timezone'))
 
-    start_time = hourly.Time()
-    interval = hourly.Interval()
 
-    # hourly_date содержит в себе всю почасовую информацию о погоде
-    hourly_data = {}
-    for name, (idx, func) in VARIABLES_HOURLY.items():
-        processor = func if func else (lambda x: x)
-        hourly_data[name] = [
-            processor(hourly.Variables(idx).Values(i))
-            for i in range(length)
-        ]
+def _valid_timezone(tz_name):
+    """Название часового пояса, если оно известно zoneinfo (приходит из запроса), иначе None"""
 
-    local_time = datetime.now(tz=tz)
-    rounded_local = local_time.replace(minute=0, second=0, microsecond=0)
+    if not tz_name:
+        return None
 
-    grouped_by_day = defaultdict(list)
-    for i in range(length):
-        current_hour = datetime.fromtimestamp(start_time + i * interval, tz=tz)
-        current_date = current_hour.date()
+    try:
+        ZoneInfo(tz_name)
+    except (ValueError, KeyError, OSError):
+        return None
+    return tz_name
+
+
+def _city_values_dict(context):
+    """словарь с данными о найденном городе"""
+
+    city_values_dict = {
+        k: v
+        for k, v in context.items()
+        if k in HISTORY_FIELDS and (v is not None or k not in LOCATION_FIELDS)
+    }
 
-        # Фильтрация hourly_date таким образом,
-        # чтобы погода показывалась с местного времени города, в который сделали запрос
-        if current_hour < rounded_local:
-            continue
+    city_values_dict.update({'city': context['city_name']})
+    return city_values_dict
 
-        filtered_hourly_data = {}
-        for name in VARIABLES_HOURLY.keys():
-            filtered_hourly_data[name] = hourly_data[name][i]
 
-        filtered_hourly_data['time'] = current_hour.strftime('%Y-%m-%d %H:%M')
+def _fill_forecast_context(context, forecast):
+    tz_name = forecast.timezone
 
-        grouped_by_day[current_date].append(filtered_hourly_data)
-    context['hourly_by_day'] = dict(grouped_by_day)
+    # Создание объекта зоны
+    try:
+        tz = ZoneInfo(tz_name)
+    except Exception as e:
+        raise RuntimeError(f"Не удалось создать ZoneInfo для '{tz_name}': {e}")
 
-    return render(request, 'weather_search/search.html', context)
+    # Формирование current_weather в context
+    context["current_weather"] = build_current_weather(forecast)
+
+    # Формирование hourly_by_day в context: первые FORECAST_INLINE_DAYS дней,
+    # остальные подгружаются со страницы через forecast_day
+    inline_days = settings.FORECAST_INLINE_DAYS or None
+    context['hourly_by_day'] = build_hourly_by_day(forecast, tz, max_days=inline_days)
+    if inline_days:
+        context['lazy_days'] = forecast_local_days(forecast, tz)[inline_days:]
+        context['lazy_days_query'] = urlencode({
+            'latitude': context['latitude'],
+            'longitude': context['longitude'],
+            'forecast_days': context['forecast_days'],
+        })
+
+    # Open-Meteo недоступен - показывается последний полученный прогноз
+    if forecast.stale:
+        context['forecast_stale'] = True
+        fetched_at = datetime.fromtimestamp(forecast.fetched_at, tz)
+        context['forecast_fetched_at'] = fetched_at.strftime('%d.%m.%Y %H:%M')
@@ -1,4 +1,4 @@
-from .utils_basic import safe_round
+from .utils_basic import safe_round, round_array
 
 
 VARIABLES_CURRENT = {
@@ -10,13 +10,37 @@ VARIABLES_CURRENT = {
 }
 
 
+# Обработчики почасовых переменных применяются к массиву значений целиком
 VARIABLES_HOURLY = {
-    "temperature": (0, safe_round),
-    "apparent_temperature": (1, safe_round),
+    "temperature": (0, round_array),
+    "apparent_temperature": (1, round_array),
     "humidity": (2, None),
-    "rain": (3, safe_round),
+    "rain": (3, round_array),
     "is_day": (4, None),
-    "wind_speed": (5, safe_round),
+    "wind_speed": (5, round_array),
 }
 
+# Переменные, запрашиваемые у Open-Meteo (порядок соответствует индексам выше)
+FORECAST_CURRENT_PARAMS = [
+    "temperature_2m",
+    "apparent_temperature",
+    "relative_humidity_2m",
+    "rain",
+    "is_day",
+]
+
+
+FORECAST_HOURLY_PARAMS = [
+    "temperature_2m",
+    "apparent_temperature",
+    "relative_humidity_2m",
+    "rain",
+    "is_day",
+    "wind_speed_10m",
+]
+
 SEARCH_FIELDS = ['city', 'country', 'country_code', 'admin', 'forecast_days']
+
+# Координаты найденного города, сохраняются в истории вместе с SEARCH_FIELDS
+LOCATION_FIELDS = ['latitude', 'longitude', 'timezone']
+HISTORY_FIELDS = SEARCH_FIELDS + LOCATION_FIELDS